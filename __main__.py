@@ -1,5 +1,6 @@
 import pulumi
-from pulumi_aws import lambda_, apigateway, iam, dynamodb, cloudwatch
+from bundles import bundle_files
+from pulumi_aws import lambda_, apigateway, apigatewayv2, iam, dynamodb, cloudwatch, sqs, s3
 
 # Create a DynamoDB table for users
 users_table = dynamodb.Table('users-table',
@@ -16,9 +17,37 @@ messages_table = dynamodb.Table('messages-table',
     attributes=[{
         'name': 'messageId',
         'type': 'S',
+    }, {
+        'name': 'recipientId',
+        'type': 'S',
+    }, {
+        'name': 'inboxKey',
+        'type': 'S',
     }],
     hash_key='messageId',
-    billing_mode='PAY_PER_REQUEST'
+    # One row per recipient, so group fan-out rows sharing a messageId don't overwrite each other.
+    # Stacks from before this key existed get a new table on update; their messages are
+    # carried over with migrations/reimport_messages.py (see the README)
+    range_key='recipientId',
+    billing_mode='PAY_PER_REQUEST',
+    # Inbox index so /messages can Query one recipient instead of scanning the table
+    global_secondary_indexes=[{
+        'name': 'inbox-index',
+        'hash_key': 'recipientId',
+        # inboxKey is a time-ordered ID assigned when the row is written (the messageId,
+        # unless a queued fan-out wrote it later), so it sorts the inbox and serves as its
+        # cursor and watermark
+        'range_key': 'inboxKey',
+        'projection_type': 'ALL',
+    }],
+    # Rows are deleted once their expiresAt (set from messageRetentionDays) has passed;
+    # the stream hands deleted rows to the archiver
+    ttl={
+        'attribute_name': 'expiresAt',
+        'enabled': True,
+    },
+    stream_enabled=True,
+    stream_view_type='OLD_IMAGE'
 )
 
 # Create a DynamoDB table for groups
@@ -31,6 +60,210 @@ groups_table = dynamodb.Table('groups-table',
     billing_mode='PAY_PER_REQUEST'
 )
 
+# Create a DynamoDB table for group timelines: large groups store each message once here
+group_messages_table = dynamodb.Table('group-messages-table',
+    attributes=[{
+        'name': 'groupId',
+        'type': 'S',
+    }, {
+        'name': 'messageId',
+        'type': 'S',
+    }],
+    hash_key='groupId',
+    range_key='messageId',
+    billing_mode='PAY_PER_REQUEST',
+    ttl={
+        'attribute_name': 'expiresAt',
+        'enabled': True,
+    },
+    stream_enabled=True,
+    stream_view_type='OLD_IMAGE'
+)
+
+# Create a DynamoDB table for group memberships with each member's timeline read cursor
+memberships_table = dynamodb.Table('memberships-table',
+    attributes=[{
+        'name': 'userId',
+        'type': 'S',
+    }, {
+        'name': 'groupId',
+        'type': 'S',
+    }],
+    hash_key='userId',
+    range_key='groupId',
+    billing_mode='PAY_PER_REQUEST'
+)
+
+# Create a DynamoDB table for open WebSocket connections, one row per user and connection
+connections_table = dynamodb.Table('connections-table',
+    attributes=[{
+        'name': 'userId',
+        'type': 'S',
+    }, {
+        'name': 'connectionId',
+        'type': 'S',
+    }],
+    hash_key='userId',
+    range_key='connectionId',
+    billing_mode='PAY_PER_REQUEST',
+    # $disconnect only knows the connection ID
+    global_secondary_indexes=[{
+        'name': 'connection-index',
+        'hash_key': 'connectionId',
+        'projection_type': 'KEYS_ONLY',
+    }],
+    # Connections last two hours at most; rows missed by $disconnect expire on their own
+    ttl={
+        'attribute_name': 'expiresAt',
+        'enabled': True,
+    }
+)
+
+# Create a DynamoDB table for chat list summaries: one row per user and direct conversation,
+# plus one summary row per group
+conversations_table = dynamodb.Table('conversations-table',
+    attributes=[{
+        'name': 'userId',
+        'type': 'S',
+    }, {
+        'name': 'conversationKey',
+        'type': 'S',
+    }, {
+        'name': 'lastMessageId',
+        'type': 'S',
+    }],
+    hash_key='userId',
+    range_key='conversationKey',
+    billing_mode='PAY_PER_REQUEST',
+    # A user's conversations by recency; message IDs are time-ordered
+    local_secondary_indexes=[{
+        'name': 'recency-index',
+        'range_key': 'lastMessageId',
+        'projection_type': 'ALL',
+    }]
+)
+
+# Create a DynamoDB table for Idempotency-Key claims and the responses they replay
+idempotency_table = dynamodb.Table('idempotency-table',
+    attributes=[{
+        'name': 'idempotencyKey',
+        'type': 'S',
+    }],
+    hash_key='idempotencyKey',
+    billing_mode='PAY_PER_REQUEST',
+    # Keys are remembered for idempotencyTtlSeconds, then TTL deletes them
+    ttl={
+        'attribute_name': 'expiresAt',
+        'enabled': True,
+    }
+)
+
+# Groups with at least this many members use fan-out-on-read (0 disables it)
+config = pulumi.Config()
+fanout_on_read_min_members = config.get_int('fanoutOnReadMinMembers')
+if fanout_on_read_min_members is None:
+    fanout_on_read_min_members = 100
+
+# How long send_message trusts a cached block list before revalidating its blockVersion
+block_cache_ttl_seconds = config.get('blockCacheTtlSeconds') or '10'
+
+# How long send_group_message trusts a cached member set before revalidating its membershipVersion
+group_cache_ttl_seconds = config.get('groupCacheTtlSeconds') or '10'
+
+# Serve every route from one router function (lambda_function.handler) instead of one
+# function per route, so warm containers and provisioned concurrency are shared
+single_function = config.get_bool('singleFunction') or False
+# Overrides the router's profile's provisionedConcurrency when set
+router_provisioned_concurrency = config.get_int('routerProvisionedConcurrency')
+
+# Queue group fan-out (and what follows a bulk send) for the fanout worker instead of doing it before responding
+queued_fanout = config.get_bool('queuedFanout')
+if queued_fanout is None:
+    queued_fanout = True
+
+# Days a message stays in the hot tables before TTL moves it to the archive bucket (0 keeps it forever)
+message_retention_days = config.get('messageRetentionDays') or '30'
+
+# Concurrent BatchWriteItem calls per group fan-out, sharing the DynamoDB client's connection pool
+fanout_concurrency = config.get_int('fanoutConcurrency') or 8
+
+# Push new messages to recipients' WebSocket connections as they are stored (polling /messages still works)
+websocket_push = config.get_bool('websocketPush')
+if websocket_push is None:
+    websocket_push = True
+
+# Share of invocations whose full event is logged; instrumented handlers always write their
+# timing and capacity metrics, so keep this at 0 outside debugging
+event_log_sample_rate = config.get('eventLogSampleRate') or '0'
+
+# Smallest response body, in bytes, API Gateway compresses (-1 turns compression off)
+minimum_compression_size = config.get_int('minimumCompressionSize')
+if minimum_compression_size is None:
+    minimum_compression_size = 1024
+
+# Shards a hot inbox or group timeline is spread over once a write to it is throttled
+hot_key_shards = config.get('hotKeyShards') or '8'
+
+# How long a send's Idempotency-Key is remembered; retries within it get the original response
+idempotency_ttl_seconds = config.get('idempotencyTtlSeconds') or '86400'
+
+# Performance profiles for the Lambda functions below. Every function names a profile, and
+# a stack can retune a profile (or add one) with the functionProfiles config object and
+# move a function to another profile with routeProfiles, keyed by function name:
+#   pulumi config set --path 'functionProfiles.hot.memorySize' 2048
+#   pulumi config set --path 'routeProfiles.send-message-batch' hot
+# Memory also buys CPU (one full vCPU at 1769 MB), so the send and poll paths get the most.
+# runtime is the Lambda Python runtime; AWS stops accepting deprecated ones for new and
+# updated functions, so raising it here moves every function at once.
+# reservedConcurrency both guarantees and caps a function's concurrency (None leaves it in
+# the account's shared pool); provisionedConcurrency > 0 publishes a version behind a
+# '-live' alias and keeps that many environments initialized, and callers invoke the alias.
+# The worker's timeout must stay under a sixth of the fan-out queue's visibility timeout.
+default_function_profiles = {
+    'hot': {'runtime': 'python3.12', 'memorySize': 1024, 'architecture': 'arm64', 'timeout': 10, 'provisionedConcurrency': 0, 'reservedConcurrency': None},
+    'standard': {'runtime': 'python3.12', 'memorySize': 512, 'architecture': 'arm64', 'timeout': 10, 'provisionedConcurrency': 0, 'reservedConcurrency': None},
+    'bulk': {'runtime': 'python3.12', 'memorySize': 1024, 'architecture': 'arm64', 'timeout': 30, 'provisionedConcurrency': 0, 'reservedConcurrency': None},
+    'admin': {'runtime': 'python3.12', 'memorySize': 256, 'architecture': 'arm64', 'timeout': 10, 'provisionedConcurrency': 0, 'reservedConcurrency': None},
+    'worker': {'runtime': 'python3.12', 'memorySize': 1024, 'architecture': 'arm64', 'timeout': 60, 'provisionedConcurrency': 0, 'reservedConcurrency': None},
+}
+function_profiles = dict(default_function_profiles)
+for profile_name, overrides in (config.get_object('functionProfiles') or {}).items():
+    function_profiles[profile_name] = {**function_profiles.get(profile_name, default_function_profiles['standard']), **overrides}
+route_profiles = config.get_object('routeProfiles') or {}
+
+def function_profile(name, default):
+    profile_name = route_profiles.get(name, default)
+    if profile_name not in function_profiles:
+        raise ValueError(f"Function '{name}' uses unknown profile '{profile_name}'")
+    return function_profiles[profile_name]
+
+# Fan-out jobs that keep failing end up here after 5 receives
+fanout_dead_letter_queue = sqs.Queue('fanout-dead-letter-queue',
+    message_retention_seconds=1209600
+)
+
+# Create the queue of group fan-out jobs
+fanout_queue = sqs.Queue('fanout-queue',
+    # At least six times the worker timeout, so a job isn't redelivered while it is being written
+    visibility_timeout_seconds=360,
+    redrive_policy=fanout_dead_letter_queue.arn.apply(lambda arn: f'{{"deadLetterTargetArn": "{arn}", "maxReceiveCount": 5}}')
+)
+
+# Create the WebSocket API clients connect to for pushed messages: wss://.../dev?userId=<userId>
+websocket_api = apigatewayv2.Api('push-api',
+    protocol_type='WEBSOCKET',
+    route_selection_expression='$request.body.action'
+)
+
+websocket_stage = apigatewayv2.Stage('push-dev-stage',
+    api_id=websocket_api.id,
+    name='dev',
+    auto_deploy=True
+)
+
+# The send handlers post to connections through the stage's https:// connections endpoint
+websocket_endpoint = websocket_stage.invoke_url.apply(lambda url: 'https://' + url[len('wss://'):]) if websocket_push else ''
+
 # Create an IAM role for Lambda
 role = iam.Role('lambda-exec-role',
     assume_role_policy="""{
@@ -54,7 +287,7 @@ role_policy = iam.RolePolicyAttachment('lambda-role-policy',
 )
 
 # Create a policy to allow access to DynamoDB
-dynamodb_policy_document = pulumi.Output.all(users_table.arn, messages_table.arn, groups_table.arn).apply(lambda arns: f"""{{
+dynamodb_policy_document = pulumi.Output.all(users_table.arn, messages_table.arn, groups_table.arn, group_messages_table.arn, memberships_table.arn, connections_table.arn, idempotency_table.arn, conversations_table.arn).apply(lambda arns: f"""{{
     "Version": "2012-10-17",
     "Statement": [
         {{
@@ -64,6 +297,7 @@ dynamodb_policy_document = pulumi.Output.all(users_table.arn, messages_table.arn
                 "dynamodb:DeleteItem",
                 "dynamodb:UpdateItem",
                 "dynamodb:GetItem",
+                "dynamodb:BatchGetItem",
                 "dynamodb:Scan"  
             ],
             "Resource": "{arns[0]}"
@@ -74,9 +308,11 @@ dynamodb_policy_document = pulumi.Output.all(users_table.arn, messages_table.arn
                 "dynamodb:PutItem",
                 "dynamodb:UpdateItem",
                 "dynamodb:GetItem",
-                "dynamodb:Scan"  
+                "dynamodb:Scan",
+                "dynamodb:Query",
+                "dynamodb:BatchWriteItem"
             ],
-            "Resource": "{arns[1]}"
+            "Resource": ["{arns[1]}", "{arns[1]}/index/*"]
         }},
         {{
             "Effect": "Allow",
@@ -84,9 +320,57 @@ dynamodb_policy_document = pulumi.Output.all(users_table.arn, messages_table.arn
                 "dynamodb:PutItem",
                 "dynamodb:UpdateItem",
                 "dynamodb:GetItem",
+                "dynamodb:BatchGetItem",
                 "dynamodb:Scan"  
             ],
             "Resource": "{arns[2]}"
+        }},
+        {{
+            "Effect": "Allow",
+            "Action": [
+                "dynamodb:PutItem",
+                "dynamodb:Query"
+            ],
+            "Resource": "{arns[3]}"
+        }},
+        {{
+            "Effect": "Allow",
+            "Action": [
+                "dynamodb:PutItem",
+                "dynamodb:DeleteItem",
+                "dynamodb:UpdateItem",
+                "dynamodb:Query",
+                "dynamodb:BatchWriteItem"
+            ],
+            "Resource": "{arns[4]}"
+        }},
+        {{
+            "Effect": "Allow",
+            "Action": [
+                "dynamodb:PutItem",
+                "dynamodb:DeleteItem",
+                "dynamodb:Query"
+            ],
+            "Resource": ["{arns[5]}", "{arns[5]}/index/*"]
+        }},
+        {{
+            "Effect": "Allow",
+            "Action": [
+                "dynamodb:PutItem",
+                "dynamodb:UpdateItem",
+                "dynamodb:DeleteItem"
+            ],
+            "Resource": "{arns[6]}"
+        }},
+        {{
+            "Effect": "Allow",
+            "Action": [
+                "dynamodb:GetItem",
+                "dynamodb:UpdateItem",
+                "dynamodb:Query",
+                "dynamodb:BatchGetItem"
+            ],
+            "Resource": ["{arns[7]}", "{arns[7]}/index/*"]
         }}
     ]
 }}""")
@@ -101,83 +385,397 @@ dynamodb_policy_attachment = iam.RolePolicyAttachment('dynamodb-policy-attachmen
     policy_arn=dynamodb_policy.arn
 )
 
-# Create the user management Lambda function
-user_lambda_function = lambda_.Function('user-function',
-    runtime='python3.8',
-    role=role.arn,
-    handler='register_user.handler',
-    code=pulumi.AssetArchive({
-        '.': pulumi.FileArchive('./lambda')
-    }),
-    environment={
+# Create a policy to allow sending and draining fan-out jobs
+fanout_queue_policy = iam.Policy('fanout-queue-access-policy',
+    policy=fanout_queue.arn.apply(lambda arn: f"""{{
+    "Version": "2012-10-17",
+    "Statement": [
+        {{
+            "Effect": "Allow",
+            "Action": [
+                "sqs:SendMessage",
+                "sqs:ReceiveMessage",
+                "sqs:DeleteMessage",
+                "sqs:ChangeMessageVisibility",
+                "sqs:GetQueueAttributes"
+            ],
+            "Resource": "{arn}"
+        }}
+    ]
+}}""")
+)
+
+# Attach the queue policy to the role
+fanout_queue_policy_attachment = iam.RolePolicyAttachment('fanout-queue-policy-attachment',
+    role=role.name,
+    policy_arn=fanout_queue_policy.arn
+)
+
+# Create a policy to allow posting to WebSocket connections
+websocket_policy = iam.Policy('websocket-push-policy',
+    policy=websocket_api.execution_arn.apply(lambda arn: f"""{{
+    "Version": "2012-10-17",
+    "Statement": [
+        {{
+            "Effect": "Allow",
+            "Action": [
+                "execute-api:ManageConnections"
+            ],
+            "Resource": "{arn}/*"
+        }}
+    ]
+}}""")
+)
+
+# Attach the WebSocket policy to the role
+websocket_policy_attachment = iam.RolePolicyAttachment('websocket-push-policy-attachment',
+    role=role.name,
+    policy_arn=websocket_policy.arn
+)
+
+def create_function(name, handler, profile_name, variables, provisioned_concurrency=None, extra_modules=()):
+    # Returns (function, target): API Gateway and event sources invoke the target, which is
+    # the '-live' alias when the profile provisions concurrency and the function otherwise.
+    # The code is the handler's bundle, only the lambda/ modules it imports (see bundles.py);
+    # extra_modules adds modules it loads by name.
+    profile = function_profile(name, profile_name)
+    if provisioned_concurrency is None:
+        provisioned_concurrency = profile['provisionedConcurrency']
+    function = lambda_.Function(f'{name}-function',
+        runtime=profile['runtime'],
+        role=role.arn,
+        handler=handler,
+        code=pulumi.AssetArchive({
+            path: pulumi.FileAsset(source)
+            for path, source in bundle_files(handler.rsplit('.', 1)[0], *extra_modules).items()
+        }),
+        memory_size=profile['memorySize'],
+        architectures=[profile['architecture']],
+        timeout=profile['timeout'],
+        reserved_concurrent_executions=profile['reservedConcurrency'],
+        # Provisioned concurrency needs a published version behind an alias
+        publish=provisioned_concurrency > 0,
+        environment={
+            'variables': {**variables, 'EVENT_LOG_SAMPLE_RATE': event_log_sample_rate}
+        }
+    )
+    if provisioned_concurrency <= 0:
+        return function, function
+    alias = lambda_.Alias(f'{name}-live',
+        function_name=function.name,
+        function_version=function.version
+    )
+    lambda_.ProvisionedConcurrencyConfig(f'{name}-provisioned-concurrency',
+        function_name=function.name,
+        qualifier=alias.name,
+        provisioned_concurrent_executions=provisioned_concurrency
+    )
+    return function, alias
+
+def invoke_qualifier(function, target):
+    # Permissions for an alias target must name the alias
+    return None if target is function else target.name
+
+# The API's Lambda functions, keyed by name (the function is '<name>-function' and its
+# invoke permission '<name>-permission'). 'export' names the stack output for its ARN.
+api_functions = {
+    'user': {
+        'handler': 'register_user.handler',
+        'profile': 'admin',
+        'export': 'user_lambda_function_arn',
         'variables': {
             'USERS_TABLE_NAME': users_table.name
         }
-    }
-)
-
-# Create the send message Lambda function
-send_message_lambda = lambda_.Function('send-message-function',
-    runtime='python3.8',
-    role=role.arn,
-    handler='send_message.handler',
-    code=pulumi.AssetArchive({
-        '.': pulumi.FileArchive('./lambda')
-    }),
-    environment={
+    },
+    'send-message': {
+        'handler': 'send_message.handler',
+        'profile': 'hot',
+        'export': 'send_message_lambda_arn',
         'variables': {
             'MESSAGES_TABLE_NAME': messages_table.name,
-            'USERS_TABLE_NAME': users_table.name  # Added to check if the user is blocked
+            'USERS_TABLE_NAME': users_table.name,  # Added to check if the user is blocked
+            'BLOCK_CACHE_TTL_SECONDS': block_cache_ttl_seconds,
+            'MESSAGE_RETENTION_DAYS': message_retention_days,
+            'CONNECTIONS_TABLE_NAME': connections_table.name,
+            'WEBSOCKET_ENDPOINT': websocket_endpoint,
+            'HOT_KEY_SHARDS': hot_key_shards,
+            'IDEMPOTENCY_TABLE_NAME': idempotency_table.name,
+            'IDEMPOTENCY_TTL_SECONDS': idempotency_ttl_seconds,
+            'CONVERSATIONS_TABLE_NAME': conversations_table.name
         }
-    }
-)
-
-# Create the block user Lambda function
-block_user_lambda = lambda_.Function('block-user-function',
-    runtime='python3.8',
-    role=role.arn,
-    handler='block_user.handler',
-    code=pulumi.AssetArchive({
-        '.': pulumi.FileArchive('./lambda')
-    }),
-    environment={
+    },
+    'send-message-batch': {
+        'handler': 'send_message_batch.handler',
+        'profile': 'bulk',
+        'variables': {
+            'MESSAGES_TABLE_NAME': messages_table.name,
+            'USERS_TABLE_NAME': users_table.name,
+            'BLOCK_CACHE_TTL_SECONDS': block_cache_ttl_seconds,
+            'MESSAGE_RETENTION_DAYS': message_retention_days,
+            'FANOUT_QUEUE_URL': fanout_queue.url if queued_fanout else '',
+            'FANOUT_CONCURRENCY': str(fanout_concurrency),
+            'CONNECTIONS_TABLE_NAME': connections_table.name,
+            'WEBSOCKET_ENDPOINT': websocket_endpoint,
+            'IDEMPOTENCY_TABLE_NAME': idempotency_table.name,
+            'IDEMPOTENCY_TTL_SECONDS': idempotency_ttl_seconds,
+            'CONVERSATIONS_TABLE_NAME': conversations_table.name
+        }
+    },
+    'block-user': {
+        'handler': 'block_user.handler',
+        'profile': 'admin',
+        'export': 'block_user_lambda_arn',
         'variables': {
             'USERS_TABLE_NAME': users_table.name
         }
-    }
-)
-
-# Create the create group Lambda function
-create_group_lambda = lambda_.Function('create-group-function',
-    runtime='python3.8',
-    role=role.arn,
-    handler='create_group.handler',
-    code=pulumi.AssetArchive({
-        '.': pulumi.FileArchive('./lambda')
-    }),
-    environment={
+    },
+    'create-group': {
+        'handler': 'create_group.handler',
+        'profile': 'admin',
+        'export': 'create_group_lambda_arn',
         'variables': {
-            'GROUPS_TABLE_NAME': groups_table.name
+            'GROUPS_TABLE_NAME': groups_table.name,
+            'MEMBERSHIPS_TABLE_NAME': memberships_table.name
         }
-    }
-)
-
-# Create the send group message Lambda function
-send_group_message_lambda = lambda_.Function('send-group-message-function',
-    runtime='python3.8',
-    role=role.arn,
-    handler='send_group_message.handler',
-    code=pulumi.AssetArchive({
-        '.': pulumi.FileArchive('./lambda')
-    }),
-    environment={
+    },
+    'send-group-message': {
+        'handler': 'send_group_message.handler',
+        'profile': 'standard',
+        'export': 'send_group_message_lambda_arn',
+        'variables': {
+            'MESSAGES_TABLE_NAME': messages_table.name,
+            'GROUPS_TABLE_NAME': groups_table.name,
+            'GROUP_MESSAGES_TABLE_NAME': group_messages_table.name,
+            'FANOUT_ON_READ_MIN_MEMBERS': str(fanout_on_read_min_members),
+            'FANOUT_QUEUE_URL': fanout_queue.url if queued_fanout else '',
+            'FANOUT_CONCURRENCY': str(fanout_concurrency),
+            'GROUP_CACHE_TTL_SECONDS': group_cache_ttl_seconds,
+            'MESSAGE_RETENTION_DAYS': message_retention_days,
+            'CONNECTIONS_TABLE_NAME': connections_table.name,
+            'WEBSOCKET_ENDPOINT': websocket_endpoint,
+            'HOT_KEY_SHARDS': hot_key_shards,
+            'IDEMPOTENCY_TABLE_NAME': idempotency_table.name,
+            'IDEMPOTENCY_TTL_SECONDS': idempotency_ttl_seconds,
+            'CONVERSATIONS_TABLE_NAME': conversations_table.name
+        }
+    },
+    'add-user-to-group': {
+        'handler': 'add_user_to_group.handler',
+        'profile': 'admin',
+        'variables': {
+            'GROUPS_TABLE_NAME': groups_table.name,
+            'MEMBERSHIPS_TABLE_NAME': memberships_table.name
+        }
+    },
+    'remove-user-from-group': {
+        'handler': 'remove_user_from_group.handler',
+        'profile': 'admin',
+        'variables': {
+            'GROUPS_TABLE_NAME': groups_table.name,
+            'MEMBERSHIPS_TABLE_NAME': memberships_table.name
+        }
+    },
+    'check-messages': {
+        'handler': 'check_messages.handler',
+        'profile': 'hot',
         'variables': {
+            'USERS_TABLE_NAME': users_table.name,
             'MESSAGES_TABLE_NAME': messages_table.name,
+            'MESSAGES_INDEX_NAME': 'inbox-index',
+            'GROUP_MESSAGES_TABLE_NAME': group_messages_table.name,
+            'MEMBERSHIPS_TABLE_NAME': memberships_table.name,
+            'MESSAGE_RETENTION_DAYS': message_retention_days,
             'GROUPS_TABLE_NAME': groups_table.name
         }
-    }
+    },
+    'ack-messages': {
+        'handler': 'ack_messages.handler',
+        'profile': 'standard',
+        'variables': {
+            'USERS_TABLE_NAME': users_table.name,
+            'MESSAGES_TABLE_NAME': messages_table.name,
+            'MESSAGES_INDEX_NAME': 'inbox-index',
+            'MEMBERSHIPS_TABLE_NAME': memberships_table.name,
+            'GROUPS_TABLE_NAME': groups_table.name,
+            'GROUP_MESSAGES_TABLE_NAME': group_messages_table.name,
+            'CONVERSATIONS_TABLE_NAME': conversations_table.name
+        }
+    },
+    'unread-count': {
+        'handler': 'unread_count.handler',
+        'profile': 'standard',
+        'variables': {
+            'CONVERSATIONS_TABLE_NAME': conversations_table.name
+        }
+    },
+    'list-conversations': {
+        'handler': 'list_conversations.handler',
+        'profile': 'standard',
+        'variables': {
+            'CONVERSATIONS_TABLE_NAME': conversations_table.name,
+            'CONVERSATIONS_INDEX_NAME': 'recency-index',
+            'MEMBERSHIPS_TABLE_NAME': memberships_table.name
+        }
+    },
+    'ws-connect': {
+        'handler': 'ws_connect.handler',
+        'profile': 'standard',
+        'variables': {
+            'CONNECTIONS_TABLE_NAME': connections_table.name
+        }
+    },
+    'ws-disconnect': {
+        'handler': 'ws_disconnect.handler',
+        'profile': 'admin',
+        'variables': {
+            'CONNECTIONS_TABLE_NAME': connections_table.name,
+            'CONNECTION_INDEX_NAME': 'connection-index'
+        }
+    },
+}
+
+# In single-function mode every API function above resolves to the router, which takes the
+# hot profile (routeProfiles.api-router changes that) since it serves the hot routes too
+if single_function:
+    router_function, router_lambda = create_function('api-router', 'lambda_function.handler', 'hot', {
+        'USERS_TABLE_NAME': users_table.name,
+        'MESSAGES_TABLE_NAME': messages_table.name,
+        'MESSAGES_INDEX_NAME': 'inbox-index',
+        'GROUPS_TABLE_NAME': groups_table.name,
+        'GROUP_MESSAGES_TABLE_NAME': group_messages_table.name,
+        'MEMBERSHIPS_TABLE_NAME': memberships_table.name,
+        'FANOUT_ON_READ_MIN_MEMBERS': str(fanout_on_read_min_members),
+        'FANOUT_QUEUE_URL': fanout_queue.url if queued_fanout else '',
+        'FANOUT_CONCURRENCY': str(fanout_concurrency),
+        'MESSAGE_RETENTION_DAYS': message_retention_days,
+        'BLOCK_CACHE_TTL_SECONDS': block_cache_ttl_seconds,
+        'GROUP_CACHE_TTL_SECONDS': group_cache_ttl_seconds,
+        'CONNECTIONS_TABLE_NAME': connections_table.name,
+        'WEBSOCKET_ENDPOINT': websocket_endpoint,
+        'HOT_KEY_SHARDS': hot_key_shards,
+        'IDEMPOTENCY_TABLE_NAME': idempotency_table.name,
+        'IDEMPOTENCY_TTL_SECONDS': idempotency_ttl_seconds,
+        'CONVERSATIONS_TABLE_NAME': conversations_table.name
+    }, provisioned_concurrency=router_provisioned_concurrency,
+        extra_modules=[spec['handler'].rsplit('.', 1)[0] for spec in api_functions.values()])
+    functions = {name: router_function for name in api_functions}
+    function_targets = {name: router_lambda for name in api_functions}
+else:
+    functions = {}
+    function_targets = {}
+    for name, spec in api_functions.items():
+        functions[name], function_targets[name] = create_function(name, spec['handler'], spec['profile'], spec['variables'])
+
+# Create the fan-out worker that drains the queue and writes members' inbox rows
+fanout_worker_function, fanout_worker_lambda = create_function('fanout-worker', 'fanout_worker.handler', 'worker', {
+    'MESSAGES_TABLE_NAME': messages_table.name,
+    'FANOUT_CONCURRENCY': str(fanout_concurrency),
+    'CONNECTIONS_TABLE_NAME': connections_table.name,
+    'WEBSOCKET_ENDPOINT': websocket_endpoint,
+    'CONVERSATIONS_TABLE_NAME': conversations_table.name,
+    'IDEMPOTENCY_TABLE_NAME': idempotency_table.name,
+    'IDEMPOTENCY_TTL_SECONDS': idempotency_ttl_seconds
+})
+
+# Deliver queued jobs to the worker in batches; failed jobs are retried on their own
+fanout_worker_event_source = lambda_.EventSourceMapping('fanout-worker-event-source',
+    event_source_arn=fanout_queue.arn,
+    function_name=fanout_worker_lambda.arn,
+    batch_size=10,
+    maximum_batching_window_in_seconds=1,
+    function_response_types=['ReportBatchItemFailures'],
+    opts=pulumi.ResourceOptions(depends_on=[fanout_queue_policy_attachment])
+)
+
+# Create the bucket for archived messages; objects move to a colder storage class after 30 days
+archive_bucket = s3.Bucket('message-archive-bucket',
+    lifecycle_rules=[{
+        'enabled': True,
+        'transitions': [{
+            'days': 30,
+            'storage_class': 'GLACIER_IR',
+        }],
+    }]
+)
+
+# Create a policy to allow reading the message streams and writing archive objects
+archive_policy = iam.Policy('message-archive-policy',
+    policy=pulumi.Output.all(messages_table.stream_arn, group_messages_table.stream_arn, archive_bucket.arn).apply(lambda arns: f"""{{
+    "Version": "2012-10-17",
+    "Statement": [
+        {{
+            "Effect": "Allow",
+            "Action": [
+                "dynamodb:DescribeStream",
+                "dynamodb:GetRecords",
+                "dynamodb:GetShardIterator",
+                "dynamodb:ListStreams"
+            ],
+            "Resource": ["{arns[0]}", "{arns[1]}"]
+        }},
+        {{
+            "Effect": "Allow",
+            "Action": [
+                "s3:PutObject"
+            ],
+            "Resource": "{arns[2]}/*"
+        }}
+    ]
+}}""")
 )
 
+# Attach the archive policy to the role
+archive_policy_attachment = iam.RolePolicyAttachment('message-archive-policy-attachment',
+    role=role.name,
+    policy_arn=archive_policy.arn
+)
+
+# Create the archiver that writes deleted message rows to the archive bucket
+archive_messages_function, archive_messages_lambda = create_function('archive-messages', 'archive_messages.handler', 'worker', {
+    'ARCHIVE_BUCKET': archive_bucket.bucket,
+    'ARCHIVE_PREFIX': 'messages'
+})
+
+# Feed both message streams to the archiver, REMOVE events only, in large batches so
+# each archive object holds many rows
+for name, table in (('messages', messages_table), ('group-messages', group_messages_table)):
+    lambda_.EventSourceMapping(f'archive-{name}-event-source',
+        event_source_arn=table.stream_arn,
+        function_name=archive_messages_lambda.arn,
+        starting_position='TRIM_HORIZON',
+        batch_size=1000,
+        maximum_batching_window_in_seconds=60,
+        bisect_batch_on_function_error=True,
+        maximum_retry_attempts=10,
+        filter_criteria={
+            'filters': [{
+                'pattern': '{"eventName": ["REMOVE"]}',
+            }],
+        },
+        opts=pulumi.ResourceOptions(depends_on=[archive_policy_attachment])
+    )
+
+# Route $connect and $disconnect to their functions; clients never send anything else
+for route_key, name in (('$connect', 'connect'), ('$disconnect', 'disconnect')):
+    function, target = functions[f'ws-{name}'], function_targets[f'ws-{name}']
+    integration = apigatewayv2.Integration(f'push-{name}-integration',
+        api_id=websocket_api.id,
+        integration_type='AWS_PROXY',
+        integration_uri=target.invoke_arn
+    )
+    apigatewayv2.Route(f'push-{name}-route',
+        api_id=websocket_api.id,
+        route_key=route_key,
+        target=integration.id.apply(lambda id: f'integrations/{id}')
+    )
+    lambda_.Permission(f'push-{name}-permission',
+        action='lambda:InvokeFunction',
+        function=function.name,
+        qualifier=invoke_qualifier(function, target),
+        principal='apigateway.amazonaws.com',
+        source_arn=websocket_api.execution_arn.apply(lambda arn: f"{arn}/*/*")
+    )
+
 # Create a CloudWatch log group
 log_group = cloudwatch.LogGroup('api-gateway-log-group',
     retention_in_days=7
@@ -206,378 +804,91 @@ cloudwatch_logs_policy_attachment = iam.RolePolicyAttachment('cloudwatch-logs-po
 
 # Create an API Gateway
 api = apigateway.RestApi('user-api',
-    description='API for User Management Lambda'
+    description='API for User Management Lambda',
+    # Gzip responses of at least this many bytes for clients that send Accept-Encoding: gzip
+    minimum_compression_size=str(minimum_compression_size)
 )
 
 # Ensure the API is created before creating the resource by applying the ID
 api_root_resource_id = api.root_resource_id.apply(lambda id: id)
 
-# Create the /register resource
-register_resource = apigateway.Resource('register-resource',
-    rest_api=api.id,
-    parent_id=api_root_resource_id,
-    path_part='register',
-    opts=pulumi.ResourceOptions(depends_on=[api])
-)
-
-# Define a POST method on the /register resource
-register_method_post = apigateway.Method('register-method-post',
-    rest_api=api.id,
-    resource_id=register_resource.id,
-    http_method='POST',
-    authorization='NONE',
-    opts=pulumi.ResourceOptions(depends_on=[register_resource])
-)
-
-# Set up the Lambda integration for the POST method
-register_integration_post = apigateway.Integration('register-integration-post',
-    rest_api=api.id,
-    resource_id=register_resource.id,
-    http_method=register_method_post.http_method,
-    integration_http_method='POST',
-    type='AWS_PROXY',
-    uri=user_lambda_function.invoke_arn,
-    opts=pulumi.ResourceOptions(depends_on=[register_method_post])
-)
-
-# Define a DELETE method on the /register resource
-register_method_delete = apigateway.Method('register-method-delete',
-    rest_api=api.id,
-    resource_id=register_resource.id,
-    http_method='DELETE',
-    authorization='NONE',
-    opts=pulumi.ResourceOptions(depends_on=[register_resource])
-)
-
-# Set up the Lambda integration for the DELETE method
-register_integration_delete = apigateway.Integration('register-integration-delete',
-    rest_api=api.id,
-    resource_id=register_resource.id,
-    http_method=register_method_delete.http_method,
-    integration_http_method='POST',
-    type='AWS_PROXY',
-    uri=user_lambda_function.invoke_arn,
-    opts=pulumi.ResourceOptions(depends_on=[register_method_delete])
-)
-
-# Create the /message resource
-message_resource = apigateway.Resource('message-resource',
-    rest_api=api.id,
-    parent_id=api_root_resource_id,
-    path_part='message',
-    opts=pulumi.ResourceOptions(depends_on=[api])
-)
-
-# Define a POST method on the /message resource
-message_method_post = apigateway.Method('message-method-post',
-    rest_api=api.id,
-    resource_id=message_resource.id,
-    http_method='POST',
-    authorization='NONE',
-    opts=pulumi.ResourceOptions(depends_on=[message_resource])
-)
-
-# Set up the Lambda integration for the POST method on /message
-message_integration_post = apigateway.Integration('message-integration-post',
-    rest_api=api.id,
-    resource_id=message_resource.id,
-    http_method=message_method_post.http_method,
-    integration_http_method='POST',
-    type='AWS_PROXY',
-    uri=send_message_lambda.invoke_arn,
-    opts=pulumi.ResourceOptions(depends_on=[message_method_post])
-)
-
-# Create the /block resource
-block_resource = apigateway.Resource('block-resource',
-    rest_api=api.id,
-    parent_id=api_root_resource_id,
-    path_part='block',
-    opts=pulumi.ResourceOptions(depends_on=[api])
-)
-
-# Define a POST method on the /block resource
-block_method_post = apigateway.Method('block-method-post',
-    rest_api=api.id,
-    resource_id=block_resource.id,
-    http_method='POST',
-    authorization='NONE',
-    opts=pulumi.ResourceOptions(depends_on=[block_resource])
-)
-
-# Set up the Lambda integration for the POST method on /block
-block_integration_post = apigateway.Integration('block-integration-post',
-    rest_api=api.id,
-    resource_id=block_resource.id,
-    http_method=block_method_post.http_method,
-    integration_http_method='POST',
-    type='AWS_PROXY',
-    uri=block_user_lambda.invoke_arn,
-    opts=pulumi.ResourceOptions(depends_on=[block_method_post])
-)
-
-# Create the /group resource
-group_resource = apigateway.Resource('group-resource',
-    rest_api=api.id,
-    parent_id=api_root_resource_id,
-    path_part='group',
-    opts=pulumi.ResourceOptions(depends_on=[api])
-)
-
-# Define a POST method on the /group resource
-group_method_post = apigateway.Method('group-method-post',
-    rest_api=api.id,
-    resource_id=group_resource.id,
-    http_method='POST',
-    authorization='NONE',
-    opts=pulumi.ResourceOptions(depends_on=[group_resource])
-)
-
-# Set up the Lambda integration for the POST method on /group
-group_integration_post = apigateway.Integration('group-integration-post',
-    rest_api=api.id,
-    resource_id=group_resource.id,
-    http_method=group_method_post.http_method,
-    integration_http_method='POST',
-    type='AWS_PROXY',
-    uri=create_group_lambda.invoke_arn,
-    opts=pulumi.ResourceOptions(depends_on=[group_method_post])
-)
-
-# Create the /group/message resource
-group_message_resource = apigateway.Resource('group-message-resource',
-    rest_api=api.id,
-    parent_id=group_resource.id,
-    path_part='message',
-    opts=pulumi.ResourceOptions(depends_on=[group_resource])
-)
-
-# Define a POST method on the /group/message resource
-group_message_method_post = apigateway.Method('group-message-method-post',
-    rest_api=api.id,
-    resource_id=group_message_resource.id,
-    http_method='POST',
-    authorization='NONE',
-    opts=pulumi.ResourceOptions(depends_on=[group_message_resource])
-)
-
-# Set up the Lambda integration for the POST method on /group/message
-group_message_integration_post = apigateway.Integration('group-message-integration-post',
-    rest_api=api.id,
-    resource_id=group_message_resource.id,
-    http_method=group_message_method_post.http_method,
-    integration_http_method='POST',
-    type='AWS_PROXY',
-    uri=send_group_message_lambda.invoke_arn,
-    opts=pulumi.ResourceOptions(depends_on=[group_message_method_post])
-)
-# Create the add user to group Lambda function
-add_user_to_group_lambda = lambda_.Function('add-user-to-group-function',
-    runtime='python3.8',
-    role=role.arn,
-    handler='add_user_to_group.handler',
-    code=pulumi.AssetArchive({
-        '.': pulumi.FileArchive('./lambda')
-    }),
-    environment={
-        'variables': {
-            'GROUPS_TABLE_NAME': groups_table.name
-        }
-    }
-)
-
-# Create the /group/add-user resource
-add_user_resource = apigateway.Resource('add-user-resource',
-    rest_api=api.id,
-    parent_id=group_resource.id,
-    path_part='add-user',
-    opts=pulumi.ResourceOptions(depends_on=[group_resource])
-)
-
-# Define a POST method on the /group/add-user resource
-add_user_method_post = apigateway.Method('add-user-method-post',
-    rest_api=api.id,
-    resource_id=add_user_resource.id,
-    http_method='POST',
-    authorization='NONE',
-    opts=pulumi.ResourceOptions(depends_on=[add_user_resource])
-)
-
-# Set up the Lambda integration for the POST method on /group/add-user
-add_user_integration_post = apigateway.Integration('add-user-integration-post',
-    rest_api=api.id,
-    resource_id=add_user_resource.id,
-    http_method=add_user_method_post.http_method,
-    integration_http_method='POST',
-    type='AWS_PROXY',
-    uri=add_user_to_group_lambda.invoke_arn,
-    opts=pulumi.ResourceOptions(depends_on=[add_user_method_post])
-)
-# Create the remove user from group Lambda function
-remove_user_from_group_lambda = lambda_.Function('remove-user-from-group-function',
-    runtime='python3.8',
-    role=role.arn,
-    handler='remove_user_from_group.handler',
-    code=pulumi.AssetArchive({
-        '.': pulumi.FileArchive('./lambda')
-    }),
-    environment={
-        'variables': {
-            'GROUPS_TABLE_NAME': groups_table.name
-        }
-    }
-)
-
-# Create the /group/remove-user resource
-remove_user_resource = apigateway.Resource('remove-user-resource',
-    rest_api=api.id,
-    parent_id=group_resource.id,
-    path_part='remove-user',
-    opts=pulumi.ResourceOptions(depends_on=[group_resource])
-)
-
-# Define a POST method on the /group/remove-user resource
-remove_user_method_post = apigateway.Method('remove-user-method-post',
-    rest_api=api.id,
-    resource_id=remove_user_resource.id,
-    http_method='POST',
-    authorization='NONE',
-    opts=pulumi.ResourceOptions(depends_on=[remove_user_resource])
-)
-
-# Set up the Lambda integration for the POST method on /group/remove-user
-remove_user_integration_post = apigateway.Integration('remove-user-integration-post',
-    rest_api=api.id,
-    resource_id=remove_user_resource.id,
-    http_method=remove_user_method_post.http_method,
-    integration_http_method='POST',
-    type='AWS_PROXY',
-    uri=remove_user_from_group_lambda.invoke_arn,
-    opts=pulumi.ResourceOptions(depends_on=[remove_user_method_post])
-)
-
-# Create the check messages Lambda function
-check_messages_lambda = lambda_.Function('check-messages-function',
-    runtime='python3.8',
-    role=role.arn,
-    handler='check_messages.handler',
-    code=pulumi.AssetArchive({
-        '.': pulumi.FileArchive('./lambda')
-    }),
-    environment={
-        'variables': {
-            'MESSAGES_TABLE_NAME': messages_table.name
-        }
-    }
-)
-
-# Create the /messages resource
-messages_resource = apigateway.Resource('messages-resource',
-    rest_api=api.id,
-    parent_id=api_root_resource_id,
-    path_part='messages',
-    opts=pulumi.ResourceOptions(depends_on=[api])
-)
-
-# Define a POST method on the /messages resource
-messages_method_post = apigateway.Method('messages-method-post',
-    rest_api=api.id,
-    resource_id=messages_resource.id,
-    http_method='POST',
-    authorization='NONE',
-    opts=pulumi.ResourceOptions(depends_on=[messages_resource])
-)
-
-# Set up the Lambda integration for the POST method on /messages
-messages_integration_post = apigateway.Integration('messages-integration-post',
-    rest_api=api.id,
-    resource_id=messages_resource.id,
-    http_method=messages_method_post.http_method,
-    integration_http_method='POST',
-    type='AWS_PROXY',
-    uri=check_messages_lambda.invoke_arn,
-    opts=pulumi.ResourceOptions(depends_on=[messages_method_post])
-)
-
-# Add permission for API Gateway to invoke the check messages Lambda function
-check_messages_lambda_permission = lambda_.Permission('check-messages-permission',
-    action='lambda:InvokeFunction',
-    function=check_messages_lambda.name,
-    principal='apigateway.amazonaws.com',
-    source_arn=api.execution_arn.apply(lambda arn: f"{arn}/*/*/*")
-)
-
-# Add permission for API Gateway to invoke the remove user from group Lambda function
-remove_user_from_group_lambda_permission = lambda_.Permission('remove-user-from-group-permission',
-    action='lambda:InvokeFunction',
-    function=remove_user_from_group_lambda.name,
-    principal='apigateway.amazonaws.com',
-    source_arn=api.execution_arn.apply(lambda arn: f"{arn}/*/*/*")
-)
-
-# Add permission for API Gateway to invoke the add user to group Lambda function
-add_user_to_group_lambda_permission = lambda_.Permission('add-user-to-group-permission',
-    action='lambda:InvokeFunction',
-    function=add_user_to_group_lambda.name,
-    principal='apigateway.amazonaws.com',
-    source_arn=api.execution_arn.apply(lambda arn: f"{arn}/*/*/*")
-)
-
-# Add permission for API Gateway to invoke the user Lambda function
-user_lambda_permission = lambda_.Permission('user-permission',
-    action='lambda:InvokeFunction',
-    function=user_lambda_function.name,
-    principal='apigateway.amazonaws.com',
-    source_arn=api.execution_arn.apply(lambda arn: f"{arn}/*/*/*")
-)
-
-# Add permission for API Gateway to invoke the send message Lambda function
-send_message_lambda_permission = lambda_.Permission('send-message-permission',
-    action='lambda:InvokeFunction',
-    function=send_message_lambda.name,
-    principal='apigateway.amazonaws.com',
-    source_arn=api.execution_arn.apply(lambda arn: f"{arn}/*/*/*")
-)
-
-# Add permission for API Gateway to invoke the block user Lambda function
-block_user_lambda_permission = lambda_.Permission('block-user-permission',
-    action='lambda:InvokeFunction',
-    function=block_user_lambda.name,
-    principal='apigateway.amazonaws.com',
-    source_arn=api.execution_arn.apply(lambda arn: f"{arn}/*/*/*")
-)
-
-# Add permission for API Gateway to invoke the create group Lambda function
-create_group_lambda_permission = lambda_.Permission('create-group-permission',
-    action='lambda:InvokeFunction',
-    function=create_group_lambda.name,
-    principal='apigateway.amazonaws.com',
-    source_arn=api.execution_arn.apply(lambda arn: f"{arn}/*/*/*")
-)
-
-# Add permission for API Gateway to invoke the send group message Lambda function
-send_group_message_lambda_permission = lambda_.Permission('send-group-message-permission',
-    action='lambda:InvokeFunction',
-    function=send_group_message_lambda.name,
-    principal='apigateway.amazonaws.com',
-    source_arn=api.execution_arn.apply(lambda arn: f"{arn}/*/*/*")
-)
+# The API's routes, parents before children. 'name' prefixes the route's resource, method
+# and integration names, 'function' is the entry in api_functions that serves it, and
+# 'export' names the stack output for its URL.
+api_routes = [
+    {'path': 'register', 'name': 'register', 'methods': ['POST', 'DELETE'], 'function': 'user', 'export': 'register_url'},
+    {'path': 'message', 'name': 'message', 'function': 'send-message', 'export': 'message_url'},
+    {'path': 'message/batch', 'name': 'message-batch', 'function': 'send-message-batch', 'export': 'message_batch_url'},
+    {'path': 'block', 'name': 'block', 'function': 'block-user', 'export': 'block_url'},
+    {'path': 'group', 'name': 'group', 'function': 'create-group', 'export': 'group_url'},
+    {'path': 'group/message', 'name': 'group-message', 'function': 'send-group-message', 'export': 'group_message_url'},
+    {'path': 'group/add-user', 'name': 'add-user', 'function': 'add-user-to-group', 'export': 'add_user_to_group_url'},
+    {'path': 'group/remove-user', 'name': 'remove-user', 'function': 'remove-user-from-group', 'export': 'remove_user_from_group_url'},
+    {'path': 'messages', 'name': 'messages', 'function': 'check-messages', 'export': 'check_messages_url'},
+    {'path': 'messages/ack', 'name': 'messages-ack', 'function': 'ack-messages', 'export': 'ack_messages_url'},
+    {'path': 'messages/unread-count', 'name': 'messages-unread-count', 'function': 'unread-count', 'export': 'unread_count_url'},
+    {'path': 'conversations', 'name': 'conversations', 'function': 'list-conversations', 'export': 'conversations_url'},
+]
+
+# Create each route's resource, methods and Lambda proxy integrations
+api_resources = {}
+api_integrations = []
+for route in api_routes:
+    parent_path, _, path_part = route['path'].rpartition('/')
+    parent = api_resources[parent_path] if parent_path else None
+    resource = apigateway.Resource(f"{route['name']}-resource",
+        rest_api=api.id,
+        parent_id=parent.id if parent else api_root_resource_id,
+        path_part=path_part,
+        opts=pulumi.ResourceOptions(depends_on=[parent or api])
+    )
+    api_resources[route['path']] = resource
+    for http_method in route.get('methods', ['POST']):
+        method = apigateway.Method(f"{route['name']}-method-{http_method.lower()}",
+            rest_api=api.id,
+            resource_id=resource.id,
+            http_method=http_method,
+            authorization='NONE',
+            opts=pulumi.ResourceOptions(depends_on=[resource])
+        )
+        api_integrations.append(apigateway.Integration(f"{route['name']}-integration-{http_method.lower()}",
+            rest_api=api.id,
+            resource_id=resource.id,
+            http_method=method.http_method,
+            integration_http_method='POST',
+            type='AWS_PROXY',
+            uri=function_targets[route['function']].invoke_arn,
+            opts=pulumi.ResourceOptions(depends_on=[method])
+        ))
+
+# Add permission for API Gateway to invoke the API's functions: the router on any route in
+# single-function mode, otherwise each function on its own
+if single_function:
+    router_permission = lambda_.Permission('api-router-permission',
+        action='lambda:InvokeFunction',
+        function=router_function.name,
+        qualifier=invoke_qualifier(router_function, router_lambda),
+        principal='apigateway.amazonaws.com',
+        source_arn=api.execution_arn.apply(lambda arn: f"{arn}/*/*/*")
+    )
+    api_permissions = [router_permission]
+else:
+    api_permissions = [
+        lambda_.Permission(f'{name}-permission',
+            action='lambda:InvokeFunction',
+            function=functions[name].name,
+            qualifier=invoke_qualifier(functions[name], function_targets[name]),
+            principal='apigateway.amazonaws.com',
+            source_arn=api.execution_arn.apply(lambda arn: f"{arn}/*/*/*")
+        )
+        for name in dict.fromkeys(route['function'] for route in api_routes)
+    ]
 
-# Update the deployment to include the new endpoints
+# Update the deployment to include every route
 deployment = apigateway.Deployment('user-deployment',
     rest_api=api.id,
     stage_name='dev',
-    opts=pulumi.ResourceOptions(depends_on=[
-        register_integration_post, register_integration_delete,
-        message_integration_post, block_integration_post,
-        group_integration_post, group_message_integration_post,
-        add_user_integration_post, remove_user_integration_post,
-        messages_integration_post,  # Add this line
-        user_lambda_permission, send_message_lambda_permission,
-        block_user_lambda_permission, create_group_lambda_permission,
-        send_group_message_lambda_permission, add_user_to_group_lambda_permission,
-        remove_user_from_group_lambda_permission, check_messages_lambda_permission  # Add this line
-    ])
+    opts=pulumi.ResourceOptions(depends_on=api_integrations + api_permissions)
 )
 
 # Enable CloudWatch Logs for the API Gateway stage
@@ -598,19 +909,19 @@ api_stage = apigateway.Stage('dev-stage',
 
 # Export the URLs of the API Gateway
 pulumi.export('role_arn', role.arn)
-pulumi.export('user_lambda_function_arn', user_lambda_function.arn)
-pulumi.export('send_message_lambda_arn', send_message_lambda.arn)
-pulumi.export('block_user_lambda_arn', block_user_lambda.arn)
-pulumi.export('create_group_lambda_arn', create_group_lambda.arn)
-pulumi.export('send_group_message_lambda_arn', send_group_message_lambda.arn)
-pulumi.export('register_url', deployment.invoke_url.apply(lambda invoke_url: f"{invoke_url}/register"))
-pulumi.export('message_url', deployment.invoke_url.apply(lambda invoke_url: f"{invoke_url}/message"))
-pulumi.export('block_url', deployment.invoke_url.apply(lambda invoke_url: f"{invoke_url}/block"))
-pulumi.export('group_url', deployment.invoke_url.apply(lambda invoke_url: f"{invoke_url}/group"))
-pulumi.export('group_message_url', deployment.invoke_url.apply(lambda invoke_url: f"{invoke_url}/group/message"))
+for name, spec in api_functions.items():
+    if 'export' in spec:
+        pulumi.export(spec['export'], function_targets[name].arn)
+for route in api_routes:
+    pulumi.export(route['export'], deployment.invoke_url.apply(lambda invoke_url, path=route['path']: f"{invoke_url}/{path}"))
 pulumi.export('users_table_name', users_table.name)
 pulumi.export('messages_table_name', messages_table.name)
 pulumi.export('groups_table_name', groups_table.name)
-pulumi.export('add_user_to_group_url', deployment.invoke_url.apply(lambda invoke_url: f"{invoke_url}/group/add-user"))
-pulumi.export('remove_user_from_group_url', deployment.invoke_url.apply(lambda invoke_url: f"{invoke_url}/group/remove-user"))
-pulumi.export('check_messages_url', deployment.invoke_url.apply(lambda invoke_url: f"{invoke_url}/messages"))  # Add this line
+pulumi.export('group_messages_table_name', group_messages_table.name)
+pulumi.export('memberships_table_name', memberships_table.name)
+pulumi.export('connections_table_name', connections_table.name)
+pulumi.export('idempotency_table_name', idempotency_table.name)
+pulumi.export('conversations_table_name', conversations_table.name)
+pulumi.export('websocket_url', websocket_stage.invoke_url)
+pulumi.export('fanout_queue_url', fanout_queue.url)
+pulumi.export('archive_bucket_name', archive_bucket.bucket)
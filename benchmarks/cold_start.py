@@ -0,0 +1,163 @@
+"""Cold-start init time and code size per handler: whole lambda/ vs its bundle.
+
+Every function used to ship all of lambda/; __main__.py now ships each handler's
+import closure (bundles.py). For every handler this copies both layouts to fresh
+directories and imports the handler in a new interpreter --runs times, the way a
+Lambda init does: sources only (the task directory is read-only, so nothing is
+cached as bytecode and every module is compiled on import), with the modules the
+runtime's bootstrap has already loaded imported first and left out of the timing.
+It reports the median init time, modules loaded and the zipped code size of each
+layout. boto3 is imported on a handler's first request, not at init, so it is in
+neither column.
+
+The "before" column is the whole lambda/ of --baseline-ref, checked out into a
+temporary git worktree. It defaults to BEFORE_BUNDLES, the last commit before
+handlers were bundled and their imports made lazy, so the report shows both
+changes however far the tree has moved on since. Any later import changes are
+in the comparison as well. To see the effect of bundling alone, pass
+--baseline-ref HEAD: both columns are then the same code. --baseline-dir uses an
+existing lambda/ directory instead.
+Run from the repo root:
+
+    python benchmarks/cold_start.py --runs 15
+    python benchmarks/cold_start.py --runs 15 --baseline-ref HEAD
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import zipfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from bundles import bundle_files  # noqa: E402
+from local.stack import TABLES  # noqa: E402
+
+# The commit before per-handler bundles and lazy imports ("Declare API routes in one
+# table with per-function performance profiles")
+BEFORE_BUNDLES = '90355e949c6768a158ec472cfeea00906a8ef69e'
+
+HANDLERS = (
+    'register_user', 'send_message', 'send_message_batch', 'block_user', 'create_group',
+    'send_group_message', 'add_user_to_group', 'remove_user_from_group', 'check_messages',
+    'ack_messages', 'unread_count', 'list_conversations', 'ws_connect', 'ws_disconnect',
+    'fanout_worker', 'archive_messages', 'lambda_function',
+)
+
+# Already imported by the Python runtime's bootstrap when it loads the handler module
+RUNTIME_MODULES = ('json', 'logging', 'decimal', 'traceback', 'importlib')
+
+CHILD = """
+import importlib, json, sys, time
+for name in {runtime!r}:
+    importlib.import_module(name)
+before = len(sys.modules)
+sys.path.insert(0, {directory!r})
+start = time.perf_counter()
+importlib.import_module({handler!r})
+print(json.dumps({{'ms': (time.perf_counter() - start) * 1000, 'modules': len(sys.modules) - before}}))
+"""
+
+
+def environment():
+    env = dict(os.environ)
+    env.update({variable: definition['name'] for variable, definition in TABLES.items()})
+    env['ARCHIVE_BUCKET'] = 'message-archive-bucket'
+    return env
+
+
+@contextlib.contextmanager
+def baseline_lambda_dir(ref):
+    # lambda/ of ref, from a throwaway worktree that is removed afterwards
+    directory = tempfile.mkdtemp(prefix='cold-start-baseline-')
+    os.rmdir(directory)
+    subprocess.run(['git', '-C', ROOT, 'worktree', 'add', '--detach', directory, ref],
+                   capture_output=True, text=True, check=True)
+    try:
+        yield os.path.join(directory, 'lambda')
+    finally:
+        subprocess.run(['git', '-C', ROOT, 'worktree', 'remove', '--force', directory],
+                       capture_output=True, check=True)
+
+
+def full_files(lambda_dir):
+    # What pulumi.FileArchive('./lambda') shipped, less any local __pycache__
+    return {name: os.path.join(lambda_dir, name) for name in sorted(os.listdir(lambda_dir))
+            if os.path.isfile(os.path.join(lambda_dir, name))}
+
+
+def zipped_size(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, path in files.items():
+            archive.write(path, name)
+    return len(buffer.getvalue())
+
+
+def measure(files, handler, runs, env):
+    # Median init ms and modules loaded over runs fresh interpreters and directories
+    samples = []
+    modules = 0
+    for _ in range(runs):
+        directory = tempfile.mkdtemp(prefix='cold-start-')
+        try:
+            for name, path in files.items():
+                shutil.copyfile(path, os.path.join(directory, name))
+            child = CHILD.format(runtime=RUNTIME_MODULES, directory=directory, handler=handler)
+            # -I keeps the user's site-packages and PYTHONPATH out, -B writes no bytecode
+            result = subprocess.run([sys.executable, '-I', '-B', '-c', child], env=env,
+                                    capture_output=True, text=True, check=True)
+        finally:
+            shutil.rmtree(directory)
+        sample = json.loads(result.stdout.strip().splitlines()[-1])
+        samples.append(sample['ms'])
+        modules = sample['modules']
+    return statistics.median(samples), modules
+
+
+def run(args, baseline_dir, label):
+    env = environment()
+    baseline = full_files(baseline_dir)
+    baseline_kb = zipped_size(baseline) / 1024
+    python = '.'.join(map(str, sys.version_info[:3]))
+    print(f"runs={args.runs} python={python} baseline={label}")
+    print(f"{'handler':<24} {'files':>11} {'zip KB':>13} {'init ms':>15} {'modules':>11} {'init saved':>10}")
+    totals = [0.0, 0.0]
+    for handler in args.handlers:
+        bundle = bundle_files(handler)
+        full_ms, full_modules = measure(baseline, handler, args.runs, env)
+        bundle_ms, bundle_modules = measure(bundle, handler, args.runs, env)
+        totals[0] += full_ms
+        totals[1] += bundle_ms
+        print(f"{handler:<24} {len(baseline):>4} -> {len(bundle):>3} {baseline_kb:>6.1f} -> {zipped_size(bundle) / 1024:>4.1f} "
+              f"{full_ms:>6.2f} -> {bundle_ms:>5.2f} {full_modules:>4} -> {bundle_modules:>3} "
+              f"{(full_ms - bundle_ms) / full_ms:>10.0%}")
+    print(f"{'total':<24} {'':>11} {'':>13} {totals[0]:>6.2f} -> {totals[1]:>5.2f} {'':>11} "
+          f"{(totals[0] - totals[1]) / totals[0]:>10.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=15, help='fresh interpreters per handler and layout')
+    parser.add_argument('--baseline-ref', default=BEFORE_BUNDLES,
+                        help='commit whose whole lambda/ makes up the "before" column (default: the last one before bundles)')
+    parser.add_argument('--baseline-dir',
+                        help='lambda/ directory to use for the "before" column instead of --baseline-ref')
+    parser.add_argument('--handlers', nargs='+', default=list(HANDLERS))
+    args = parser.parse_args()
+
+    if args.baseline_dir:
+        run(args, args.baseline_dir, args.baseline_dir)
+    else:
+        with baseline_lambda_dir(args.baseline_ref) as lambda_dir:
+            run(args, lambda_dir, args.baseline_ref)
+
+if __name__ == '__main__':
+    main()
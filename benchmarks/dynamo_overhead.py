@@ -0,0 +1,145 @@
+"""Import time and warm per-call overhead: boto3.resource vs. the shared common.Table.
+
+Import time is measured in fresh interpreters, comparing what every handler used
+to run at module load (import boto3 + boto3.resource('dynamodb')) with importing
+common and creating its Table wrappers. Per-call overhead is measured with the HTTP
+layer replaced by canned DynamoDB responses, so the numbers cover parameter
+(de)serialization, botocore request building and response parsing but no network.
+Requires boto3. Run from the repo root:
+
+    python benchmarks/dynamo_overhead.py --calls 2000
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda')
+sys.path.insert(0, LAMBDA_DIR)
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-west-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+
+import common  # noqa: E402
+
+IMPORT_SNIPPETS = {
+    'before: boto3.resource at import': (
+        "import boto3\n"
+        "dynamodb = boto3.resource('dynamodb')\n"
+        "table = dynamodb.Table('messages')\n"
+    ),
+    'after: common.Table at import': (
+        "from common import Table\n"
+        "table = Table('messages')\n"
+    ),
+    'after: common.Table + first call builds client': (
+        "from common import Table, get_client\n"
+        "table = Table('messages')\n"
+        "get_client()\n"
+    ),
+}
+
+MESSAGE = {
+    'messageId': {'S': '01HXYZ0000000000000000000'},
+    'recipientId': {'S': 'user-1'},
+    'senderId': {'S': 'user-2'},
+    'content': {'S': 'hello there, this is a message of typical length'},
+    'timestamp': {'S': '2024-05-01T12:00:00.123Z'},
+    'sentAt': {'S': '2024-05-01T12:00:00.123Z'},
+}
+
+CANNED = {
+    'PutItem': {},
+    'GetItem': {'Item': MESSAGE},
+    'Query': {'Items': [MESSAGE] * 20, 'Count': 20, 'ScannedCount': 20},
+}
+
+
+class CannedBody:
+    def __init__(self, data):
+        self.data = data
+
+    def stream(self, **kwargs):
+        yield self.data
+
+
+def canned_send(request, **kwargs):
+    from botocore.awsrequest import AWSResponse
+    operation = request.headers['X-Amz-Target'].decode().split('.')[-1]
+    body = json.dumps(CANNED[operation]).encode()
+    return AWSResponse(request.url, 200, {'Content-Type': 'application/x-amz-json-1.0'}, CannedBody(body))
+
+
+def measure_import(snippet, runs):
+    code = (
+        "import sys, time\n"
+        f"sys.path.insert(0, {LAMBDA_DIR!r})\n"
+        "start = time.perf_counter()\n"
+        f"{snippet}"
+        "print(time.perf_counter() - start)\n"
+    )
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True, env=os.environ)
+        samples.append(float(out.stdout) * 1000)
+    return statistics.median(samples)
+
+
+def per_call_us(fn, calls):
+    for _ in range(min(calls, 200)):
+        fn()
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--import-runs', type=int, default=7)
+    args = parser.parse_args()
+
+    print('Import time (median of fresh interpreters)')
+    for label, snippet in IMPORT_SNIPPETS.items():
+        print(f"  {label:<48} {measure_import(snippet, args.import_runs):8.1f} ms")
+
+    import boto3
+    resource_table = boto3.resource('dynamodb').Table('messages')
+    resource_table.meta.client.meta.events.register('before-send', canned_send)
+    client = boto3.client('dynamodb')
+    client.meta.events.register('before-send', canned_send)
+    common.use_client(client)
+    shared_table = common.Table('messages')
+
+    item = {key: value['S'] for key, value in MESSAGE.items()}
+    key = {'messageId': item['messageId'], 'recipientId': item['recipientId']}
+    query = {
+        'IndexName': 'inbox-index',
+        'KeyConditionExpression': 'recipientId = :recipientId',
+        'ExpressionAttributeValues': {':recipientId': 'user-1'},
+    }
+    operations = [
+        ('put_item', lambda t: t.put_item(Item=item)),
+        ('get_item', lambda t: t.get_item(Key=key)),
+        ('query (20 items)', lambda t: t.query(**query)),
+        ('json response of query', lambda t: common.dumps(t.query(**query)['Items'])),
+    ]
+
+    print(f"\nWarm per-call overhead, canned responses ({args.calls} calls)")
+    print(f"  {'operation':<24} {'resource us':>12} {'common us':>10} {'saved':>7}")
+    for label, op in operations:
+        if label.startswith('json'):
+            # The resource layer returns Decimal for every number; json.dumps needs a default
+            before = per_call_us(lambda: json.dumps(resource_table.query(**query)['Items'], default=str), args.calls)
+        else:
+            before = per_call_us(lambda: op(resource_table), args.calls)
+        after = per_call_us(lambda: op(shared_table), args.calls)
+        print(f"  {label:<24} {before:>12.1f} {after:>10.1f} {1 - after / before:>6.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Group fan-out latency: one put_item per member vs. 25-item BatchWriteItem calls.
+
+DynamoDB is simulated with local.dynamodb.LocalDynamoDB: a fixed round-trip
+time per request plus a small per-item cost, and a configurable share of each
+batch comes back as UnprocessedItems so the retry path is exercised. Run from the repo root:
+
+    python benchmarks/fanout_latency.py --rtt-ms 8 --unprocessed 0.02
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from local.dynamodb import LocalDynamoDB  # noqa: E402
+import common  # noqa: E402
+import fanout  # noqa: E402
+
+
+def simulated(rtt, per_item, unprocessed_rate):
+    client = LocalDynamoDB(latency=rtt, per_item_latency=per_item, unprocessed_rate=unprocessed_rate)
+    client.add_table('messages', 'messageId', 'recipientId')
+    common.use_client(client)
+    return client
+
+
+def run_serial(table, items):
+    for item in items:
+        table.put_item(Item=item)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10,50,100,250,500,1000')
+    parser.add_argument('--rtt-ms', type=float, default=8.0)
+    parser.add_argument('--per-item-ms', type=float, default=0.02)
+    parser.add_argument('--unprocessed', type=float, default=0.02)
+    args = parser.parse_args()
+
+    print(f"rtt={args.rtt_ms}ms per_item={args.per_item_ms}ms unprocessed={args.unprocessed:.0%}")
+    print(f"{'members':>8} {'serial ms':>10} {'calls':>6} {'batched ms':>11} {'calls':>6} {'failed':>7} {'speedup':>8}")
+    for size in [int(s) for s in args.sizes.split(',')]:
+        items = [{'messageId': 'm', 'recipientId': f'user-{i}'} for i in range(size)]
+
+        table = common.Table('messages')
+
+        serial = simulated(args.rtt_ms / 1000, args.per_item_ms / 1000, 0)
+        start = time.perf_counter()
+        run_serial(table, items)
+        serial_ms = (time.perf_counter() - start) * 1000
+
+        batched = simulated(args.rtt_ms / 1000, args.per_item_ms / 1000, args.unprocessed)
+        start = time.perf_counter()
+        _, failed = fanout.write_items(table, items)
+        batched_ms = (time.perf_counter() - start) * 1000
+
+        serial_calls, batched_calls = serial.totals()['calls'], batched.totals()['calls']
+        print(f"{size:>8} {serial_ms:>10.1f} {serial_calls:>6} {batched_ms:>11.1f} {batched_calls:>6} {failed:>7} {serial_ms / batched_ms:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Group fan-out throughput: serial BatchWriteItem calls vs. concurrent shards.
+
+DynamoDB is simulated with local.dynamodb.LocalDynamoDB: a fixed round-trip time
+per request plus a per-item cost. --partition-wcu caps the write units per second
+one partition key accepts; every row of a group message shares its messageId
+partition, so a large fan-out runs into it and the AIMD limit in fanout has to back
+off. Run from the repo root:
+
+    python benchmarks/fanout_throughput.py --concurrency 8 --partition-wcu 3000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from local import stack  # noqa: E402
+from local.dynamodb import LocalDynamoDB  # noqa: E402
+import common  # noqa: E402
+import fanout  # noqa: E402
+
+
+def run(size, concurrency, args):
+    client = LocalDynamoDB(latency=args.rtt_ms / 1000, per_item_latency=args.per_item_ms / 1000,
+                           partition_wcu_limit=args.partition_wcu or None)
+    definition = dict(stack.TABLES['MESSAGES_TABLE_NAME'], stream_view_type=None)
+    client.add_table(definition.pop('name'), **definition)
+    common.use_client(client)
+    table = common.Table('messages-table')
+    items = [{
+        'messageId': f'message-{size}-{concurrency}',
+        'recipientId': f'user-{i}',
+        'senderId': 'user-0',
+        'content': 'hello group',
+        'sentAt': '2024-05-01T12:00:00.000Z',
+    } for i in range(size)]
+    start = time.perf_counter()
+    written, failed = fanout.write_items(table, items, concurrency)
+    elapsed = time.perf_counter() - start
+    totals = client.totals()
+    return elapsed, written, failed, totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10,100,1000,5000,10000')
+    parser.add_argument('--concurrency', type=int, default=fanout.FANOUT_CONCURRENCY)
+    parser.add_argument('--rtt-ms', type=float, default=8.0)
+    parser.add_argument('--per-item-ms', type=float, default=0.02)
+    parser.add_argument('--partition-wcu', type=float, default=0,
+                        help='write units per second per partition key (0 = unlimited)')
+    args = parser.parse_args()
+
+    print(f"rtt={args.rtt_ms}ms per_item={args.per_item_ms}ms concurrency={args.concurrency} "
+          f"partition_wcu={args.partition_wcu or 'unlimited'}")
+    print(f"{'members':>8} {'mode':>10} {'ms':>9} {'rows/s':>9} {'calls':>6} {'throttled':>10} {'failed':>7}")
+    for size in [int(s) for s in args.sizes.split(',')]:
+        serial_elapsed = None
+        for label, concurrency in (('serial', 1), ('concurrent', args.concurrency)):
+            elapsed, written, failed, totals = run(size, concurrency, args)
+            serial_elapsed = serial_elapsed or elapsed
+            print(f"{size:>8} {label:>10} {elapsed * 1000:>9.1f} {written / elapsed:>9.0f} {totals['calls']:>6} "
+                  f"{totals['throttled']:>10} {failed:>7}"
+                  + (f"  {serial_elapsed / elapsed:.1f}x" if concurrency > 1 else ''))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""Per-handler latency and DynamoDB capacity, run offline against LocalDynamoDB.
+
+Every route is driven through lambda_function (the single-function router) with
+synthetic API Gateway events. The stand-in records the read and write units each
+call would consume, so the report shows p50/p95/p99 latency and RCU/WCU per
+operation. --latency-ms adds a simulated round trip to every DynamoDB request;
+without it the numbers are handler CPU time only. Run from the repo root:
+
+    python benchmarks/handlers.py --users 1000 --groups 50 --group-size 20 --calls 200
+"""
+import argparse
+import contextlib
+import json
+import io
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from local import stack  # noqa: E402
+
+client = None
+router = None
+
+
+def invoke(resource, body, method='POST'):
+    # Handler prints and log lines would swamp the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = router.handler(stack.api_event(resource, method, body), None)
+    return result['statusCode'], json.loads(result['body'])
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class Recorder:
+    def __init__(self):
+        self.results = {}
+
+    def measure(self, label, resource, body, method='POST'):
+        before = client.totals()
+        start = time.perf_counter()
+        status, payload = invoke(resource, body, method)
+        elapsed = (time.perf_counter() - start) * 1000
+        self.add(label, elapsed, before, client.totals(), 1 if status >= 400 else 0)
+        return status, payload
+
+    def drain(self, label, queue, worker):
+        # Measures one worker invocation per queued batch
+        def timed(event, context):
+            before = client.totals()
+            start = time.perf_counter()
+            result = worker(event, context)
+            elapsed = (time.perf_counter() - start) * 1000
+            self.add(label, elapsed, before, client.totals(), len(result['batchItemFailures']))
+            return result
+        queue.drain(timed)
+
+    def add(self, label, elapsed, before, after, errors):
+        entry = self.results.setdefault(label, {'ms': [], 'rcu': 0.0, 'wcu': 0.0, 'calls': 0, 'errors': 0})
+        entry['ms'].append(elapsed)
+        entry['rcu'] += after['rcu'] - before['rcu']
+        entry['wcu'] += after['wcu'] - before['wcu']
+        entry['calls'] += after['calls'] - before['calls']
+        entry['errors'] += errors
+
+    def report(self):
+        print(f"{'operation':<28} {'n':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'RCU/op':>8} {'WCU/op':>8} {'ddb/op':>7} {'errors':>7}")
+        for label, entry in self.results.items():
+            n = len(entry['ms'])
+            print(f"{label:<28} {n:>5} {percentile(entry['ms'], 0.50):>8.2f} {percentile(entry['ms'], 0.95):>8.2f} "
+                  f"{percentile(entry['ms'], 0.99):>8.2f} {entry['rcu'] / n:>8.1f} {entry['wcu'] / n:>8.1f} "
+                  f"{entry['calls'] / n:>7.1f} {entry['errors']:>7}")
+
+
+def main():
+    global client, router
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--groups', type=int, default=50)
+    parser.add_argument('--group-size', type=int, default=20)
+    parser.add_argument('--large-group-size', type=int, default=500,
+                        help='members in one extra group that crosses FANOUT_ON_READ_MIN_MEMBERS')
+    parser.add_argument('--messages', type=int, default=20, help='direct messages seeded per user')
+    parser.add_argument('--batch-recipients', type=int, default=100, help='recipients per POST /message/batch call')
+    parser.add_argument('--calls', type=int, default=200, help='measured calls per operation')
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--queued-fanout', action='store_true',
+                        help='queue group fan-out jobs on a LocalQueue and drain them with fanout_worker')
+    parser.add_argument('--push-share', type=float, default=0.0,
+                        help='share of users with an open WebSocket connection (turns on push delivery)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    logging.disable(logging.INFO)
+    client = stack.install(latency=args.latency_ms / 1000, seed=args.seed)
+    queue = stack.install_queue(seed=args.seed) if args.queued_fanout else None
+    connections = stack.install_push() if args.push_share else None
+    import lambda_function
+    import fanout_worker
+    router = lambda_function
+
+    # Seed data through the handlers themselves, unmeasured
+    users = [invoke('/register', {'name': f'user {i}', 'email': f'user{i}@example.com'})[1]['userId']
+             for i in range(args.users)]
+    groups = []
+    for i in range(args.groups):
+        members = rng.sample(users, min(args.group_size, len(users)))
+        group_id = invoke('/group', {'groupName': f'group {i}', 'members': members})[1]['groupId']
+        groups.append((group_id, members))
+    if connections is not None:
+        for user_id in rng.sample(users, int(len(users) * args.push_share)):
+            connections.connect(router.handler, user_id)
+    large_members = rng.sample(users, min(args.large_group_size, len(users)))
+    large_group = invoke('/group', {'groupName': 'large', 'members': large_members})[1]['groupId']
+    for user_id in users:
+        for _ in range(args.messages):
+            invoke('/message', {'senderId': rng.choice(users), 'recipientId': user_id, 'content': 'seed message'})
+    for group_id, members in groups:
+        invoke('/group/message', {'senderId': members[0], 'groupId': group_id, 'content': 'seed group message'})
+    invoke('/group/message', {'senderId': large_members[0], 'groupId': large_group, 'content': 'seed group message'})
+    if queue is not None:
+        queue.drain(fanout_worker.handler)
+
+    print(f"users={args.users} groups={args.groups}x{args.group_size} + 1x{len(large_members)} "
+          f"seeded items={sum(t.count() for t in client.tables.values())} latency={args.latency_ms}ms")
+    recorder = Recorder()
+    for _ in range(args.calls):
+        sender, recipient = rng.sample(users, 2)
+        group_id, members = rng.choice(groups)
+        outsider = rng.choice(users)
+        recorder.measure('register_user POST', '/register', {'name': 'new user', 'email': 'new@example.com'})
+        recorder.measure('send_message', '/message', {'senderId': sender, 'recipientId': recipient, 'content': 'hello'})
+        recorder.measure(f'send_message_batch ({args.batch_recipients})', '/message/batch', {
+            'senderId': sender, 'recipientIds': rng.sample(users, min(args.batch_recipients, len(users))), 'content': 'hello'})
+        if queue is not None:
+            recorder.drain('fanout_worker (batch)', queue, fanout_worker.handler)
+        recorder.measure('block_user', '/block', {'blockerId': recipient, 'blockedId': outsider})
+        recorder.measure('create_group', '/group', {'groupName': 'bench', 'members': rng.sample(users, min(args.group_size, len(users)))})
+        recorder.measure('add_user_to_group', '/group/add-user', {'groupId': group_id, 'userId': outsider})
+        recorder.measure('remove_user_from_group', '/group/remove-user', {'groupId': group_id, 'userId': outsider})
+        recorder.measure('send_group_message (write)', '/group/message', {'senderId': members[0], 'groupId': group_id, 'content': 'hi all'})
+        if queue is not None:
+            recorder.drain('fanout_worker (group write)', queue, fanout_worker.handler)
+        recorder.measure('send_group_message (read)', '/group/message', {'senderId': large_members[0], 'groupId': large_group, 'content': 'hi all'})
+        if queue is not None:
+            recorder.drain('fanout_worker (group read)', queue, fanout_worker.handler)
+        _, page = recorder.measure('check_messages', '/messages', {'userId': recipient})
+        recorder.measure('check_messages since', '/messages', {'userId': recipient, 'since': page.get('watermark')})
+        if page.get('watermark'):
+            recorder.measure('ack_messages', '/messages/ack', {'userId': recipient, 'watermark': page['watermark']})
+        recorder.measure('unread_count', '/messages/unread-count', {'userId': recipient})
+        recorder.measure('list_conversations', '/conversations', {'userId': recipient})
+        user_id = invoke('/register', {'name': 'gone', 'email': 'gone@example.com'})[1]['userId']
+        recorder.measure('register_user DELETE', '/register', {'userId': user_id}, method='DELETE')
+    recorder.report()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Hot recipient throughput and read cost with and without inbox sharding.
+
+Many senders message one recipient as fast as send_message allows, for a few
+seconds, against a LocalDynamoDB that caps every partition (table and index) at
+--partition-wcu write units per second. Without shards every row lands in the
+recipient's inbox-index partition and the excess is throttled; with shards the
+first throttled write marks the inbox hot and later rows spread over the shards.
+Afterwards /messages pages through the inbox with --read-latency-ms per request,
+which shows what the scatter/gather over shards costs. Run from the repo root:
+
+    python benchmarks/hot_keys.py --shards 1 8 --partition-wcu 1000 --duration 3
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from local import stack  # noqa: E402
+
+router = None
+
+
+def invoke(resource, body):
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = router.handler(stack.api_event(resource, 'POST', body), None)
+    return result['statusCode'], json.loads(result['body'])
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run(shard_count, args):
+    global router
+    import blocks
+    import shards
+    client = stack.install(partition_wcu_limit=args.partition_wcu, seed=args.seed)
+    import lambda_function
+    router = lambda_function
+    shards.HOT_KEY_SHARDS = shard_count
+    blocks.block_cache.entries.clear()
+
+    recipient = invoke('/register', {'name': 'celebrity', 'email': 'c@example.com'})[1]['userId']
+    senders = [invoke('/register', {'name': f'fan {i}', 'email': 'f@example.com'})[1]['userId']
+               for i in range(args.senders)]
+    sent, errors = 0, 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < args.duration:
+        try:
+            status, _ = invoke('/message', {'senderId': senders[sent % len(senders)], 'recipientId': recipient, 'content': 'hi!'})
+        except Exception:
+            status = 500
+        if status == 200:
+            sent += 1
+        else:
+            errors += 1
+    elapsed = time.perf_counter() - started
+    used = client.tables['users-table'].partitions[recipient][None].get('inboxShards', 1)
+
+    client.latency = args.read_latency_ms / 1000
+    timings, token, read = [], None, 0
+    while True:
+        request = {'userId': recipient, 'limit': 100}
+        if token:
+            request['nextToken'] = token
+        start = time.perf_counter()
+        _, page = invoke('/messages', request)
+        timings.append((time.perf_counter() - start) * 1000)
+        read += len(page['messages'])
+        token = page.get('nextToken')
+        if not token:
+            break
+    return {
+        'sent/s': sent / elapsed,
+        'errors': errors,
+        'throttled': client.totals()['throttled'],
+        'shards': used,
+        'read': read,
+        'p50': percentile(timings, 0.50),
+        'p95': percentile(timings, 0.95),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 8], help='HOT_KEY_SHARDS values to compare')
+    parser.add_argument('--partition-wcu', type=int, default=1000)
+    parser.add_argument('--duration', type=float, default=3.0, help='seconds of sending per run')
+    parser.add_argument('--senders', type=int, default=100)
+    parser.add_argument('--read-latency-ms', type=float, default=5.0)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    print(f"partition limit={args.partition_wcu} WCU/s, {args.duration}s of sends, read latency={args.read_latency_ms}ms")
+    print(f"{'HOT_KEY_SHARDS':>14} {'shards':>7} {'sent/s':>9} {'errors':>8} {'throttled':>10} {'read':>7} "
+          f"{'page p50 ms':>12} {'page p95 ms':>12}")
+    for shard_count in args.shards:
+        result = run(shard_count, args)
+        print(f"{shard_count:>14} {result['shards']:>7} {result['sent/s']:>9.0f} {result['errors']:>8} "
+              f"{result['throttled']:>10} {result['read']:>7} {result['p50']:>12.2f} {result['p95']:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
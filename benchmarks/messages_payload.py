@@ -0,0 +1,117 @@
+"""/messages response size and latency by format, run offline against LocalDynamoDB.
+
+Seeds one inbox (10,000 messages by default, some of them group messages) and pages
+through all of it with the largest page size, once per response variant: whole
+items, a "fields" projection, the compact columnar format, and both together. The
+report shows the bytes the handler returns, the same bodies gzip-compressed (what
+API Gateway sends to clients that accept gzip), per-page latency and the read units
+consumed. Run from the repo root:
+
+    python benchmarks/messages_payload.py --messages 10000 --senders 50
+"""
+import argparse
+import contextlib
+import gzip
+import io
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from local import stack  # noqa: E402
+
+WORDS = ('hey', 'are', 'we', 'still', 'on', 'for', 'lunch', 'tomorrow', 'the', 'build', 'is',
+         'green', 'again', 'thanks', 'see', 'you', 'at', 'noon', 'can', 'someone', 'review', 'my', 'change')
+
+VARIANTS = (
+    ('full', {}),
+    ('fields', {'fields': ['senderId', 'content', 'sentAt']}),
+    ('compact', {'format': 'compact'}),
+    ('compact + fields', {'format': 'compact', 'fields': ['senderId', 'content', 'sentAt']}),
+)
+
+router = None
+
+
+def invoke(resource, body):
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = router.handler(stack.api_event(resource, 'POST', body), None)
+    return result['statusCode'], result['body']
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def read_inbox(client, user_id, options, limit):
+    # Pages through the whole inbox; returns per-page timings, raw and gzip sizes, RCU and messages seen
+    timings, raw, compressed, seen = [], 0, 0, 0
+    before = client.totals()
+    token = None
+    while True:
+        request = dict(options, userId=user_id, limit=limit)
+        if token:
+            request['nextToken'] = token
+        start = time.perf_counter()
+        status, body = invoke('/messages', request)
+        timings.append((time.perf_counter() - start) * 1000)
+        if status != 200:
+            raise RuntimeError(f'/messages returned {status}: {body}')
+        raw += len(body.encode('utf-8'))
+        compressed += len(gzip.compress(body.encode('utf-8')))
+        page = json.loads(body)
+        seen += page['count'] if 'count' in page else len(page['messages'])
+        token = page.get('nextToken')
+        if not token:
+            return timings, raw, compressed, client.totals()['rcu'] - before['rcu'], seen
+
+
+def main():
+    global router
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=10000, help='messages in the inbox that is read')
+    parser.add_argument('--senders', type=int, default=50)
+    parser.add_argument('--group-share', type=float, default=0.1, help='share of messages sent to a small group')
+    parser.add_argument('--limit', type=int, default=100, help='page size')
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    logging.disable(logging.INFO)
+    # Everything stays within the retention window and unacknowledged
+    client = stack.install(latency=args.latency_ms / 1000, seed=args.seed)
+    import lambda_function
+    router = lambda_function
+
+    def register(name):
+        return json.loads(invoke('/register', {'name': name, 'email': f'{name}@example.com'})[1])['userId']
+
+    reader = register('reader')
+    senders = [register(f'sender{i}') for i in range(args.senders)]
+    groups = [json.loads(invoke('/group', {'groupName': f'group {i}', 'members': [reader] + rng.sample(senders, 3)})[1])
+              for i in range(5)]
+    for _ in range(args.messages):
+        content = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 15)))
+        if rng.random() < args.group_share:
+            group = rng.choice(groups)
+            invoke('/group/message', {'senderId': rng.choice(senders), 'groupId': group['groupId'], 'content': content})
+        else:
+            invoke('/message', {'senderId': rng.choice(senders), 'recipientId': reader, 'content': content})
+
+    print(f"inbox={args.messages} senders={args.senders} page size={args.limit} latency={args.latency_ms}ms")
+    print(f"{'variant':<18} {'pages':>6} {'KB':>9} {'gzip KB':>9} {'B/msg':>7} {'gzip B/msg':>10} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'RCU':>8}")
+    for label, options in VARIANTS:
+        timings, raw, compressed, rcu, seen = read_inbox(client, reader, options, args.limit)
+        print(f"{label:<18} {len(timings):>6} {raw / 1024:>9.1f} {compressed / 1024:>9.1f} {raw / seen:>7.1f} "
+              f"{compressed / seen:>10.1f} {percentile(timings, 0.50):>8.2f} {percentile(timings, 0.95):>8.2f} {rcu:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
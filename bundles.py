@@ -0,0 +1,48 @@
+"""Per-handler deployment bundles for the functions in __main__.py.
+
+A handler's bundle is its module plus every module in lambda/ it imports,
+directly or through another bundled module, found by walking the import
+statements' syntax trees. Imports inside functions count too, so a lazily
+imported module still ships; imports by name through importlib do not, which
+is why the router's bundle is seeded with every handler it can dispatch to.
+Anything that is not a module in lambda/ (the standard library, boto3) is
+left to the runtime.
+"""
+import ast
+import os
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lambda')
+
+
+def imported_names(path):
+    with open(path, encoding='utf-8') as source:
+        tree = ast.parse(source.read(), filename=path)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                yield alias.name.split('.')[0]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            yield node.module.split('.')[0]
+
+
+def import_closure(*modules, lambda_dir=LAMBDA_DIR):
+    # Sorted names of the lambda/ modules the given modules need, themselves included
+    found = set()
+    pending = list(modules)
+    while pending:
+        module = pending.pop()
+        if module in found:
+            continue
+        path = os.path.join(lambda_dir, f'{module}.py')
+        if not os.path.isfile(path):
+            raise ValueError(f'{module} is not a module in {lambda_dir}')
+        found.add(module)
+        pending.extend(name for name in imported_names(path)
+                       if name not in found and os.path.isfile(os.path.join(lambda_dir, f'{name}.py')))
+    return sorted(found)
+
+
+def bundle_files(*modules, lambda_dir=LAMBDA_DIR):
+    # {archive path: source path} for a handler's bundle
+    return {f'{module}.py': os.path.join(lambda_dir, f'{module}.py')
+            for module in import_closure(*modules, lambda_dir=lambda_dir)}
@@ -0,0 +1,194 @@
+import json
+import os
+from common import Table, ConditionFailed, response, internal_error
+from fanout import write_requests, read_items
+from ids import is_id
+from shards import shard_keys
+from conversations import direct_key, group_key
+from metrics import instrument
+import unread
+
+users_table = Table(os.environ['USERS_TABLE_NAME'])
+messages_table = Table(os.environ['MESSAGES_TABLE_NAME'])
+messages_index_name = os.environ.get('MESSAGES_INDEX_NAME', 'inbox-index')
+memberships_table = Table(os.environ['MEMBERSHIPS_TABLE_NAME'])
+groups_table = Table(os.environ['GROUPS_TABLE_NAME'])
+group_messages_table = Table(os.environ['GROUP_MESSAGES_TABLE_NAME'])
+
+# Inbox rows deleted per call with "delete": true; the rest go on the next ack
+MAX_DELETES = 1000
+
+# Acknowledging a watermark from /messages (or a message ID) marks everything up to and
+# including it as delivered: the user's deliveredCursor and the read cursor of each of
+# their groups move forward to it, and /messages polls start after those cursors. Inbox
+# rows are compared by their inboxKey, so a group message a queued fan-out wrote after
+# it was sent is only covered by a watermark that includes it, not by its messageId.
+# Cursors only ever move forward, so repeated or out-of-order acks are harmless.
+# Whatever a cursor moves past is subtracted from the user's unread counters, so only
+# an ack that moves a cursor changes them.
+
+def advance(table, key, attribute, up_to, must_exist=None):
+    # Returns (True, previous value or None) if the cursor moved, (False, None) if it
+    # was already at or past up_to
+    condition = f'attribute_not_exists({attribute}) OR {attribute} < :upTo'
+    if must_exist:
+        condition = f'attribute_exists({must_exist}) AND ({condition})'
+    try:
+        result = table.update_item(
+            Key=key,
+            UpdateExpression=f'SET {attribute} = :upTo',
+            ConditionExpression=condition,
+            ExpressionAttributeValues={':upTo': up_to},
+            ReturnValues='UPDATED_OLD',
+            ReturnValuesOnConditionCheckFailure='ALL_OLD'
+        )
+        return True, result.get('Attributes', {}).get(attribute)
+    except ConditionFailed as e:
+        if must_exist and e.item is None:
+            raise
+        return False, None
+
+def get_inbox_shards(user_id):
+    result = users_table.get_item(Key={'userId': user_id}, ProjectionExpression='inboxShards')
+    return result.get('Item', {}).get('inboxShards', 1)
+
+def count_between(user_id, table, query_args, sort_key, after, conversation_key, counts):
+    # Adds the rows of one inbox or timeline partition in (after, up_to] to counts, by
+    # conversation; the user's own messages were never counted as unread
+    while True:
+        result = table.query(**query_args)
+        for item in result.get('Items', []):
+            if item[sort_key] == after or item.get('senderId') == user_id:
+                continue
+            key = conversation_key(item)
+            counts[key] = counts.get(key, 0) + 1
+        if 'LastEvaluatedKey' not in result:
+            return
+        query_args['ExclusiveStartKey'] = result['LastEvaluatedKey']
+
+def range_condition(sort_key, after):
+    # Key attributes can't be filtered on, so a lower bound is inclusive and the row at
+    # after itself is skipped while counting
+    return f'{sort_key} BETWEEN :after AND :upTo' if after else f'{sort_key} <= :upTo'
+
+def count_inbox(user_id, shards, after, up_to, counts):
+    values = {':upTo': up_to}
+    if after:
+        values[':after'] = after
+    for key in shard_keys(user_id, shards):
+        count_between(user_id, messages_table, {
+            'IndexName': messages_index_name,
+            'KeyConditionExpression': f"recipientId = :recipientId AND {range_condition('inboxKey', after)}",
+            'ExpressionAttributeValues': dict(values, **{':recipientId': key}),
+            'ProjectionExpression': 'inboxKey, senderId, groupId'
+        }, 'inboxKey', after, lambda item: group_key(item['groupId']) if 'groupId' in item else direct_key(item['senderId']), counts)
+
+def count_timelines(user_id, moved, up_to, counts):
+    # moved: {group ID: previous read cursor} for the groups whose cursor this ack moved
+    items = read_items(groups_table.name, [{'groupId': group_id} for group_id in moved],
+                       ProjectionExpression='groupId, timelineShards, hasTimeline')
+    # Groups without a timeline fan out on write; their rows were counted by count_inbox
+    timeline_shards = {item['groupId']: item.get('timelineShards', 1) for item in items if item.get('hasTimeline')}
+    for group_id, after in moved.items():
+        if group_id not in timeline_shards:
+            continue
+        values = {':upTo': up_to}
+        if after:
+            values[':after'] = after
+        for key in shard_keys(group_id, timeline_shards[group_id]):
+            count_between(user_id, group_messages_table, {
+                'KeyConditionExpression': f"groupId = :groupId AND {range_condition('messageId', after)}",
+                'ExpressionAttributeValues': dict(values, **{':groupId': key}),
+                'ProjectionExpression': 'messageId, senderId'
+            }, 'messageId', after, lambda item: group_key(group_id), counts)
+
+def delete_acknowledged(user_id, shards, up_to):
+    # Batch-deletes the user's inbox rows up to up_to, across all inbox shards; returns (deleted, more)
+    requests = []
+    more = False
+    for key in shard_keys(user_id, shards):
+        if len(requests) >= MAX_DELETES:
+            more = True
+            break
+        result = messages_table.query(
+            IndexName=messages_index_name,
+            KeyConditionExpression='recipientId = :recipientId AND inboxKey <= :upTo',
+            ExpressionAttributeValues={':recipientId': key, ':upTo': up_to},
+            ProjectionExpression='messageId',
+            Limit=MAX_DELETES - len(requests)
+        )
+        requests.extend({'DeleteRequest': {'Key': {
+            'messageId': {'S': item['messageId']},
+            'recipientId': {'S': key}
+        }}} for item in result.get('Items', []))
+        more = more or 'LastEvaluatedKey' in result
+    failed = write_requests(messages_table.name, requests) if requests else 0
+    return len(requests) - failed, more or failed > 0
+
+@instrument
+def handler(event, context):
+    try:
+        body = json.loads(event['body'])
+        user_id = body['userId']
+        up_to = body.get('messageId') or body.get('watermark')
+        if not is_id(up_to):
+            return response(400, {
+                'message': 'messageId or watermark must be a message ID returned by /messages'
+            })
+
+        try:
+            advanced, previous = advance(users_table, {'userId': user_id}, 'deliveredCursor', up_to, must_exist='userId')
+        except ConditionFailed:
+            return response(404, {
+                'message': 'User not found',
+                'userId': user_id
+            })
+
+        counting = unread.enabled()
+        shards = get_inbox_shards(user_id) if counting and advanced or body.get('delete') else 1
+        acknowledged = {}
+        if counting and advanced:
+            count_inbox(user_id, shards, previous, up_to, acknowledged)
+
+        # Group timelines have no per-message rows; acknowledging moves their read cursors
+        moved = {}
+        query_args = {
+            'KeyConditionExpression': 'userId = :userId',
+            'FilterExpression': 'readCursor < :upTo',
+            'ExpressionAttributeValues': {':userId': user_id, ':upTo': up_to},
+            'ProjectionExpression': 'groupId'
+        }
+        while True:
+            memberships = memberships_table.query(**query_args)
+            for membership in memberships.get('Items', []):
+                # The user may have been removed from the group since the query; the
+                # update must not write their membership row back
+                try:
+                    group_moved, group_previous = advance(memberships_table, {'userId': user_id, 'groupId': membership['groupId']},
+                                                          'readCursor', up_to, must_exist='groupId')
+                except ConditionFailed:
+                    continue
+                if group_moved:
+                    moved[membership['groupId']] = group_previous
+            if 'LastEvaluatedKey' not in memberships:
+                break
+            query_args['ExclusiveStartKey'] = memberships['LastEvaluatedKey']
+        if counting and moved:
+            count_timelines(user_id, moved, up_to, acknowledged)
+        unread.subtract(user_id, acknowledged)
+
+        result = {
+            'message': 'Messages acknowledged',
+            'userId': user_id,
+            'upTo': up_to,
+            'advanced': advanced
+        }
+        if body.get('delete'):
+            result['deleted'], result['moreToDelete'] = delete_acknowledged(user_id, shards, up_to)
+        return response(200, result)
+    except KeyError as e:
+        return response(400, {
+            'message': f'Missing required key in request body: {e}'
+        })
+    except Exception as e:
+        return internal_error(e)
@@ -1,39 +1,50 @@
 import json
-import boto3
 import os
+from common import Table, ConditionFailed, response, internal_error
+from clock import now_ms
+from ids import min_id
+from groups import invalidate, update_members
+from metrics import instrument
 
-dynamodb = boto3.resource('dynamodb')
-groups_table = dynamodb.Table(os.environ['GROUPS_TABLE_NAME'])
+groups_table = Table(os.environ['GROUPS_TABLE_NAME'])
+memberships_table = Table(os.environ['MEMBERSHIPS_TABLE_NAME'])
 
+@instrument
 def handler(event, context):
     body = json.loads(event['body'])
     group_id = body['groupId']
     user_id = body['userId']
 
     try:
-        response = groups_table.update_item(
-            Key={'groupId': group_id},
-            UpdateExpression='SET members = list_append(if_not_exists(members, :empty_list), :userId)',
+        # Set ADD is idempotent, so retries can't add the user twice; the version bump
+        # tells cached copies of the member set (see groups) to reload
+        update_members(
+            groups_table, group_id,
+            UpdateExpression='ADD members :userIds, membershipVersion :one',
+            ConditionExpression='attribute_exists(groupId)',
             ExpressionAttributeValues={
-                ':userId': [user_id],
-                ':empty_list': []
-            },
-            ReturnValues='UPDATED_NEW'
+                ':userIds': {user_id},
+                ':one': 1
+            }
         )
+        invalidate(group_id)
 
-        return {
-            'statusCode': 200,
-            'body': json.dumps({
-                'message': 'User added to group successfully',
-                'groupId': group_id,
-                'userId': user_id
-            })
-        }
+        # Keep an existing read cursor if the user is already a member
+        memberships_table.update_item(
+            Key={'userId': user_id, 'groupId': group_id},
+            UpdateExpression='SET readCursor = if_not_exists(readCursor, :joinedAt)',
+            ExpressionAttributeValues={':joinedAt': min_id(now_ms())}
+        )
+
+        return response(200, {
+            'message': 'User added to group successfully',
+            'groupId': group_id,
+            'userId': user_id
+        })
+    except ConditionFailed:
+        return response(404, {
+            'message': 'Group not found',
+            'groupId': group_id
+        })
     except Exception as e:
-        return {
-            'statusCode': 500,
-            'body': json.dumps({
-                'message': 'Internal server error',
-                'error': str(e)
-            })
-        }
+        return internal_error(e)
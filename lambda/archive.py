@@ -0,0 +1,84 @@
+import os
+import gzip
+import json
+from common import deserialize_item, json_default
+from clock import to_iso
+from ids import id_ms
+from shards import base_key
+
+# Cold storage for messages leaving the hot tables: each batch of removed rows becomes
+# one gzip-compressed JSON-lines object per table and send date, under
+# <ARCHIVE_PREFIX>/<table>/dt=YYYY-MM-DD/, so a day can be listed, restored or queried
+# (e.g. with Athena) without touching DynamoDB.
+ARCHIVE_BUCKET = os.environ.get('ARCHIVE_BUCKET', '')
+ARCHIVE_PREFIX = os.environ.get('ARCHIVE_PREFIX', 'messages')
+
+class S3Store:
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.client = None
+
+    def put(self, key, data):
+        if self.client is None:
+            import boto3
+            self.client = boto3.session.Session().client('s3')
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=key,
+            Body=data,
+            ContentType='application/x-ndjson',
+            ContentEncoding='gzip'
+        )
+
+_store = None
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = S3Store(ARCHIVE_BUCKET)
+    return _store
+
+def use_store(store):
+    # Swaps in another store with a put(key, data) method (e.g. local.blobstore.DirectoryStore)
+    global _store
+    _store = store
+
+def table_label(event_source_arn):
+    # arn:aws:dynamodb:<region>:<account>:table/<name>/stream/<label>
+    return event_source_arn.split(':table/', 1)[1].split('/', 1)[0]
+
+def sent_date(item):
+    if 'sentAt' in item:
+        return item['sentAt'][:10]
+    return to_iso(id_ms(item['messageId']))[:10]
+
+def encode_lines(items):
+    lines = (json.dumps(item, separators=(',', ':'), default=json_default) for item in items)
+    return gzip.compress(('\n'.join(lines) + '\n').encode('utf-8'))
+
+def archive_records(records):
+    # Writes the OldImage of every REMOVE stream record and returns the object keys.
+    # Keys are derived from the first record's sequence number, so a retried batch
+    # overwrites its own objects instead of archiving the rows twice.
+    partitions = {}
+    for record in records:
+        if record.get('eventName') != 'REMOVE' or 'OldImage' not in record.get('dynamodb', {}):
+            continue
+        item = deserialize_item(record['dynamodb']['OldImage'])
+        # TTL deletions are made by the DynamoDB service principal; anything else was deleted by the app
+        identity = record.get('userIdentity') or {}
+        item['removedBy'] = 'ttl' if identity.get('principalId') == 'dynamodb.amazonaws.com' else 'app'
+        # Rows of hot keys are stored under a shard suffix; the archive keeps the plain IDs
+        for attribute in ('recipientId', 'groupId'):
+            if attribute in item:
+                item[attribute] = base_key(item[attribute])
+        key = (table_label(record['eventSourceARN']), sent_date(item))
+        partition = partitions.setdefault(key, {'first': record['dynamodb']['SequenceNumber'], 'items': []})
+        partition['items'].append(item)
+
+    keys = []
+    for (table, date), partition in sorted(partitions.items()):
+        key = f"{ARCHIVE_PREFIX}/{table}/dt={date}/{partition['first']}.jsonl.gz"
+        get_store().put(key, encode_lines(partition['items']))
+        keys.append(key)
+    return keys
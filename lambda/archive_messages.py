@@ -0,0 +1,16 @@
+import logging
+from archive import archive_records
+from metrics import instrument
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Fed by the messages-table and group-messages-table streams, filtered to REMOVE events:
+# rows deleted by TTL once their retention is up, and rows the app deletes. Raising
+# makes Lambda retry the batch, which rewrites the same archive objects.
+
+@instrument
+def handler(event, context):
+    keys = archive_records(event['Records'])
+    logger.info(f"Archived {len(event['Records'])} records to {len(keys)} objects")
+    return {'archived': keys}
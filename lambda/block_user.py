@@ -1,31 +1,31 @@
 import json
-import boto3
 import os
+from common import Table, response
+from metrics import instrument
 
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table(os.environ['USERS_TABLE_NAME'])
+table = Table(os.environ['USERS_TABLE_NAME'])
 
+@instrument
 def handler(event, context):
     body = json.loads(event['body'])
     blocker_id = body['blockerId']
     blocked_id = body['blockedId']
 
-    # Update the block list for the blocker
-    response = table.update_item(
+    # Update the block list for the blocker and bump its version so cached
+    # copies in send_message are reloaded on their next revalidation
+    table.update_item(
         Key={
             'userId': blocker_id
         },
-        UpdateExpression="ADD blockedUsers :blockedUser",
+        UpdateExpression="ADD blockedUsers :blockedUser, blockVersion :one",
         ExpressionAttributeValues={
-            ':blockedUser': {blocked_id}
+            ':blockedUser': {blocked_id},
+            ':one': 1
         }
     )
 
-    return {
-        'statusCode': 200,
-        'body': json.dumps({
-            'message': 'User blocked successfully',
-            'blockerId': blocker_id,
-            'blockedId': blocked_id
-        })
-    }
+    return response(200, {
+        'message': 'User blocked successfully',
+        'blockerId': blocker_id,
+        'blockedId': blocked_id
+    })
@@ -0,0 +1,103 @@
+import os
+from cache import TTLCache
+from fanout import read_items
+import metrics
+
+# Block sets are served from the warm container for up to BLOCK_CACHE_TTL_SECONDS,
+# then revalidated against the recipient's blockVersion before being reused. Entries
+# also carry the user's inboxShards for the send handlers; a stale count is harmless
+# (see shards), so it is only refreshed when the entry is reloaded. The cache's hits,
+# misses and size go into the metrics record of every invocation that uses it (see
+# metrics).
+BLOCK_CACHE_TTL_SECONDS = float(os.environ.get('BLOCK_CACHE_TTL_SECONDS', '10'))
+BLOCK_CACHE_MAX_ENTRIES = int(os.environ.get('BLOCK_CACHE_MAX_ENTRIES', '10000'))
+
+block_cache = TTLCache(BLOCK_CACHE_MAX_ENTRIES, BLOCK_CACHE_TTL_SECONDS)
+metrics.track_cache('Block', block_cache)
+
+def block_entry(item):
+    return {
+        'blockedUsers': frozenset(item.get('blockedUsers', ())),
+        'blockVersion': item.get('blockVersion', 0),
+        'inboxShards': item.get('inboxShards', 1)
+    }
+
+def load_block_entry(users_table, user_id):
+    response = users_table.get_item(
+        Key={'userId': user_id},
+        ProjectionExpression='blockedUsers, blockVersion, inboxShards'
+    )
+    return block_entry(response.get('Item', {}))
+
+def get_blocked_users(users_table, user_id):
+    cached = block_cache.get(user_id)
+    if cached is None:
+        entry = load_block_entry(users_table, user_id)
+        block_cache.put(user_id, entry)
+        return entry['blockedUsers']
+
+    entry, fresh = cached
+    if fresh:
+        return entry['blockedUsers']
+
+    # Stale: fetch only the version number and reload the set if it moved
+    response = users_table.get_item(
+        Key={'userId': user_id},
+        ProjectionExpression='blockVersion'
+    )
+    version = response.get('Item', {}).get('blockVersion', 0)
+    if version == entry['blockVersion']:
+        block_cache.renew(user_id)
+        return entry['blockedUsers']
+    entry = load_block_entry(users_table, user_id)
+    block_cache.reload(user_id, entry)
+    return entry['blockedUsers']
+
+def get_blocked_users_many(users_table, user_ids):
+    # Returns {userId: blocked set} for many users. Fresh cache entries are used as they
+    # are; everything else, stale entries included, comes from one BatchGetItem per 100
+    # users. A stale entry is reloaded outright rather than version-checked first, since
+    # the set rides along in the same call.
+    blocked = {}
+    stale = {}
+    load = []
+    for user_id in dict.fromkeys(user_ids):
+        cached = block_cache.get(user_id)
+        if cached is None:
+            load.append(user_id)
+            continue
+        entry, fresh = cached
+        if fresh:
+            blocked[user_id] = entry['blockedUsers']
+        else:
+            stale[user_id] = entry
+            load.append(user_id)
+    if not load:
+        return blocked
+
+    items = read_items(
+        users_table.name,
+        [{'userId': user_id} for user_id in load],
+        ProjectionExpression='userId, blockedUsers, blockVersion, inboxShards'
+    )
+    found = {item['userId']: item for item in items}
+    for user_id in load:
+        entry = block_entry(found.get(user_id, {}))
+        if user_id not in stale:
+            block_cache.put(user_id, entry)
+        elif stale[user_id]['blockVersion'] == entry['blockVersion']:
+            block_cache.renew(user_id)
+        else:
+            block_cache.reload(user_id, entry)
+        blocked[user_id] = entry['blockedUsers']
+    return blocked
+
+def get_inbox_shards(user_id):
+    # From the entry get_blocked_users(_many) just cached for the same user
+    entry = block_cache.peek(user_id)
+    return entry['inboxShards'] if entry else 1
+
+def set_inbox_shards(user_id, shards):
+    entry = block_cache.peek(user_id)
+    if entry is not None:
+        entry['inboxShards'] = shards
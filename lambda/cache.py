@@ -0,0 +1,68 @@
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    # Module-level instances live as long as the warm Lambda container.
+    # Entries are evicted least-recently-used once max_entries is reached and
+    # are reported as stale (not dropped) after ttl seconds, so callers can
+    # revalidate them cheaply instead of reloading.
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.reloads = 0
+        self.evictions = 0
+
+    def get(self, key):
+        # Returns (value, fresh), or None if the key isn't cached
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        value, stored_at = entry
+        if time.monotonic() - stored_at < self.ttl:
+            self.hits += 1
+            return value, True
+        return value, False
+
+    def peek(self, key):
+        # The cached value, fresh or not, without touching the stats or the LRU order
+        entry = self.entries.get(key)
+        return entry[0] if entry else None
+
+    def put(self, key, value):
+        self.entries[key] = (value, time.monotonic())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def renew(self, key):
+        # A stale entry was checked against the source of truth and is still current
+        self.revalidations += 1
+        value, _ = self.entries[key]
+        self.entries[key] = (value, time.monotonic())
+
+    def reload(self, key, value):
+        # A stale entry was out of date and has been fetched again
+        self.reloads += 1
+        self.put(key, value)
+
+    def invalidate(self, key):
+        self.entries.pop(key, None)
+
+    def stats(self):
+        return {
+            'size': len(self.entries),
+            'maxEntries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'revalidations': self.revalidations,
+            'reloads': self.reloads,
+            'evictions': self.evictions
+        }
@@ -1,47 +1,323 @@
 import json
-import boto3
 import os
 import logging
+import functools
+from common import Table, response, internal_error, encode_token, decode_token, parse_limit
+from clock import from_iso
+from ids import max_id, is_id
+from retention import oldest_id
+from fanout import get_executor, read_items
+from shards import shard_keys, base_key
+from metrics import instrument
 
-dynamodb = boto3.resource('dynamodb')
-messages_table = dynamodb.Table(os.environ['MESSAGES_TABLE_NAME'])
+users_table = Table(os.environ['USERS_TABLE_NAME'])
+messages_table = Table(os.environ['MESSAGES_TABLE_NAME'])
+messages_index_name = os.environ.get('MESSAGES_INDEX_NAME', 'inbox-index')
+group_messages_table = Table(os.environ['GROUP_MESSAGES_TABLE_NAME'])
+groups_table = Table(os.environ['GROUPS_TABLE_NAME'])
+memberships_table = Table(os.environ['MEMBERSHIPS_TABLE_NAME'])
+
+DEFAULT_LIMIT = 50
+
+# Attributes a client can ask for with "fields"; messageId is always returned since it
+# is the merge key and the watermark
+FIELDS = ('messageId', 'senderId', 'recipientId', 'groupId', 'content', 'timestamp', 'sentAt', 'expiresAt')
+# What the compact format returns when no fields are given
+COMPACT_FIELDS = ('messageId', 'senderId', 'groupId', 'content', 'sentAt')
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+def decode_cursor(token, user_id):
+    # A cursor must have the shape read_page gives it: a position per source (inbox
+    # and each group timeline) and a list of finished sources
+    cursor = decode_token(token, user_id)
+    positions = cursor.get('positions', {})
+    done = cursor.get('done', [])
+    if not isinstance(positions, dict) or not isinstance(done, list) or not all(isinstance(source, str) for source in done):
+        raise ValueError('Invalid nextToken')
+    for source, source_position in positions.items():
+        if not valid_position(source, source_position, user_id):
+            raise ValueError('Invalid nextToken')
+    return cursor
+
+def valid_position(source, source_position, user_id):
+    # An inbox shard's position is its query's ExclusiveStartKey, on one of this user's
+    # inbox keys; a timeline's is the last message ID read from it
+    if source == 'inbox' or source.startswith('inbox#'):
+        return (isinstance(source_position, dict) and set(source_position) == {'messageId', 'recipientId', 'inboxKey'}
+                and all(isinstance(value, str) for value in source_position.values())
+                and base_key(source_position['recipientId']) == user_id and is_id(source_position['inboxKey']))
+    return is_id(source_position)
+
+def parse_since(since):
+    # A watermark is the position of the last message seen; an ISO-8601 sentAt is also
+    # accepted and means "everything stored after that millisecond"
+    if since is None or since == '':
+        return None
+    if not isinstance(since, str):
+        raise ValueError('since must be a watermark returned by a previous call')
+    if ':' in since:
+        try:
+            return max_id(from_iso(since))
+        except ValueError:
+            raise ValueError('since must be a watermark returned by a previous call')
+    if not is_id(since):
+        raise ValueError('since must be a watermark returned by a previous call')
+    return since
+
+def parse_fields(fields):
+    # A list or a comma-separated string; None means whole items
+    if fields is None:
+        return None
+    if isinstance(fields, str):
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+    if not isinstance(fields, list) or not fields or any(field not in FIELDS for field in fields):
+        raise ValueError(f"fields must list some of: {', '.join(FIELDS)}")
+    return list(dict.fromkeys(['messageId'] + fields))
+
+def projection(fields):
+    # Every name goes through a placeholder: timestamp is a DynamoDB reserved word
+    names = {f'#f{i}': field for i, field in enumerate(fields)}
+    return {
+        'ProjectionExpression': ', '.join(names),
+        'ExpressionAttributeNames': names
+    }
+
+def to_compact(messages, fields):
+    # One array per field instead of one object per message. Senders and groups are
+    # listed once and referenced by index (group is null for direct messages), and
+    # recipientId is left out since it is always the caller.
+    senders = {}
+    groups = {}
+    columns = {}
+    for field in fields:
+        if field == 'recipientId':
+            continue
+        if field == 'senderId':
+            columns['sender'] = [senders.setdefault(message.get('senderId'), len(senders)) for message in messages]
+        elif field == 'groupId':
+            columns['group'] = [groups.setdefault(message['groupId'], len(groups)) if 'groupId' in message else None
+                                for message in messages]
+        else:
+            columns[field] = [message.get(field) for message in messages]
+    return {
+        'senders': list(senders),
+        'groups': list(groups),
+        'columns': columns
+    }
+
+def get_user_state(user_id):
+    # deliveredCursor is set by /messages/ack and polls start after it; inboxShards is
+    # how many shards a hot inbox is spread over
+    result = users_table.get_item(
+        Key={'userId': user_id},
+        ProjectionExpression='deliveredCursor, inboxShards'
+    )
+    item = result.get('Item', {})
+    return item.get('deliveredCursor'), item.get('inboxShards', 1)
+
+def get_memberships(user_id):
+    memberships = []
+    query_args = {
+        'KeyConditionExpression': 'userId = :userId',
+        'ExpressionAttributeValues': {':userId': user_id},
+        'ProjectionExpression': 'groupId, readCursor'
+    }
+    while True:
+        result = memberships_table.query(**query_args)
+        memberships.extend(result.get('Items', []))
+        if 'LastEvaluatedKey' not in result:
+            return memberships
+        query_args['ExclusiveStartKey'] = result['LastEvaluatedKey']
+
+def get_timeline_shards(group_ids):
+    # Shard counts of the user's groups that have a timeline, one BatchGetItem per 100
+    # groups; groups that fan out on write have nothing on theirs to query
+    if not group_ids:
+        return {}
+    items = read_items(
+        groups_table.name,
+        [{'groupId': group_id} for group_id in group_ids],
+        ProjectionExpression='groupId, timelineShards, hasTimeline'
+    )
+    return {item['groupId']: item.get('timelineShards', 1) for item in items if item.get('hasTimeline')}
+
+def query_inbox(key, since, start_key, limit, fields=None):
+    # Inbox rows sort by inboxKey, assigned when the row was written (see jobs)
+    query_args = {
+        'IndexName': messages_index_name,
+        'KeyConditionExpression': 'recipientId = :recipientId',
+        'ExpressionAttributeValues': {':recipientId': key},
+        'Limit': limit
+    }
+    if fields:
+        query_args.update(projection(fields + ['inboxKey']))
+    if since:
+        query_args['KeyConditionExpression'] += ' AND inboxKey > :since'
+        query_args['ExpressionAttributeValues'][':since'] = since
+    if start_key:
+        query_args['ExclusiveStartKey'] = start_key
+    result = messages_table.query(**query_args)
+    return result.get('Items', []), 'LastEvaluatedKey' in result
+
+def query_timeline(key, after, limit, fields=None):
+    query_args = {
+        'KeyConditionExpression': 'groupId = :groupId AND messageId > :after',
+        'ExpressionAttributeValues': {':groupId': key, ':after': after},
+        'Limit': limit
+    }
+    if fields:
+        query_args.update(projection(fields))
+    result = group_messages_table.query(**query_args)
+    return result.get('Items', []), 'LastEvaluatedKey' in result
+
+def gather(queries):
+    # Runs {source: query} concurrently on the shared pool and returns {source: result}
+    if len(queries) < 2:
+        return {source: query() for source, query in queries.items()}
+    return dict(zip(queries, get_executor().map(lambda query: query(), queries.values())))
+
+def position(source_is_inbox, item):
+    # Where a row sorts in its source: an inbox row's inboxKey, a timeline row's
+    # messageId (timeline rows are written as the message is sent). Both are IDs from
+    # ids.new_id, so they merge into one order and one watermark covers every source.
+    return item['inboxKey'] if source_is_inbox else item['messageId']
+
+def read_page(user_id, since, cursor, limit, fields=None):
+    # Merges the direct inbox with the timelines of fan-out-on-read groups, each of
+    # them possibly spread over shards. Every source (one per shard) is read from its
+    # own position, all at once, the results are merged by position, and every
+    # source's position is advanced past what was returned. Returns the messages, the
+    # next cursor and the position of the last message (the watermark).
+    positions = cursor.get('positions', {})
+    done = set(cursor.get('done', []))
+    delivered_cursor, inbox_shards = get_user_state(user_id)
+    # Skip what the user has acknowledged, and rows past their retention that may
+    # linger until TTL deletes them
+    for floor in (delivered_cursor, oldest_id()):
+        if floor and (not since or since < floor):
+            since = floor
+
+    queries = {}
+    inbox_keys = {}
+    for shard, key in enumerate(shard_keys(user_id, inbox_shards)):
+        source = 'inbox' if shard == 0 else f'inbox#{shard}'
+        inbox_keys[source] = key
+        if source not in done:
+            queries[source] = functools.partial(query_inbox, key, since, positions.get(source), limit, fields)
+    memberships = get_memberships(user_id)
+    timeline_shards = get_timeline_shards([membership['groupId'] for membership in memberships])
+    for membership in memberships:
+        group_id = membership['groupId']
+        if group_id not in timeline_shards:
+            continue
+        # A timeline shard's source name is its key: the group ID, then group ID#n
+        for key in shard_keys(group_id, timeline_shards[group_id]):
+            if key in done:
+                continue
+            after = positions.get(key, membership['readCursor'])
+            if since:
+                after = max(after, since)
+            queries[key] = functools.partial(query_timeline, key, after, limit, fields)
+    fetched = gather(queries)
+
+    # Rows carry their shard's key; clients see the plain IDs
+    for source, (items, _) in fetched.items():
+        for item in items:
+            if source in inbox_keys:
+                if 'recipientId' in item:
+                    item['recipientId'] = user_id
+            else:
+                if 'groupId' in item:
+                    item['groupId'] = base_key(item['groupId'])
+                if not fields or 'recipientId' in fields:
+                    item['recipientId'] = user_id
+
+    merged = sorted(
+        ((position(source in inbox_keys, item), source, item)
+         for source, (items, _) in fetched.items() for item in items),
+        key=lambda entry: entry[0]
+    )
+    page = merged[:limit]
+    last = page[-1][0] if page else None
+
+    consumed = {}
+    for _, source, item in page:
+        consumed[source] = consumed.get(source, 0) + 1
+    for source, (items, more) in fetched.items():
+        count = consumed.get(source, 0)
+        if count == len(items) and not more:
+            done.add(source)
+        elif count:
+            last_item = items[count - 1]
+            if source in inbox_keys:
+                positions[source] = {'messageId': last_item['messageId'], 'recipientId': inbox_keys[source],
+                                     'inboxKey': last_item['inboxKey']}
+            else:
+                positions[source] = last_item['messageId']
+
+    messages = [item for _, _, item in page]
+    if fields and 'inboxKey' not in fields:
+        for _, source, item in page:
+            if source in inbox_keys:
+                item.pop('inboxKey', None)
+    if all(source in done for source in fetched):
+        return messages, None, last
+    return messages, {'userId': user_id, 'positions': positions, 'done': sorted(done)}, last
+
+@instrument
 def handler(event, context):
     try:
-        logger.info(f"Received event: {json.dumps(event)}")
-        
         body = json.loads(event['body'])
         user_id = body['userId']
-        
-        response = messages_table.scan(
-            FilterExpression='recipientId = :recipientId',
-            ExpressionAttributeValues={':recipientId': user_id}
-        )
-        
-        messages = response.get('Items', [])
-        
-        if not messages:
-            return {
-                'statusCode': 200,
-                'body': json.dumps({
-                    'message': 'No messages found for this user.'
-                })
+
+        try:
+            limit = parse_limit(body.get('limit', DEFAULT_LIMIT))
+            since = parse_since(body.get('since'))
+            fields = parse_fields(body.get('fields'))
+            output = body.get('format', 'full')
+            if output not in ('full', 'compact'):
+                raise ValueError('format must be full or compact')
+            if output == 'compact' and fields is None:
+                fields = list(COMPACT_FIELDS)
+            cursor = {}
+            if body.get('nextToken'):
+                cursor = decode_cursor(body['nextToken'], user_id)
+        except ValueError as e:
+            return response(400, {
+                'message': str(e)
+            })
+
+        messages, next_cursor, last = read_page(user_id, since, cursor, limit, fields)
+        next_token = encode_token(next_cursor) if next_cursor else None
+        # Pages are in position order, so the newest position seen so far is on the last page
+        watermark = last or since
+
+        if output == 'compact':
+            page = {
+                'format': 'compact',
+                'count': len(messages)
             }
-        
-        return {
-            'statusCode': 200,
-            'body': json.dumps(messages)
-        }
+            page.update(to_compact(messages, fields))
+            page['nextToken'] = next_token
+            page['watermark'] = watermark
+            return response(200, page)
+
+        if not messages:
+            return response(200, {
+                'message': 'No messages found for this user.',
+                'messages': [],
+                'nextToken': next_token,
+                'watermark': watermark
+            })
+
+        return response(200, {
+            'messages': messages,
+            'nextToken': next_token,
+            'watermark': watermark
+        })
     except Exception as e:
         logger.error(f"Error checking messages: {e}")
-        return {
-            'statusCode': 500,
-            'body': json.dumps({
-                'message': 'Internal server error',
-                'error': str(e)
-            })
-        }
+        return internal_error(e)
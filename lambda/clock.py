@@ -0,0 +1,26 @@
+import threading
+import time
+from datetime import datetime, timezone
+
+_lock = threading.Lock()
+_last_ms = 0
+
+def now_ms():
+    # Milliseconds since the epoch, strictly increasing within a container: if the
+    # clock hasn't moved on (or went backwards) the last value is bumped by 1ms,
+    # which keeps "since" watermarks from skipping messages sent in the same millisecond.
+    global _last_ms
+    with _lock:
+        _last_ms = max(time.time_ns() // 1000000, _last_ms + 1)
+        return _last_ms
+
+def to_iso(ms):
+    # UTC with millisecond precision, e.g. 2024-05-01T12:00:00.123Z, so values sort as strings
+    return datetime.fromtimestamp(ms / 1000, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+def from_iso(value):
+    moment = datetime.strptime(value.rstrip('Z'), '%Y-%m-%dT%H:%M:%S.%f').replace(tzinfo=timezone.utc)
+    return int(moment.timestamp() * 1000 + 0.5)
+
+def now_iso():
+    return to_iso(now_ms())
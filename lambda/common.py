@@ -0,0 +1,232 @@
+import os
+import json
+import time
+import base64
+import logging
+from decimal import Decimal
+import metrics
+
+# Shared plumbing for the handlers: one lazily built low-level DynamoDB client,
+# a thin Table wrapper that speaks plain Python values, the JSON response helper,
+# and the nextToken and limit parsing shared by the list handlers.
+#
+# boto3 is imported on first use rather than at module load, and the low-level
+# client is used instead of boto3.resource: the resource layer adds tens of
+# milliseconds to every cold start and runs the generic TypeSerializer on each call.
+
+_client = None
+
+def get_client():
+    global _client
+    if _client is None:
+        import boto3
+        from botocore.config import Config
+        _client = boto3.session.Session().client('dynamodb', config=Config(
+            # Fan-out writers share this client across threads
+            max_pool_connections=int(os.environ.get('DYNAMODB_MAX_POOL_CONNECTIONS', '50')),
+            tcp_keepalive=True,
+            connect_timeout=2,
+            read_timeout=5,
+            retries={'mode': 'standard', 'max_attempts': 4}
+        ))
+    return _client
+
+def use_client(client):
+    # Swaps in another client (e.g. a local stand-in); None goes back to the real one
+    global _client
+    _client = client
+
+# Lambda initializes provisioned-concurrency environments before any request reaches
+# them, so there the client (boto3's import and the service model load, most of a cold
+# start) is built at init instead of on the first request
+PREWARM = os.environ.get('AWS_LAMBDA_INITIALIZATION_TYPE') == 'provisioned-concurrency'
+if PREWARM:
+    get_client()
+
+def call(operation, params):
+    # Every DynamoDB request goes through here so metrics can time it; inside an
+    # instrumented handler the request also asks for its consumed capacity
+    if metrics.wants_capacity():
+        params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+    start = time.perf_counter()
+    try:
+        response = getattr(get_client(), operation)(**params)
+    except Exception as e:
+        # Failed conditions are part of normal control flow, not errors
+        failed = error_code(e) != 'ConditionalCheckFailedException'
+        metrics.record_call(operation, (time.perf_counter() - start) * 1000, failed=failed)
+        raise
+    metrics.record_call(operation, (time.perf_counter() - start) * 1000, response.get('ConsumedCapacity'))
+    return response
+
+class ConditionFailed(Exception):
+    # Raised for ConditionalCheckFailedException; item is the old item when the call
+    # asked for ReturnValuesOnConditionCheckFailure='ALL_OLD' and the item existed
+    def __init__(self, item=None):
+        super().__init__('The conditional request failed')
+        self.item = item
+
+def error_code(e):
+    # The AWS error code of a botocore ClientError (or a stand-in's), else None
+    response = getattr(e, 'response', None)
+    if isinstance(response, dict):
+        return response.get('Error', {}).get('Code')
+    return None
+
+def serialize(value):
+    if isinstance(value, str):
+        return {'S': value}
+    if isinstance(value, bool):
+        return {'BOOL': value}
+    if isinstance(value, (int, Decimal)):
+        return {'N': str(value)}
+    if isinstance(value, float):
+        return {'N': repr(value)}
+    if isinstance(value, dict):
+        return {'M': {k: serialize(v) for k, v in value.items()}}
+    if isinstance(value, (list, tuple)):
+        return {'L': [serialize(v) for v in value]}
+    if isinstance(value, (set, frozenset)):
+        if not value:
+            raise ValueError('DynamoDB cannot store an empty set')
+        sample = next(iter(value))
+        if isinstance(sample, str):
+            return {'SS': list(value)}
+        if isinstance(sample, (bytes, bytearray)):
+            return {'BS': [bytes(v) for v in value]}
+        return {'NS': [str(v) for v in value]}
+    if value is None:
+        return {'NULL': True}
+    if isinstance(value, (bytes, bytearray)):
+        return {'B': bytes(value)}
+    raise TypeError(f'Unsupported type for DynamoDB: {type(value).__name__}')
+
+def to_number(value):
+    # Integers come back as int (what the handlers and json.dumps want); anything
+    # with a fraction or exponent stays an exact Decimal
+    if '.' in value or 'e' in value or 'E' in value:
+        return Decimal(value)
+    return int(value)
+
+_DESERIALIZERS = {
+    'S': lambda v: v,
+    'N': to_number,
+    'BOOL': lambda v: v,
+    'NULL': lambda v: None,
+    'B': lambda v: v,
+    'M': lambda v: {k: deserialize(x) for k, x in v.items()},
+    'L': lambda v: [deserialize(x) for x in v],
+    'SS': set,
+    'NS': lambda v: {to_number(x) for x in v},
+    'BS': set,
+}
+
+def deserialize(value):
+    for kind, data in value.items():
+        return _DESERIALIZERS[kind](data)
+
+def serialize_item(item):
+    return {k: serialize(v) for k, v in item.items()}
+
+def deserialize_item(item):
+    return {k: deserialize(v) for k, v in item.items()}
+
+class Table:
+    # Mirrors the boto3 Table methods the handlers use (same keyword arguments, plain
+    # Python values in and out), but on top of the shared low-level client.
+    # Expressions must be strings; there is no boto3.dynamodb.conditions support.
+
+    def __init__(self, name):
+        self.name = name
+
+    def call(self, operation, kwargs):
+        params = {'TableName': self.name}
+        for name, value in kwargs.items():
+            if name in ('Key', 'Item', 'ExclusiveStartKey', 'ExpressionAttributeValues'):
+                value = serialize_item(value)
+            params[name] = value
+        try:
+            response = call(operation, params)
+        except Exception as e:
+            if error_code(e) == 'ConditionalCheckFailedException':
+                old = e.response.get('Item')
+                raise ConditionFailed(deserialize_item(old) if old else None) from e
+            raise
+        for name in ('Item', 'Attributes', 'LastEvaluatedKey'):
+            if name in response:
+                response[name] = deserialize_item(response[name])
+        if 'Items' in response:
+            response['Items'] = [deserialize_item(item) for item in response['Items']]
+        return response
+
+    def get_item(self, **kwargs):
+        return self.call('get_item', kwargs)
+
+    def put_item(self, **kwargs):
+        return self.call('put_item', kwargs)
+
+    def update_item(self, **kwargs):
+        return self.call('update_item', kwargs)
+
+    def delete_item(self, **kwargs):
+        return self.call('delete_item', kwargs)
+
+    def query(self, **kwargs):
+        return self.call('query', kwargs)
+
+    def scan(self, **kwargs):
+        return self.call('scan', kwargs)
+
+def json_default(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(value).decode('ascii')
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+def dumps(body):
+    return json.dumps(body, default=json_default)
+
+def response(status_code, body):
+    return {
+        'statusCode': status_code,
+        'body': dumps(body)
+    }
+
+def internal_error(e):
+    logging.getLogger().error(f"Unhandled error: {e!r}")
+    return response(500, {
+        'message': 'Internal server error',
+        'error': str(e)
+    })
+
+# Paging for the list handlers. A nextToken is a JSON cursor, base64url-encoded
+# and opaque to clients; it is only valid for the user it was issued to.
+MAX_LIMIT = 100
+
+def encode_token(cursor):
+    raw = json.dumps(cursor, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_token(token, user_id):
+    # The cursor, if token holds one issued for user_id; each handler checks the rest
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+    except (ValueError, TypeError, AttributeError):
+        raise ValueError('Invalid nextToken')
+    if not isinstance(cursor, dict) or cursor.get('userId') != user_id:
+        raise ValueError('Invalid nextToken')
+    return cursor
+
+def parse_limit(limit):
+    # An integer (or a string of one) from 1 to MAX_LIMIT; null, lists and the like
+    # make int() raise TypeError rather than ValueError
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        limit = 0
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ValueError(f'limit must be an integer between 1 and {MAX_LIMIT}')
+    return limit
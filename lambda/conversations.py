@@ -0,0 +1,101 @@
+import os
+import logging
+from common import Table, ConditionFailed
+from fanout import get_executor
+
+logger = logging.getLogger()
+
+# Conversation summaries for the chat list, kept up to date by the send handlers so
+# /conversations reads one row per conversation instead of every message.
+#
+# A direct conversation has a row for each side: userId plus conversationKey
+# user#<counterpart>. A group has a single summary row (userId and conversationKey
+# both group#<groupId>) rather than one per member, so a send to a 10,000-member group
+# still updates one item; /conversations finds a user's groups through memberships.
+# Every row holds the last message (ID, sender, preview, sentAt) and a message count.
+# The recency-index LSI sorts a user's rows by lastMessageId, which is time-ordered.
+#
+# Summaries are best effort: the message is already stored when they are updated, so
+# a failed update is logged and the row catches up with the next message.
+CONVERSATIONS_TABLE_NAME = os.environ.get('CONVERSATIONS_TABLE_NAME', '')
+CONVERSATIONS_INDEX_NAME = os.environ.get('CONVERSATIONS_INDEX_NAME', 'recency-index')
+PREVIEW_LENGTH = 100
+
+conversations_table = Table(CONVERSATIONS_TABLE_NAME) if CONVERSATIONS_TABLE_NAME else None
+
+def direct_key(user_id):
+    return f'user#{user_id}'
+
+def group_key(group_id):
+    return f'group#{group_id}'
+
+def enabled():
+    return conversations_table is not None
+
+def summarize(key, message, attributes):
+    # Counts the message and, unless the row already shows a newer one (sends can finish
+    # out of order), makes it the row's last message
+    values = {
+        ':messageId': message['messageId'],
+        ':senderId': message['senderId'],
+        ':preview': message['content'][:PREVIEW_LENGTH],
+        ':sentAt': message['sentAt'],
+        ':one': 1
+    }
+    assignments = ['lastMessageId = :messageId', 'lastSenderId = :senderId', 'preview = :preview', 'lastSentAt = :sentAt']
+    for i, (name, value) in enumerate(attributes.items()):
+        assignments.append(f'{name} = :a{i}')
+        values[f':a{i}'] = value
+    try:
+        conversations_table.update_item(
+            Key=key,
+            UpdateExpression=f"SET {', '.join(assignments)} ADD messageCount :one",
+            ConditionExpression='attribute_not_exists(lastMessageId) OR lastMessageId < :messageId',
+            ExpressionAttributeValues=values
+        )
+    except ConditionFailed:
+        conversations_table.update_item(
+            Key=key,
+            UpdateExpression='ADD messageCount :one',
+            ExpressionAttributeValues={':one': 1}
+        )
+
+def direct_updates(message):
+    # (key, attributes) for both sides of a direct message; a note to self has one side
+    sender_id = message['senderId']
+    recipient_id = message['recipientId']
+    updates = [({'userId': sender_id, 'conversationKey': direct_key(recipient_id)},
+                {'conversationType': 'direct', 'withUserId': recipient_id})]
+    if recipient_id != sender_id:
+        updates.append(({'userId': recipient_id, 'conversationKey': direct_key(sender_id)},
+                        {'conversationType': 'direct', 'withUserId': sender_id}))
+    return [(key, message, attributes) for key, attributes in updates]
+
+def apply(updates, update_function=None):
+    # Runs update_function (summarize by default) on every argument tuple, concurrently;
+    # failures are logged, never raised
+    update_function = update_function or summarize
+    def run(update):
+        try:
+            update_function(*update)
+        except Exception as e:
+            logger.warning(f"Could not update conversation {update[0]}: {e!r}")
+    if len(updates) < 2:
+        for update in updates:
+            run(update)
+    else:
+        list(get_executor().map(run, updates))
+
+def record_direct(messages):
+    # Updates both sides of every direct message, concurrently
+    if enabled():
+        apply([update for message in messages for update in direct_updates(message)])
+
+def record_group(message, group_name=None):
+    if not enabled():
+        return
+    key = group_key(message['groupId'])
+    attributes = {'conversationType': 'group', 'groupId': message['groupId']}
+    if group_name:
+        attributes['groupName'] = group_name
+    apply([({'userId': key, 'conversationKey': key}, message, attributes)])
@@ -1,24 +1,56 @@
 import json
 import uuid
-import boto3
 import os
+from common import Table, response, serialize_item
+from clock import now_ms
+from ids import min_id
+from fanout import FANOUT_CONCURRENCY, write_requests_concurrently
+from metrics import instrument
 
-dynamodb = boto3.resource('dynamodb')
-groups_table = dynamodb.Table(os.environ['GROUPS_TABLE_NAME'])
+groups_table = Table(os.environ['GROUPS_TABLE_NAME'])
+memberships_table = Table(os.environ['MEMBERSHIPS_TABLE_NAME'])
 
+@instrument
 def handler(event, context):
     body = json.loads(event['body'])
     group_id = str(uuid.uuid4())
+    # A string would otherwise become a set of its characters
+    if not isinstance(body.get('members'), list) or not all(isinstance(member_id, str) and member_id for member_id in body['members']):
+        return response(400, {
+            'message': 'members must be a list of user IDs'
+        })
+    members = set(body['members'])
     group = {
         'groupId': group_id,
         'groupName': body['groupName'],
-        'members': body['members']  # Expecting a list of user IDs
+        # Bumped by every membership change so cached member sets can be revalidated
+        'membershipVersion': 1,
+        # Every member gets a membership row below (see groups)
+        'hasMemberships': True
     }
+    # Members are a string set so add/remove can be single ADD/DELETE updates;
+    # DynamoDB doesn't store empty sets, so an empty group has no attribute yet
+    if members:
+        group['members'] = members
     groups_table.put_item(Item=group)
-    return {
-        'statusCode': 200,
-        'body': json.dumps({
-            'message': 'Group created successfully',
-            'groupId': group_id
+    # Membership rows let check_messages find the user's group timelines;
+    # members only see timeline messages sent after they joined
+    joined_at = min_id(now_ms())
+    failures = []
+    write_requests_concurrently(memberships_table.name, [{'PutRequest': {'Item': serialize_item({
+        'userId': member_id,
+        'groupId': group_id,
+        'readCursor': joined_at
+    })}} for member_id in members], FANOUT_CONCURRENCY, failures)
+    if failures:
+        # The group exists, but these members can't see its timeline or ack it until
+        # /group/add-user writes their rows; it is safe to repeat for any of them
+        return response(207, {
+            'message': 'Group created, but some memberships could not be written',
+            'groupId': group_id,
+            'failedMembers': sorted(request['PutRequest']['Item']['userId']['S'] for request in failures)
         })
-    }
+    return response(200, {
+        'message': 'Group created successfully',
+        'groupId': group_id
+    })
@@ -0,0 +1,160 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from common import call, error_code, serialize_item, deserialize_item
+
+# BatchWriteItem accepts at most 25 put/delete requests per call, BatchGetItem 100 keys
+BATCH_SIZE = 25
+GET_BATCH_SIZE = 100
+# Consecutive calls that may come back with nothing written before giving up
+MAX_ATTEMPTS = 6
+BASE_DELAY = 0.05
+MAX_DELAY = 1.0
+# Concurrent BatchWriteItem calls for a group fan-out (1 writes serially); keep it at or
+# below DYNAMODB_MAX_POOL_CONNECTIONS so the shards share the client's connection pool
+FANOUT_CONCURRENCY = max(1, int(os.environ.get('FANOUT_CONCURRENCY', '8')))
+
+_executor = None
+
+def get_executor():
+    # One pool per container, reused by every invocation it serves
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=FANOUT_CONCURRENCY, thread_name_prefix='fanout')
+    return _executor
+
+class AdaptiveLimit:
+    # AIMD backpressure shared by the shards of one fan-out. Every throttled call
+    # (UnprocessedItems or a throughput error) halves the number of calls allowed in
+    # flight and pauses all shards for a jittered, growing delay; every clean call adds
+    # 1/limit, so about one slot per round of calls.
+    def __init__(self, maximum):
+        self.maximum = maximum
+        self.limit = float(maximum)
+        self.active = 0
+        self.streak = 0
+        self.resume_at = 0.0
+        self.throttled = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                pause = self.resume_at - time.monotonic()
+                if pause > 0:
+                    self.condition.wait(pause)
+                elif self.active < int(self.limit):
+                    break
+                else:
+                    self.condition.wait()
+            self.active += 1
+
+    def release(self, throttled):
+        with self.condition:
+            self.active -= 1
+            if throttled:
+                self.throttled += 1
+                self.limit = max(1.0, self.limit / 2)
+                delay = random.uniform(0, min(MAX_DELAY, BASE_DELAY * (2 ** self.streak)))
+                self.resume_at = max(self.resume_at, time.monotonic() + delay)
+                self.streak += 1
+            else:
+                self.streak = 0
+                self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+def backoff(attempt):
+    # Full jitter: sleep a random amount up to the exponential cap
+    time.sleep(random.uniform(0, min(MAX_DELAY, BASE_DELAY * (2 ** attempt))))
+
+def write_requests(table_name, requests, limit=None, failures=None):
+    # Sends serialized put/delete requests 25 at a time and returns how many could not
+    # be written; with a failures list, the requests themselves are added to it.
+    # UnprocessedItems go back on the queue and are retried together with the
+    # remaining requests, so a partially throttled batch doesn't stall the rest.
+    # With an AdaptiveLimit, each call waits for a slot and reports whether it was
+    # throttled, and the limit's shared pause replaces the per-call backoff.
+    pending = deque(requests)
+    failed = 0
+    attempt = 0
+    while pending:
+        batch = [pending.popleft() for _ in range(min(BATCH_SIZE, len(pending)))]
+        if limit is not None:
+            limit.acquire()
+        try:
+            response = call('batch_write_item', {'RequestItems': {table_name: batch}})
+        except Exception as e:
+            if limit is not None:
+                limit.release(throttled=True)
+            if error_code(e) is None:
+                raise
+            # botocore has already retried throttling errors by the time this is raised
+            failed += len(batch)
+            if failures is not None:
+                failures.extend(batch)
+            continue
+        unprocessed = (response.get('UnprocessedItems') or {}).get(table_name, [])
+        if limit is not None:
+            limit.release(throttled=bool(unprocessed))
+        if not unprocessed:
+            attempt = 0
+            continue
+        # Only calls that wrote nothing count towards giving up; a partially throttled
+        # call still made progress, but backs off a little less each time it repeats
+        attempt = attempt + 1 if len(unprocessed) == len(batch) else max(0, attempt - 1)
+        if attempt >= MAX_ATTEMPTS:
+            failed += len(unprocessed) + len(pending)
+            if failures is not None:
+                failures.extend(unprocessed)
+                failures.extend(pending)
+            break
+        pending.extend(unprocessed)
+        if limit is None:
+            backoff(attempt)
+    return failed
+
+def write_requests_concurrently(table_name, requests, concurrency, failures=None):
+    # Splits requests into up to `concurrency` shards of whole batches and writes them
+    # on the shared pool; the shards share one AdaptiveLimit, so throttling anywhere
+    # slows all of them down
+    concurrency = max(1, min(concurrency, FANOUT_CONCURRENCY))
+    batches = -(-len(requests) // BATCH_SIZE)
+    if concurrency == 1 or batches < 2:
+        return write_requests(table_name, requests, failures=failures)
+    shard_size = -(-batches // concurrency) * BATCH_SIZE
+    shards = [requests[start:start + shard_size] for start in range(0, len(requests), shard_size)]
+    limit = AdaptiveLimit(len(shards))
+    futures = [get_executor().submit(write_requests, table_name, shard, limit, failures) for shard in shards]
+    return sum(future.result() for future in futures)
+
+def write_items(table, items, concurrency=1):
+    # Writes items with BatchWriteItem and returns (written, failed) counts
+    requests = [{'PutRequest': {'Item': serialize_item(item)}} for item in items]
+    failed = write_requests_concurrently(table.name, requests, concurrency)
+    return len(requests) - failed, failed
+
+def read_items(table_name, keys, **params):
+    # Fetches keys with BatchGetItem, 100 per call, and returns the items found in no
+    # particular order; params (e.g. ProjectionExpression) apply to every call. Keys
+    # must be unique. UnprocessedKeys are retried with backoff, and keys still unread
+    # after MAX_ATTEMPTS raise, since callers can't tell them from missing items.
+    pending = deque(serialize_item(key) for key in keys)
+    items = []
+    attempt = 0
+    while pending:
+        batch = [pending.popleft() for _ in range(min(GET_BATCH_SIZE, len(pending)))]
+        response = call('batch_get_item', {'RequestItems': {table_name: dict(params, Keys=batch)}})
+        items.extend(deserialize_item(item) for item in response.get('Responses', {}).get(table_name, []))
+        unprocessed = ((response.get('UnprocessedKeys') or {}).get(table_name) or {}).get('Keys', [])
+        if not unprocessed:
+            attempt = 0
+            continue
+        attempt += 1
+        if attempt >= MAX_ATTEMPTS:
+            raise RuntimeError(f'{len(unprocessed) + len(pending)} keys could not be read from {table_name}')
+        pending.extend(unprocessed)
+        backoff(attempt)
+    return items
@@ -0,0 +1,68 @@
+import json
+import os
+import logging
+from common import Table
+from fanout import FANOUT_CONCURRENCY, write_items
+from jobs import recipient_rows
+from ids import new_id
+from conversations import group_key, direct_key, record_direct
+from idempotency import mark_once
+from metrics import instrument
+import push
+import unread
+
+messages_table = Table(os.environ['MESSAGES_TABLE_NAME'])
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Drains group fan-out jobs queued by send_group_message. The event source mapping hands
+# over up to batch_size jobs per invocation; a job whose rows could not all be written is
+# reported in batchItemFailures and redelivered on its own. Rows are rebuilt from the job
+# with deterministic keys, so a redelivered or duplicated job just rewrites the same rows.
+# Rows get an inboxKey minted as they are written, not the messageId: by the time a job
+# runs, the recipients may have polled or acknowledged past the messageId, and rows
+# sorted by it would land behind their watermark and never be returned. A redelivered
+# job gets a new key, so rows it rewrites are returned again (clients already drop
+# messageIds they have seen) rather than lost.
+# Once a job's rows are written the message is pushed to the recipients' WebSocket
+# connections (the sender excepted) and counted as unread for them. timelineOnly jobs,
+# queued for groups that fan out on read, skip the write. A redelivered job can push
+# twice, so clients drop messageIds they have already seen; counting is guarded by a
+# mark in the idempotency table so a job counts only once.
+# Direct jobs, queued by send_message_batch, carry messages whose rows are already
+# written; they are pushed, and their summaries and unread counts, which add to what
+# they hold, are guarded by the same kind of mark.
+
+def deliver_direct(messages):
+    push.deliver_each(messages)
+    if mark_once(f"direct#{messages[0]['messageId']}"):
+        record_direct(messages)
+        unread.record([(message['recipientId'], direct_key(message['senderId']))
+                       for message in messages if message['recipientId'] != message['senderId']])
+
+@instrument
+def handler(event, context):
+    failures = []
+    for record in event['Records']:
+        try:
+            job = json.loads(record['body'])
+            if 'messages' in job:
+                deliver_direct(job['messages'])
+                continue
+            message = {key: value for key, value in job.items() if key not in ('recipients', 'timelineOnly')}
+            failed = 0
+            if not job.get('timelineOnly'):
+                _, failed = write_items(messages_table, recipient_rows(message, job['recipients'], new_id()), FANOUT_CONCURRENCY)
+            if not failed:
+                recipients = [user_id for user_id in job['recipients'] if user_id != message['senderId']]
+                push.deliver(recipients, message)
+                # A job's recipients never overlap another job's for the same message
+                if unread.enabled() and mark_once(f"unread#{message['messageId']}#{job['recipients'][0]}"):
+                    unread.record([(user_id, group_key(message['groupId'])) for user_id in recipients])
+        except Exception:
+            logger.exception(f"Fan-out job {record['messageId']} failed")
+            failed = True
+        if failed:
+            failures.append({'itemIdentifier': record['messageId']})
+    return {'batchItemFailures': failures}
@@ -0,0 +1,140 @@
+import os
+import logging
+from common import ConditionFailed, error_code
+from cache import TTLCache
+import metrics
+
+logger = logging.getLogger()
+
+# Group items (name, member set, timelineShards) are served from the warm container for
+# up to GROUP_CACHE_TTL_SECONDS, then revalidated against the group's membershipVersion,
+# which create_group, add_user_to_group and remove_user_from_group bump. Within the TTL
+# a send reads nothing; after it, one GetItem projected to the version (and the shard
+# count, which may grow) decides whether the cached members can be reused. DynamoDB
+# still bills that read by the whole item's size, but it returns and parses a few bytes
+# instead of a member set that grows with the group. Callers that act on the member set
+# itself pass revalidate, and cached entries it is true for are checked on every call:
+# a group that fans out on write copies each message into its members' inboxes, so a
+# stale set would keep delivering to removed members. Groups that fan out on read skip
+# the check, since members read their timelines through membership rows. Like the
+# block cache, its stats go into the metrics record.
+GROUP_CACHE_TTL_SECONDS = float(os.environ.get('GROUP_CACHE_TTL_SECONDS', '10'))
+# Member sets can be large, so fewer entries than the block cache
+GROUP_CACHE_MAX_ENTRIES = int(os.environ.get('GROUP_CACHE_MAX_ENTRIES', '1000'))
+
+group_cache = TTLCache(GROUP_CACHE_MAX_ENTRIES, GROUP_CACHE_TTL_SECONDS)
+metrics.track_cache('Group', group_cache)
+
+def group_entry(item):
+    return {
+        'groupId': item['groupId'],
+        'groupName': item.get('groupName'),
+        'members': frozenset(item.get('members', ())),
+        'membershipVersion': item.get('membershipVersion', 0),
+        'timelineShards': item.get('timelineShards', 1),
+        'hasTimeline': item.get('hasTimeline', False),
+        # Groups created before memberships-table have no membership rows until
+        # migrations/write_memberships.py writes them, and their members couldn't find a
+        # timeline, so such groups fan out on write whatever their size
+        'hasMemberships': item.get('hasMemberships', False)
+    }
+
+def load_group_entry(groups_table, group_id):
+    response = groups_table.get_item(Key={'groupId': group_id})
+    item = response.get('Item')
+    return group_entry(item) if item else None
+
+def get_group(groups_table, group_id, revalidate=None):
+    # The group's entry, or None if there is no such group (misses are not cached);
+    # revalidate(entry) true means a cached entry is checked even within the TTL
+    cached = group_cache.get(group_id)
+    if cached is None:
+        entry = load_group_entry(groups_table, group_id)
+        if entry is not None:
+            group_cache.put(group_id, entry)
+        return entry
+
+    entry, fresh = cached
+    if fresh and not (revalidate and revalidate(entry)):
+        return entry
+
+    # Stale: fetch only the version (and timeline state) and reload the group if it moved
+    response = groups_table.get_item(
+        Key={'groupId': group_id},
+        ProjectionExpression='membershipVersion, timelineShards, hasTimeline'
+    )
+    item = response.get('Item')
+    if item is None:
+        group_cache.invalidate(group_id)
+        return None
+    if item.get('membershipVersion', 0) == entry['membershipVersion']:
+        entry['timelineShards'] = item.get('timelineShards', 1)
+        entry['hasTimeline'] = item.get('hasTimeline', False)
+        group_cache.renew(group_id)
+        return entry
+    entry = load_group_entry(groups_table, group_id)
+    if entry is None:
+        group_cache.invalidate(group_id)
+    else:
+        group_cache.reload(group_id, entry)
+    return entry
+
+def set_timeline_shards(group_id, shards):
+    entry = group_cache.peek(group_id)
+    if entry is not None:
+        entry['timelineShards'] = shards
+
+def mark_timeline(groups_table, group_id):
+    # check_messages only queries the timelines of groups with hasTimeline set, so it
+    # is set before the group's first timeline write, never after
+    groups_table.update_item(
+        Key={'groupId': group_id},
+        UpdateExpression='SET hasTimeline = :true',
+        ExpressionAttributeValues={':true': True}
+    )
+    entry = group_cache.peek(group_id)
+    if entry is not None:
+        entry['hasTimeline'] = True
+
+def members_to_set(groups_table, group_id):
+    # Groups created before members became a string set store a list, which ADD and
+    # DELETE reject. Rewrites such a list as a set in place, unless it changed meanwhile;
+    # returns whether the group had a list
+    item = groups_table.get_item(Key={'groupId': group_id}, ProjectionExpression='members').get('Item') or {}
+    members = item.get('members')
+    if not isinstance(members, list):
+        return False
+    try:
+        if members:
+            groups_table.update_item(
+                Key={'groupId': group_id},
+                UpdateExpression='SET members = :members',
+                ConditionExpression='members = :list',
+                ExpressionAttributeValues={':members': set(members), ':list': members}
+            )
+        else:
+            # DynamoDB doesn't store empty sets
+            groups_table.update_item(
+                Key={'groupId': group_id},
+                UpdateExpression='REMOVE members',
+                ConditionExpression='members = :list',
+                ExpressionAttributeValues={':list': members}
+            )
+        logger.info(f"Converted the member list of group {group_id} to a set")
+    except ConditionFailed:
+        pass
+    return True
+
+def update_members(groups_table, group_id, **params):
+    # An update_item on the group that ADDs to or DELETEs from its member set; a legacy
+    # member list is converted (see members_to_set) and the update tried once more
+    try:
+        return groups_table.update_item(Key={'groupId': group_id}, **params)
+    except Exception as e:
+        if error_code(e) != 'ValidationException' or not members_to_set(groups_table, group_id):
+            raise
+    return groups_table.update_item(Key={'groupId': group_id}, **params)
+
+def invalidate(group_id):
+    # Membership writes in this container take effect here at once, not after the TTL
+    group_cache.invalidate(group_id)
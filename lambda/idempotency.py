@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import logging
+import functools
+from common import Table, ConditionFailed, response
+
+logger = logging.getLogger()
+
+# Idempotency-Key support for the send handlers. Clients retry on timeouts, and without
+# a key every retry is a new message (for a group, a whole new fan-out). With one, the
+# first request claims <scope>#<senderId>#<key> in the idempotency table with a
+# conditional put, runs, and stores its response on the claim; a retry within
+# IDEMPOTENCY_TTL_SECONDS gets that response back and never reaches the handler.
+# A duplicate that arrives while the first is still running is answered with 409, and
+# a claim whose handler died is taken over once IDEMPOTENCY_LOCK_SECONDS have passed.
+# Without IDEMPOTENCY_TABLE_NAME the header is ignored.
+IDEMPOTENCY_TABLE_NAME = os.environ.get('IDEMPOTENCY_TABLE_NAME', '')
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', '86400'))
+# Longer than the slowest send handler's timeout
+IDEMPOTENCY_LOCK_SECONDS = int(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', '60'))
+HEADER = 'idempotency-key'
+MAX_KEY_LENGTH = 255
+
+IN_PROGRESS = 'IN_PROGRESS'
+COMPLETED = 'COMPLETED'
+
+idempotency_table = Table(IDEMPOTENCY_TABLE_NAME) if IDEMPOTENCY_TABLE_NAME else None
+
+def get_key(event):
+    # Header names keep the client's case in REST API events
+    for name, value in (event.get('headers') or {}).items():
+        if name.lower() == HEADER:
+            return value
+    return None
+
+def request_hash(body):
+    # Reusing a key for a different request is a client bug, not a retry
+    try:
+        canonical = json.dumps(json.loads(body), sort_keys=True, separators=(',', ':'))
+    except (TypeError, ValueError):
+        canonical = body or ''
+    # Imported here: loading OpenSSL costs every cold start a millisecond or two, and most
+    # sends carry no key
+    import hashlib
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def replay(record):
+    return {
+        'statusCode': record['statusCode'],
+        'body': record['responseBody'],
+        'headers': {'Idempotent-Replayed': 'true'}
+    }
+
+def claim(record_key, hashed):
+    # Returns (token, None) when this request should run, else (None, the response to return)
+    now = int(time.time())
+    token = os.urandom(16).hex()
+    try:
+        idempotency_table.put_item(
+            Item={
+                'idempotencyKey': record_key,
+                'requestStatus': IN_PROGRESS,
+                'claimToken': token,
+                'requestHash': hashed,
+                'lockedUntil': now + IDEMPOTENCY_LOCK_SECONDS,
+                'expiresAt': now + IDEMPOTENCY_TTL_SECONDS
+            },
+            # TTL deletes lag expiry, so an expired claim counts as absent
+            ConditionExpression='attribute_not_exists(idempotencyKey) OR expiresAt < :now OR '
+                                '(requestStatus = :inProgress AND lockedUntil < :now)',
+            ExpressionAttributeValues={':now': now, ':inProgress': IN_PROGRESS},
+            ReturnValuesOnConditionCheckFailure='ALL_OLD'
+        )
+        return token, None
+    except ConditionFailed as e:
+        existing = e.item or {}
+    if existing.get('requestHash') != hashed:
+        return None, response(422, {
+            'message': 'Idempotency-Key has already been used for a different request'
+        })
+    if existing.get('requestStatus') == COMPLETED:
+        return None, replay(existing)
+    return None, dict(response(409, {
+        'message': 'A request with this Idempotency-Key is still in progress'
+    }), headers={'Retry-After': '1'})
+
+def complete(record_key, token, result):
+    # Stores the response on the claim; only the request holding the claim may
+    try:
+        idempotency_table.update_item(
+            Key={'idempotencyKey': record_key},
+            UpdateExpression='SET requestStatus = :completed, statusCode = :statusCode, responseBody = :body REMOVE lockedUntil',
+            ConditionExpression='claimToken = :token',
+            ExpressionAttributeValues={
+                ':completed': COMPLETED,
+                ':statusCode': result['statusCode'],
+                ':body': result['body'],
+                ':token': token
+            }
+        )
+    except Exception as e:
+        # The message went out either way; a retry after this runs the handler again
+        logger.warning(f"Could not store the response for {record_key}: {e!r}")
+
+def release(record_key, token):
+    # Server errors are not remembered, so the client's retry runs the handler again
+    try:
+        idempotency_table.delete_item(
+            Key={'idempotencyKey': record_key},
+            ConditionExpression='claimToken = :token',
+            ExpressionAttributeValues={':token': token}
+        )
+    except Exception as e:
+        logger.warning(f"Could not release {record_key}: {e!r}")
+
+def mark_once(record_key):
+    # True the first time record_key is marked within IDEMPOTENCY_TTL_SECONDS (always
+    # True without the table); guards side effects of queue jobs SQS may deliver twice
+    if idempotency_table is None:
+        return True
+    now = int(time.time())
+    try:
+        idempotency_table.put_item(
+            Item={
+                'idempotencyKey': record_key,
+                'requestStatus': COMPLETED,
+                'expiresAt': now + IDEMPOTENCY_TTL_SECONDS
+            },
+            ConditionExpression='attribute_not_exists(idempotencyKey) OR expiresAt < :now',
+            ExpressionAttributeValues={':now': now}
+        )
+        return True
+    except ConditionFailed:
+        return False
+
+def idempotent(scope):
+    # Wraps a send handler; requests without an Idempotency-Key header go straight through
+    def decorate(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            key = get_key(event)
+            if key is None or idempotency_table is None:
+                return handler(event, context)
+            if not 0 < len(key) <= MAX_KEY_LENGTH:
+                return response(400, {
+                    'message': f'Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters'
+                })
+            try:
+                body = json.loads(event.get('body') or '{}')
+                sender_id = body.get('senderId') if isinstance(body, dict) else None
+            except ValueError:
+                # The handler rejects the request itself
+                return handler(event, context)
+            # Keys are only unique per client, so they are scoped to the sender
+            record_key = f'{scope}#{sender_id or ""}#{key}'
+            token, early = claim(record_key, request_hash(event.get('body')))
+            if early is not None:
+                return early
+            try:
+                result = handler(event, context)
+            except Exception:
+                release(record_key, token)
+                raise
+            if result.get('statusCode', 500) >= 500:
+                release(record_key, token)
+            else:
+                complete(record_key, token, result)
+            return result
+        return wrapper
+    return decorate
@@ -0,0 +1,54 @@
+import os
+import threading
+from clock import now_ms
+
+# ULID layout: 48-bit millisecond timestamp + 80 random bits, Crockford base32.
+# IDs sort lexicographically in creation order, so they can be used directly as
+# range keys and "after X" becomes a key condition.
+ENCODING = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+TIME_LENGTH = 10
+RANDOM_LENGTH = 16
+RANDOM_MAX = (1 << 80) - 1
+
+_lock = threading.Lock()
+_last_ms = -1
+_last_random = 0
+
+def encode(value, length):
+    chars = []
+    for _ in range(length):
+        value, index = divmod(value, 32)
+        chars.append(ENCODING[index])
+    return ''.join(reversed(chars))
+
+def new_id(ms=None):
+    # Within one millisecond the random part is incremented rather than redrawn,
+    # so IDs from the same container stay unique and ordered
+    global _last_ms, _last_random
+    with _lock:
+        if ms is None:
+            ms = now_ms()
+        if ms == _last_ms and _last_random < RANDOM_MAX:
+            _last_random += 1
+        else:
+            _last_random = int.from_bytes(os.urandom(10), 'big')
+        _last_ms = ms
+        return encode(ms, TIME_LENGTH) + encode(_last_random, RANDOM_LENGTH)
+
+def id_ms(value):
+    ms = 0
+    for char in value[:TIME_LENGTH]:
+        ms = ms * 32 + ENCODING.index(char)
+    return ms
+
+def min_id(ms):
+    # Sorts before every ID created in or after millisecond ms
+    return encode(ms, TIME_LENGTH) + ENCODING[0] * RANDOM_LENGTH
+
+def max_id(ms):
+    # Sorts after every ID created in or before millisecond ms
+    return encode(ms, TIME_LENGTH) + ENCODING[-1] * RANDOM_LENGTH
+
+def is_id(value):
+    return (isinstance(value, str) and len(value) == TIME_LENGTH + RANDOM_LENGTH
+            and all(char in ENCODING for char in value))
@@ -0,0 +1,84 @@
+import os
+from common import dumps, error_code
+
+# Group fan-out jobs: instead of writing every member's inbox row before responding,
+# send_group_message queues jobs of up to FANOUT_JOB_MAX_RECIPIENTS recipients and
+# fanout_worker writes the rows. send_message_batch queues direct jobs, which carry
+# the already written messages themselves, for the pushes, summaries and unread counts
+# that follow them. Queuing is on when FANOUT_QUEUE_URL is set.
+FANOUT_QUEUE_URL = os.environ.get('FANOUT_QUEUE_URL', '')
+# 500 recipient IDs keep a job far below the 256 KB SQS message limit
+FANOUT_JOB_MAX_RECIPIENTS = int(os.environ.get('FANOUT_JOB_MAX_RECIPIENTS', '500'))
+# Direct jobs hold whole messages, so they are also cut at this many bytes of JSON
+FANOUT_JOB_MAX_BYTES = 200 * 1024
+# SendMessageBatch accepts at most 10 messages per call
+SEND_BATCH_SIZE = 10
+
+_client = None
+
+def get_queue_client():
+    global _client
+    if _client is None:
+        import boto3
+        from botocore.config import Config
+        _client = boto3.session.Session().client('sqs', config=Config(
+            tcp_keepalive=True,
+            connect_timeout=2,
+            read_timeout=5,
+            retries={'mode': 'standard', 'max_attempts': 4}
+        ))
+    return _client
+
+def use_queue_client(client):
+    # Swaps in another client (e.g. local.sqs.LocalQueue); None goes back to the real one
+    global _client
+    _client = client
+
+def recipient_rows(message, recipient_ids, inbox_key=None):
+    # One messages-table row per recipient; the key is (messageId, recipientId), so
+    # writing the same rows again leaves the table unchanged. inboxKey sorts the row in
+    # the recipient's inbox-index partition and is what watermarks and the delivered
+    # cursor are compared with, so it must be assigned when the row is written: rows
+    # written while the message is sent reuse the messageId, and fanout_worker, which
+    # may write long after, mints a new one.
+    inbox_key = inbox_key or message['messageId']
+    return [dict(message, recipientId=recipient_id, inboxKey=inbox_key) for recipient_id in recipient_ids]
+
+def fanout_jobs(message, recipient_ids):
+    for start in range(0, len(recipient_ids), FANOUT_JOB_MAX_RECIPIENTS):
+        yield dict(message, recipients=recipient_ids[start:start + FANOUT_JOB_MAX_RECIPIENTS])
+
+def direct_jobs(messages):
+    # A message too large for any job gets one of its own, which the queue rejects
+    job = []
+    size = 0
+    for message in messages:
+        message_size = len(dumps(message)) + 1
+        if job and (len(job) >= FANOUT_JOB_MAX_RECIPIENTS or size + message_size > FANOUT_JOB_MAX_BYTES):
+            yield {'messages': job}
+            job = []
+            size = 0
+        job.append(message)
+        size += message_size
+    if job:
+        yield {'messages': job}
+
+def enqueue(jobs, queue_url=None):
+    # Sends jobs 10 per SendMessageBatch call and returns the ones that were not queued
+    queue_url = queue_url or FANOUT_QUEUE_URL
+    client = get_queue_client()
+    jobs = list(jobs)
+    rejected = []
+    for start in range(0, len(jobs), SEND_BATCH_SIZE):
+        batch = jobs[start:start + SEND_BATCH_SIZE]
+        try:
+            result = client.send_message_batch(QueueUrl=queue_url, Entries=[
+                {'Id': str(index), 'MessageBody': dumps(job)} for index, job in enumerate(batch)
+            ])
+        except Exception as e:
+            if error_code(e) is None:
+                raise
+            rejected.extend(batch)
+            continue
+        rejected.extend(batch[int(entry['Id'])] for entry in result.get('Failed', []))
+    return rejected
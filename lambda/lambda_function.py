@@ -1,5 +1,58 @@
+import importlib
+from common import response, PREWARM
+
+# Single-function mode: API Gateway sends every route here and the event's
+# resource/httpMethod pick the handler module. Modules are imported on first
+# use, so a container only pays for the handlers it actually serves. WebSocket API
+# events have no resource; their requestContext.routeKey picks the handler instead.
+ROUTES = {
+    ('/register', 'POST'): 'register_user',
+    ('/register', 'DELETE'): 'register_user',
+    ('/message', 'POST'): 'send_message',
+    ('/message/batch', 'POST'): 'send_message_batch',
+    ('/block', 'POST'): 'block_user',
+    ('/group', 'POST'): 'create_group',
+    ('/group/message', 'POST'): 'send_group_message',
+    ('/group/add-user', 'POST'): 'add_user_to_group',
+    ('/group/remove-user', 'POST'): 'remove_user_from_group',
+    ('/messages', 'POST'): 'check_messages',
+    ('/messages/ack', 'POST'): 'ack_messages',
+    ('/messages/unread-count', 'POST'): 'unread_count',
+    ('/conversations', 'POST'): 'list_conversations',
+}
+
+WEBSOCKET_ROUTES = {
+    '$connect': 'ws_connect',
+    '$disconnect': 'ws_disconnect',
+}
+
+handlers = {}
+
+def get_handler(module_name):
+    route_handler = handlers.get(module_name)
+    if route_handler is None:
+        route_handler = importlib.import_module(module_name).handler
+        handlers[module_name] = route_handler
+    return route_handler
+
+# A provisioned environment loads every handler during its init instead
+if PREWARM:
+    for module_name in dict.fromkeys([*ROUTES.values(), *WEBSOCKET_ROUTES.values()]):
+        get_handler(module_name)
+
 def handler(event, context):
-    return {
-        'statusCode': 200,
-        'body': "Hello World"
-    }
\ No newline at end of file
+    route_key = (event.get('requestContext') or {}).get('routeKey')
+    if route_key in WEBSOCKET_ROUTES:
+        return get_handler(WEBSOCKET_ROUTES[route_key])(event, context)
+    resource = event.get('resource')
+    http_method = event.get('httpMethod')
+    module_name = ROUTES.get((resource, http_method))
+    if module_name is None:
+        if any(route_resource == resource for route_resource, _ in ROUTES):
+            return response(405, {
+                'message': 'Method Not Allowed'
+            })
+        return response(404, {
+            'message': 'Not Found'
+        })
+    return get_handler(module_name)(event, context)
@@ -0,0 +1,102 @@
+import json
+import os
+from common import Table, response, internal_error, encode_token, decode_token, parse_limit
+from fanout import read_items
+from conversations import CONVERSATIONS_TABLE_NAME, CONVERSATIONS_INDEX_NAME, group_key
+from metrics import instrument
+import unread
+
+conversations_table = Table(CONVERSATIONS_TABLE_NAME)
+memberships_table = Table(os.environ['MEMBERSHIPS_TABLE_NAME'])
+
+DEFAULT_LIMIT = 20
+
+# Returned for every conversation; the rest of a row is bookkeeping
+SUMMARY_FIELDS = ('conversationType', 'withUserId', 'groupId', 'groupName',
+                  'lastMessageId', 'lastSenderId', 'preview', 'lastSentAt', 'messageCount')
+
+def decode_before(token, user_id):
+    before = decode_token(token, user_id).get('before')
+    if not isinstance(before, str):
+        raise ValueError('Invalid nextToken')
+    return before
+
+def query_direct(user_id, before, limit):
+    # The user's direct conversations, newest first, from the recency index
+    query_args = {
+        'IndexName': CONVERSATIONS_INDEX_NAME,
+        'KeyConditionExpression': 'userId = :userId',
+        'ExpressionAttributeValues': {':userId': user_id},
+        'ScanIndexForward': False,
+        'Limit': limit
+    }
+    if before:
+        query_args['KeyConditionExpression'] += ' AND lastMessageId < :before'
+        query_args['ExpressionAttributeValues'][':before'] = before
+    result = conversations_table.query(**query_args)
+    return result.get('Items', []), 'LastEvaluatedKey' in result
+
+def get_group_ids(user_id):
+    group_ids = []
+    query_args = {
+        'KeyConditionExpression': 'userId = :userId',
+        'ExpressionAttributeValues': {':userId': user_id},
+        'ProjectionExpression': 'groupId'
+    }
+    while True:
+        result = memberships_table.query(**query_args)
+        group_ids.extend(item['groupId'] for item in result.get('Items', []))
+        if 'LastEvaluatedKey' not in result:
+            return group_ids
+        query_args['ExclusiveStartKey'] = result['LastEvaluatedKey']
+
+def get_group_summaries(group_ids):
+    # One summary row per group, one BatchGetItem per 100 groups; groups without
+    # messages have no row yet and are left out
+    if not group_ids:
+        return []
+    return read_items(
+        conversations_table.name,
+        [{'userId': group_key(group_id), 'conversationKey': group_key(group_id)} for group_id in group_ids]
+    )
+
+def summary(row, counts):
+    result = {field: row[field] for field in SUMMARY_FIELDS if field in row}
+    result['unread'] = counts.get(row['conversationKey'], 0)
+    return result
+
+@instrument
+def handler(event, context):
+    try:
+        body = json.loads(event['body'])
+        user_id = body['userId']
+
+        try:
+            limit = parse_limit(body.get('limit', DEFAULT_LIMIT))
+            before = decode_before(body['nextToken'], user_id) if body.get('nextToken') else None
+        except ValueError as e:
+            return response(400, {
+                'message': str(e)
+            })
+
+        # Direct rows come sorted from the index; group summaries are few per user and
+        # are merged in on every page. Last message IDs are time-ordered and unique, so
+        # the last one returned is the position of the next page.
+        direct, more = query_direct(user_id, before, limit)
+        groups = [row for row in get_group_summaries(get_group_ids(user_id))
+                  if not before or row['lastMessageId'] < before]
+        merged = sorted(direct + groups, key=lambda row: row['lastMessageId'], reverse=True)
+        page = merged[:limit]
+        more = more or len(merged) > limit
+        counts = unread.get_counters(user_id)[0] if page else {}
+
+        return response(200, {
+            'conversations': [summary(row, counts) for row in page],
+            'nextToken': encode_token({'userId': user_id, 'before': page[-1]['lastMessageId']}) if more and page else None
+        })
+    except KeyError as e:
+        return response(400, {
+            'message': f'Missing required key in request body: {e}'
+        })
+    except Exception as e:
+        return internal_error(e)
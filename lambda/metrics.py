@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import random
+import logging
+import threading
+import functools
+
+logger = logging.getLogger()
+
+# Per-invocation instrumentation. @instrument wraps a handler and, when it returns,
+# writes one CloudWatch embedded metric format (EMF) line to stdout: duration, cold
+# start, status code, and every DynamoDB call made meanwhile (count, latency and the
+# capacity units DynamoDB reported). CloudWatch turns the line into metrics under
+# METRICS_NAMESPACE with a Handler dimension; the rest stays searchable in the log.
+# Container caches registered with track_cache add what they did during the
+# invocation (hits, misses, revalidations, reloads, evictions) and their size.
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') not in ('0', 'false', '')
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'MessageApp')
+# Share of invocations whose full event is logged (0 in production, 1 to debug)
+EVENT_LOG_SAMPLE_RATE = float(os.environ.get('EVENT_LOG_SAMPLE_RATE', '0'))
+# EMF accepts at most 100 values per metric in one record
+MAX_SAMPLES = 100
+
+READ_OPERATIONS = {'get_item', 'query', 'scan', 'batch_get_item'}
+
+cold_start = True
+_current = None
+# {metric name prefix: TTLCache}
+caches = {}
+CACHE_COUNTERS = ('hits', 'misses', 'revalidations', 'reloads', 'evictions')
+
+class Invocation:
+    def __init__(self, handler_name, cold):
+        self.handler_name = handler_name
+        self.cold = cold
+        self.started = time.perf_counter()
+        # Fan-out shards record their calls from pool threads
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.latencies = []
+        self.operations = {}
+        self.rcu = 0.0
+        self.wcu = 0.0
+        self.counts = {}
+        self.cache_stats = {name: cache.stats() for name, cache in caches.items()}
+
+    def add_call(self, operation, elapsed_ms, consumed, failed):
+        with self.lock:
+            self.calls += 1
+            self.errors += failed
+            if len(self.latencies) < MAX_SAMPLES:
+                self.latencies.append(round(elapsed_ms, 2))
+            entry = self.operations.setdefault(operation, {'calls': 0, 'ms': 0.0})
+            entry['calls'] += 1
+            entry['ms'] = round(entry['ms'] + elapsed_ms, 2)
+            if isinstance(consumed, dict):
+                consumed = [consumed]
+            for capacity in consumed or ():
+                if 'ReadCapacityUnits' in capacity or 'WriteCapacityUnits' in capacity:
+                    self.rcu += capacity.get('ReadCapacityUnits', 0)
+                    self.wcu += capacity.get('WriteCapacityUnits', 0)
+                elif operation in READ_OPERATIONS:
+                    self.rcu += capacity.get('CapacityUnits', 0)
+                else:
+                    self.wcu += capacity.get('CapacityUnits', 0)
+
+    def add_count(self, name, value):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def cache_metrics(self):
+        # Per-invocation counts of every cache used during it, e.g. BlockCacheHits, and
+        # its size afterwards (BlockCacheSize)
+        for name, cache in sorted(caches.items()):
+            before = self.cache_stats.get(name) or dict.fromkeys(CACHE_COUNTERS, 0)
+            after = cache.stats()
+            counts = [(counter, after[counter] - before[counter]) for counter in CACHE_COUNTERS]
+            if not any(value for _, value in counts):
+                continue
+            for counter, value in counts:
+                yield f'{name}Cache{counter.capitalize()}', 'Count', value
+            yield f'{name}CacheSize', 'Count', after['size']
+
+    def record(self, status_code, request_id):
+        metrics = [
+            ('Duration', 'Milliseconds', round((time.perf_counter() - self.started) * 1000, 2)),
+            ('ColdStart', 'Count', int(self.cold)),
+            ('DynamoDBCalls', 'Count', self.calls),
+            ('DynamoDBErrors', 'Count', self.errors),
+            ('ConsumedRCU', 'Count', round(self.rcu, 2)),
+            ('ConsumedWCU', 'Count', round(self.wcu, 2)),
+        ]
+        if self.latencies:
+            metrics.append(('DynamoDBLatency', 'Milliseconds', self.latencies))
+        metrics.extend((name, 'Count', value) for name, value in sorted(self.counts.items()))
+        metrics.extend(self.cache_metrics())
+        record = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': METRICS_NAMESPACE,
+                    'Dimensions': [['Handler']],
+                    'Metrics': [{'Name': name, 'Unit': unit} for name, unit, _ in metrics]
+                }]
+            },
+            'Handler': self.handler_name,
+            'StatusCode': status_code,
+            'RequestId': request_id,
+            'DynamoDBOperations': self.operations
+        }
+        for name, _, value in metrics:
+            record[name] = value
+        return record
+
+def record_call(operation, elapsed_ms, consumed=None, failed=False):
+    # Called by common for every DynamoDB request; a no-op outside an instrumented handler
+    invocation = _current
+    if invocation is not None:
+        invocation.add_call(operation, elapsed_ms, consumed, int(failed))
+
+def count(name, value=1):
+    # Adds to a Count metric of the current invocation (e.g. work dropped by a best-effort
+    # path); a no-op outside an instrumented handler
+    invocation = _current
+    if invocation is not None:
+        invocation.add_count(name, value)
+
+def track_cache(name, cache):
+    # Reports cache's stats in every record, as <name>CacheHits and so on
+    caches[name] = cache
+
+def wants_capacity():
+    return _current is not None
+
+def instrument(handler):
+    handler_name = handler.__module__
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        global cold_start, _current
+        # Nested calls (e.g. one handler delegating to another) report as the outer one
+        if not METRICS_ENABLED or _current is not None:
+            return handler(event, context)
+        if EVENT_LOG_SAMPLE_RATE and random.random() < EVENT_LOG_SAMPLE_RATE:
+            logger.info(f"Received event: {json.dumps(event, default=str)}")
+        invocation = Invocation(handler_name, cold_start)
+        cold_start = False
+        _current = invocation
+        status_code = None
+        try:
+            result = handler(event, context)
+            if isinstance(result, dict):
+                status_code = result.get('statusCode')
+            return result
+        finally:
+            _current = None
+            request_id = getattr(context, 'aws_request_id', None)
+            print(json.dumps(invocation.record(status_code, request_id), separators=(',', ':')))
+    return wrapper
@@ -0,0 +1,83 @@
+import os
+import logging
+from common import Table, dumps, error_code
+from fanout import get_executor
+
+logger = logging.getLogger()
+
+# Push delivery over the WebSocket API: send handlers hand new messages to deliver(),
+# which posts them to every live connection of the recipients. Push is best effort;
+# anything it misses is still returned by the next /messages poll. It is off unless
+# WEBSOCKET_ENDPOINT (the https:// connections URL of the WebSocket stage) is set.
+WEBSOCKET_ENDPOINT = os.environ.get('WEBSOCKET_ENDPOINT', '')
+CONNECTIONS_TABLE_NAME = os.environ.get('CONNECTIONS_TABLE_NAME', '')
+# API Gateway closes WebSocket connections after two hours at most
+CONNECTION_TTL_SECONDS = 7200
+
+connections_table = Table(CONNECTIONS_TABLE_NAME) if CONNECTIONS_TABLE_NAME else None
+
+_client = None
+
+def get_push_client():
+    global _client
+    if _client is None:
+        import boto3
+        from botocore.config import Config
+        _client = boto3.session.Session().client('apigatewaymanagementapi', endpoint_url=WEBSOCKET_ENDPOINT, config=Config(
+            tcp_keepalive=True,
+            connect_timeout=1,
+            read_timeout=2,
+            retries={'mode': 'standard', 'max_attempts': 2}
+        ))
+    return _client
+
+def use_push_client(client):
+    # Swaps in another client (e.g. local.websocket.LocalConnectionManager); None goes back to the real one
+    global _client
+    _client = client
+
+def enabled():
+    return bool(WEBSOCKET_ENDPOINT) and connections_table is not None
+
+def get_connection_ids(user_id):
+    result = connections_table.query(
+        KeyConditionExpression='userId = :userId',
+        ExpressionAttributeValues={':userId': user_id},
+        ProjectionExpression='connectionId'
+    )
+    return [item['connectionId'] for item in result.get('Items', [])]
+
+def post(user_id, connection_id, data):
+    try:
+        get_push_client().post_to_connection(ConnectionId=connection_id, Data=data)
+        return True
+    except Exception as e:
+        if error_code(e) == 'GoneException':
+            # The client went away without a clean $disconnect
+            connections_table.delete_item(Key={'userId': user_id, 'connectionId': connection_id})
+        else:
+            logger.warning(f"Push to {connection_id} failed: {e}")
+        return False
+
+def push_to_user(user_id, data):
+    try:
+        return sum(post(user_id, connection_id, data) for connection_id in get_connection_ids(user_id))
+    except Exception as e:
+        logger.warning(f"Push to user {user_id} failed: {e}")
+        return 0
+
+def deliver(user_ids, message):
+    # Returns how many connections the message reached; recipients are looked up
+    # concurrently on the fan-out pool
+    if not enabled() or not user_ids:
+        return 0
+    data = dumps({'type': 'message', 'message': message}).encode('utf-8')
+    if len(user_ids) == 1:
+        return push_to_user(user_ids[0], data)
+    return sum(get_executor().map(lambda user_id: push_to_user(user_id, data), user_ids))
+
+def deliver_each(messages):
+    # Pushes each message to its own recipient (bulk direct messages differ per recipient)
+    if not enabled() or not messages:
+        return 0
+    return sum(get_executor().map(lambda message: deliver([message['recipientId']], message), messages))
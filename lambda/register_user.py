@@ -1,11 +1,12 @@
 import json
 import uuid
-import boto3
 import os
+from common import Table, response, internal_error
+from metrics import instrument
 
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table(os.environ['USERS_TABLE_NAME'])
+table = Table(os.environ['USERS_TABLE_NAME'])
 
+@instrument
 def handler(event, context):
     http_method = event['httpMethod']
     try:
@@ -23,13 +24,10 @@ def handler(event, context):
                 'email': body['email']
             }
             table.put_item(Item=user)
-            return {
-                'statusCode': 200,
-                'body': json.dumps({
-                    'message': 'User registered successfully',
-                    'userId': user_id
-                })
-            }
+            return response(200, {
+                'message': 'User registered successfully',
+                'userId': user_id
+            })
 
         elif http_method == 'DELETE':
             body = json.loads(event['body'])
@@ -40,33 +38,18 @@ def handler(event, context):
 
             user_id = body['userId']
             table.delete_item(Key={'userId': user_id})
-            return {
-                'statusCode': 200,
-                'body': json.dumps({
-                    'message': 'User deleted successfully',
-                    'userId': user_id
-                })
-            }
+            return response(200, {
+                'message': 'User deleted successfully',
+                'userId': user_id
+            })
 
         else:
-            return {
-                'statusCode': 405,
-                'body': json.dumps({
-                    'message': 'Method Not Allowed'
-                })
-            }
-    except KeyError as e:
-        return {
-            'statusCode': 400,
-            'body': json.dumps({
-                'message': str(e)
+            return response(405, {
+                'message': 'Method Not Allowed'
             })
-        }
+    except KeyError as e:
+        return response(400, {
+            'message': str(e)
+        })
     except Exception as e:
-        return {
-            'statusCode': 500,
-            'body': json.dumps({
-                'message': 'Internal server error',
-                'error': str(e)
-            })
-        }
+        return internal_error(e)
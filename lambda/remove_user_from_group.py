@@ -1,74 +1,49 @@
 import json
-import boto3
 import os
+from common import Table, ConditionFailed, response, internal_error
+from groups import invalidate, update_members
+from metrics import instrument
 
-dynamodb = boto3.resource('dynamodb')
-groups_table = dynamodb.Table(os.environ['GROUPS_TABLE_NAME'])
+groups_table = Table(os.environ['GROUPS_TABLE_NAME'])
+memberships_table = Table(os.environ['MEMBERSHIPS_TABLE_NAME'])
 
+@instrument
 def handler(event, context):
     try:
-        # Log the incoming event for debugging
-        print("Received event:", event)
-        
         body = json.loads(event['body'])
         group_id = body['groupId']
         user_id = body['userId']
         
-        # Log the parsed body for debugging
-        print("Parsed body:", body)
-        
-        # Retrieve the current members
-        response = groups_table.get_item(Key={'groupId': group_id})
-        
-        # Log the response from DynamoDB
-        print("DynamoDB get_item response:", response)
-        
-        if 'Item' not in response:
-            return {
-                'statusCode': 404,
-                'body': json.dumps({
-                    'message': 'Group not found',
-                    'groupId': group_id
-                })
-            }
-        
-        # Extract members list correctly
-        members = response['Item'].get('members', [])
-        
-        # Log the current members for debugging
-        print("Current members:", members)
-        
-        # Filter out the user to be removed
-        updated_members = [member for member in members if member != user_id]
-        
-        # Log the updated members for debugging
-        print("Updated members:", updated_members)
+        # Remove the user in a single write; the condition rejects unknown groups and
+        # non-members, and on failure returns the old item so the two can be told apart
+        try:
+            update_members(
+                groups_table, group_id,
+                UpdateExpression="DELETE members :userIds ADD membershipVersion :one",
+                ConditionExpression="attribute_exists(groupId) AND contains(members, :userId)",
+                ExpressionAttributeValues={
+                    ':userIds': {user_id},
+                    ':userId': user_id,
+                    ':one': 1
+                },
+                ReturnValuesOnConditionCheckFailure='ALL_OLD'
+            )
+        except ConditionFailed as e:
+            message = 'User is not a member of this group' if e.item else 'Group not found'
+            return response(404, {
+                'message': message,
+                'groupId': group_id
+            })
         
-        # Update the group with the new list of members
-        response = groups_table.update_item(
-            Key={'groupId': group_id},
-            UpdateExpression="SET members = :updated_members",
-            ExpressionAttributeValues={':updated_members': updated_members}
-        )
+        invalidate(group_id)
         
-        # Log the update response for debugging
-        print("DynamoDB update_item response:", response)
+        # Stop reading the group's timeline for this user
+        memberships_table.delete_item(Key={'userId': user_id, 'groupId': group_id})
         
-        return {
-            'statusCode': 200,
-            'body': json.dumps({
-                'message': 'User removed from group successfully',
-                'groupId': group_id,
-                'userId': user_id
-            })
-        }
+        return response(200, {
+            'message': 'User removed from group successfully',
+            'groupId': group_id,
+            'userId': user_id
+        })
     except Exception as e:
-        # Log the exception for debugging
-        print("Exception:", str(e))
-        return {
-            'statusCode': 500,
-            'body': json.dumps({
-                'message': 'Internal server error',
-                'error': str(e)
-            })
-        }
+        return internal_error(e)
@@ -0,0 +1,21 @@
+import os
+from clock import now_ms
+from ids import min_id
+
+# Messages are kept for MESSAGE_RETENTION_DAYS after they are sent (0 keeps them forever).
+# The send handlers stamp expiresAt (epoch seconds), DynamoDB TTL deletes the row some
+# time after that, and archive_messages ships the deleted row to the archive bucket.
+MESSAGE_RETENTION_DAYS = float(os.environ.get('MESSAGE_RETENTION_DAYS', '30'))
+RETENTION_MS = int(MESSAGE_RETENTION_DAYS * 86400000)
+
+def expires_at(sent_ms):
+    if not RETENTION_MS:
+        return None
+    return (sent_ms + RETENTION_MS) // 1000
+
+def oldest_id():
+    # TTL deletes can lag expiry by a day or two. Message IDs are time-ordered, so reads
+    # start after this ID and never return (or pay for) rows that are already expired.
+    if not RETENTION_MS:
+        return None
+    return min_id(now_ms() - RETENTION_MS)
@@ -1,12 +1,35 @@
 import json
-import uuid
-import boto3
 import os
+from common import Table, response, internal_error
+from clock import now_ms, to_iso
+from ids import new_id
+from retention import expires_at
+from fanout import FANOUT_CONCURRENCY, write_items
+from jobs import FANOUT_QUEUE_URL, recipient_rows, fanout_jobs, enqueue
+from shards import put_sharded, mark_hot
+from groups import get_group, set_timeline_shards, mark_timeline
+from metrics import instrument
+from idempotency import idempotent
+import push
+import conversations
+import unread
 
-dynamodb = boto3.resource('dynamodb')
-messages_table = dynamodb.Table(os.environ['MESSAGES_TABLE_NAME'])
-groups_table = dynamodb.Table(os.environ['GROUPS_TABLE_NAME'])
+messages_table = Table(os.environ['MESSAGES_TABLE_NAME'])
+groups_table = Table(os.environ['GROUPS_TABLE_NAME'])
+group_messages_table = Table(os.environ['GROUP_MESSAGES_TABLE_NAME'])
 
+# Groups at least this large store each message once on the group timeline
+# (fan-out-on-read) instead of copying it into every member's inbox; 0 disables it
+FANOUT_ON_READ_MIN_MEMBERS = int(os.environ.get('FANOUT_ON_READ_MIN_MEMBERS', '100'))
+
+def fans_out_on_read(group):
+    # Members find timelines through their membership rows, so a group without them
+    # (see groups) keeps writing to inboxes
+    members = len(group['members'])
+    return bool(FANOUT_ON_READ_MIN_MEMBERS and members >= FANOUT_ON_READ_MIN_MEMBERS and group['hasMemberships'])
+
+@instrument
+@idempotent('group-message')
 def handler(event, context):
     try:
         body = json.loads(event['body'])
@@ -14,48 +37,111 @@ def handler(event, context):
         group_id = body['groupId']
         content = body['content']
         
-        # Fetch group details
-        group_response = groups_table.get_item(Key={'groupId': group_id})
+        # Fetch group details (cached across warm invocations, see groups); the member set
+        # of a group that fans out on write is checked against its version on every send
+        group = get_group(groups_table, group_id, revalidate=lambda entry: not fans_out_on_read(entry))
         
-        if 'Item' not in group_response:
-            return {
-                'statusCode': 400,
-                'body': json.dumps({'message': 'Group not found'})
-            }
+        if group is None:
+            return response(400, {'message': 'Group not found'})
         
-        group = group_response['Item']
-        members = group.get('members', [])
+        members = group['members']
         
         if not members:
-            return {
-                'statusCode': 400,
-                'body': json.dumps({'message': 'Group has no members'})
-            }
-        
-        # Send message to each member
-        message_id = str(uuid.uuid4())
-        timestamp = body.get('timestamp', '')
-        for member_id in members:
-            message = {
-                'messageId': message_id,
-                'senderId': sender_id,
-                'recipientId': member_id,
-                'groupId': group_id,
-                'content': content,
-                'timestamp': timestamp
-            }
-            messages_table.put_item(Item=message)
-        
-        return {
-            'statusCode': 200,
-            'body': json.dumps({
+            return response(400, {'message': 'Group has no members'})
+        
+        # IDs and timestamps are assigned here, not by the client; the ID is time-ordered
+        # and doubles as the timeline sort key, and as the inbox sort key of rows written
+        # before responding (queued rows get their own, see fanout_worker)
+        sent_ms = now_ms()
+        message_id = new_id(sent_ms)
+        sent_at = to_iso(sent_ms)
+        member_ids = list(dict.fromkeys(members))  # BatchWriteItem rejects duplicate keys
+        # Members other than the sender get the message pushed to their WebSocket connections
+        push_ids = [member_id for member_id in member_ids if member_id != sender_id]
+        
+        message = {
+            'messageId': message_id,
+            'senderId': sender_id,
+            'groupId': group_id,
+            'content': content,
+            'timestamp': sent_at,
+            'sentAt': sent_at
+        }
+        expiry = expires_at(sent_ms)
+        if expiry:
+            message['expiresAt'] = expiry
+        
+        if fans_out_on_read(group):
+            # Store the message once; members read it from the timeline via check_messages
+            if not group['hasTimeline']:
+                mark_timeline(groups_table, group_id)
+            # A busy group's timeline is spread over shards; a throttled write marks it hot
+            def on_throttle():
+                shards = mark_hot(groups_table, {'groupId': group_id}, 'timelineShards')
+                set_timeline_shards(group_id, shards)
+                return shards
+            put_sharded(group_messages_table, message, 'groupId', group['timelineShards'], on_throttle)
+            # Members' chat lists read the group's single summary row
+            conversations.record_group(message, group['groupName'])
+            if FANOUT_QUEUE_URL and (push.enabled() or unread.enabled()):
+                # Pushing to and counting for every member of a large group would hold up
+                # the sender, so fanout_worker does it; without a queue these members rely
+                # on polling and their unread counts leave the group out
+                enqueue(dict(job, timelineOnly=True) for job in fanout_jobs(message, push_ids))
+            return response(200, {
                 'message': 'Message sent to group successfully',
-                'messageId': message_id
+                'messageId': message_id,
+                'sentAt': sent_at,
+                'fanout': 'read',
+                'delivered': len(member_ids),
+                'failed': 0
             })
-        }
+        
+        if FANOUT_QUEUE_URL:
+            # Queue the member rows for fanout_worker and return without waiting for them;
+            # jobs the queue rejects are written inline so no member is skipped
+            rejected = enqueue(fanout_jobs(message, member_ids))
+            leftover = [member_id for job in rejected for member_id in job['recipients']]
+            delivered, failed = write_items(messages_table, recipient_rows(message, leftover), FANOUT_CONCURRENCY) if leftover else (0, 0)
+            leftover_ids = [member_id for member_id in leftover if member_id != sender_id]
+            push.deliver(leftover_ids, message)
+            unread.record([(member_id, conversations.group_key(group_id)) for member_id in leftover_ids])
+            conversations.record_group(message, group['groupName'])
+            return response(207 if failed else 202, {
+                'message': 'Message queued for group members',
+                'messageId': message_id,
+                'sentAt': sent_at,
+                'fanout': 'queued',
+                'queued': len(member_ids) - len(leftover),
+                'delivered': delivered,
+                'failed': failed
+            })
+        
+        # Send message to each member, 25 rows per BatchWriteItem call; large groups are
+        # split into shards written concurrently
+        delivered, failed = write_items(messages_table, recipient_rows(message, member_ids), FANOUT_CONCURRENCY)
+        push.deliver(push_ids, message)
+        unread.record([(member_id, conversations.group_key(group_id)) for member_id in push_ids])
+        conversations.record_group(message, group['groupName'])
+        
+        if failed:
+            return response(207, {
+                'message': 'Message sent to some group members',
+                'messageId': message_id,
+                'sentAt': sent_at,
+                'fanout': 'write',
+                'delivered': delivered,
+                'failed': failed
+            })
+        
+        return response(200, {
+            'message': 'Message sent to group successfully',
+            'messageId': message_id,
+            'sentAt': sent_at,
+            'fanout': 'write',
+            'delivered': delivered,
+            'failed': failed
+        })
     
     except Exception as e:
-        return {
-            'statusCode': 500,
-            'body': json.dumps({'message': 'Internal server error', 'error': str(e)})
-        }
+        return internal_error(e)
@@ -1,46 +1,69 @@
 import json
-import uuid
-import boto3
 import os
+from common import Table, response
+from clock import now_ms, to_iso
+from ids import new_id
+from retention import expires_at
+from blocks import get_blocked_users, get_inbox_shards, set_inbox_shards
+from shards import put_sharded, mark_hot
+from metrics import instrument
+from idempotency import idempotent
+import push
+import conversations
+import unread
 
-dynamodb = boto3.resource('dynamodb')
-messages_table = dynamodb.Table(os.environ['MESSAGES_TABLE_NAME'])
-users_table = dynamodb.Table(os.environ['USERS_TABLE_NAME'])
+messages_table = Table(os.environ['MESSAGES_TABLE_NAME'])
+users_table = Table(os.environ['USERS_TABLE_NAME'])
 
+@instrument
+@idempotent('message')
 def handler(event, context):
     body = json.loads(event['body'])
     sender_id = body['senderId']
     recipient_id = body['recipientId']
     
-    # Check if the sender is blocked by the recipient
-    response = users_table.get_item(
-        Key={'userId': recipient_id}
-    )
-    recipient = response.get('Item')
-    
-    if recipient and 'blockedUsers' in recipient and sender_id in recipient['blockedUsers']:
-        return {
-            'statusCode': 403,
-            'body': json.dumps({
-                'message': 'You are blocked from sending messages to this user.'
-            })
-        }
+    # Check if the sender is blocked by the recipient (cached across warm invocations)
+    if sender_id in get_blocked_users(users_table, recipient_id):
+        return response(403, {
+            'message': 'You are blocked from sending messages to this user.'
+        })
     
     # If not blocked, proceed to send the message
-    message_id = str(uuid.uuid4())
+    # IDs and timestamps are assigned here, not by the client; the ID is time-ordered
+    # and, since the row is written right away, doubles as its inbox sort key (inboxKey),
+    # so "since" polling can rely on it
+    sent_ms = now_ms()
+    message_id = new_id(sent_ms)
+    sent_at = to_iso(sent_ms)
     message = {
         'messageId': message_id,
         'senderId': sender_id,
         'recipientId': recipient_id,
+        'inboxKey': message_id,
         'content': body['content'],
-        'timestamp': body.get('timestamp', '')
+        'timestamp': sent_at,
+        'sentAt': sent_at
     }
-    messages_table.put_item(Item=message)
+    expiry = expires_at(sent_ms)
+    if expiry:
+        message['expiresAt'] = expiry
+    # A hot recipient's rows are spread over inbox shards; a throttled write marks them hot
+    def on_throttle():
+        shards = mark_hot(users_table, {'userId': recipient_id}, 'inboxShards')
+        set_inbox_shards(recipient_id, shards)
+        return shards
+    put_sharded(messages_table, message, 'recipientId', get_inbox_shards(recipient_id), on_throttle)
     
-    return {
-        'statusCode': 200,
-        'body': json.dumps({
-            'message': 'Message sent successfully',
-            'messageId': message_id
-        })
-    }
+    # Push to the recipient's open WebSocket connections; the row is already stored,
+    # so anything the push misses is still picked up by the next poll
+    push.deliver([recipient_id], message)
+    # Both sides' chat lists show this as the conversation's last message
+    conversations.record_direct([message])
+    if recipient_id != sender_id:
+        unread.record([(recipient_id, conversations.direct_key(sender_id))])
+    
+    return response(200, {
+        'message': 'Message sent successfully',
+        'messageId': message_id,
+        'sentAt': sent_at
+    })
@@ -0,0 +1,140 @@
+import json
+import os
+from common import Table, response, internal_error, serialize_item
+from clock import now_ms, to_iso
+from ids import new_id
+from retention import expires_at
+from blocks import get_blocked_users_many, get_inbox_shards
+from shards import shard_key, base_key
+from fanout import FANOUT_CONCURRENCY, write_requests_concurrently
+from jobs import FANOUT_QUEUE_URL, direct_jobs, enqueue
+from metrics import instrument
+from idempotency import idempotent
+import push
+import conversations
+import unread
+
+messages_table = Table(os.environ['MESSAGES_TABLE_NAME'])
+users_table = Table(os.environ['USERS_TABLE_NAME'])
+
+MESSAGE_BATCH_MAX_RECIPIENTS = int(os.environ.get('MESSAGE_BATCH_MAX_RECIPIENTS', '500'))
+
+def parse_payloads(body):
+    # Either one content for many recipients, or a content per recipient
+    if 'messages' in body:
+        payloads = body['messages']
+        if not isinstance(payloads, list) or not all(
+                isinstance(payload, dict) and 'recipientId' in payload and 'content' in payload for payload in payloads):
+            raise ValueError('messages must be a list of {recipientId, content}')
+        payloads = [(payload['recipientId'], payload['content']) for payload in payloads]
+    elif 'recipientIds' in body and 'content' in body:
+        if not isinstance(body['recipientIds'], list):
+            raise ValueError('recipientIds must be a list')
+        payloads = [(recipient_id, body['content']) for recipient_id in body['recipientIds']]
+    else:
+        raise ValueError('Missing required key in request body: recipientIds and content, or messages')
+    if not payloads:
+        raise ValueError('No recipients given')
+    # Recipient IDs are keys, and a list or object isn't even hashable
+    if not all(isinstance(recipient_id, str) and recipient_id for recipient_id, _ in payloads):
+        raise ValueError('Every recipientId must be a user ID string')
+    if len(payloads) > MESSAGE_BATCH_MAX_RECIPIENTS:
+        raise ValueError(f'At most {MESSAGE_BATCH_MAX_RECIPIENTS} recipients per request')
+    return payloads
+
+def notify(messages):
+    # Pushes, conversation summaries and unread counts for stored messages: a
+    # connections Query per recipient (with push on) and three UpdateItems, two
+    # summaries and a counter, per message
+    push.deliver_each(messages)
+    conversations.record_direct(messages)
+    unread.record([(message['recipientId'], conversations.direct_key(message['senderId']))
+                   for message in messages if message['recipientId'] != message['senderId']])
+
+# Sends one direct message per recipient. Every recipient's block list is resolved with
+# BatchGetItem (100 users per call, through the block cache) and the permitted messages
+# are written with BatchWriteItem (25 per call), about N/25 calls for N recipients. What
+# follows a stored message costs about 3 calls per recipient (see notify), so with
+# FANOUT_QUEUE_URL set it is queued for fanout_worker and the response waits only for
+# the rows; without a queue the handler makes those calls itself, about 3N in all.
+# results[i] belongs to the i-th recipient of the request.
+@instrument
+@idempotent('message-batch')
+def handler(event, context):
+    try:
+        body = json.loads(event['body'])
+        if 'senderId' not in body:
+            return response(400, {
+                'message': 'Missing required key in request body: senderId'
+            })
+        sender_id = body['senderId']
+        try:
+            payloads = parse_payloads(body)
+        except ValueError as e:
+            return response(400, {
+                'message': str(e)
+            })
+
+        blocked = get_blocked_users_many(users_table, [recipient_id for recipient_id, _ in payloads])
+
+        sent_ms = now_ms()
+        sent_at = to_iso(sent_ms)
+        expiry = expires_at(sent_ms)
+        results = []
+        messages = []
+        seen = set()
+        for recipient_id, content in payloads:
+            if recipient_id in seen:
+                results.append({'recipientId': recipient_id, 'status': 'duplicate'})
+                continue
+            seen.add(recipient_id)
+            if sender_id in blocked[recipient_id]:
+                results.append({'recipientId': recipient_id, 'status': 'blocked'})
+                continue
+            message_id = new_id(sent_ms)
+            message = {
+                'messageId': message_id,
+                'senderId': sender_id,
+                'recipientId': recipient_id,
+                'inboxKey': message_id,
+                'content': content,
+                'timestamp': sent_at,
+                'sentAt': sent_at
+            }
+            if expiry:
+                message['expiresAt'] = expiry
+            messages.append(message)
+            results.append({'recipientId': recipient_id, 'status': 'sent', 'messageId': message['messageId']})
+
+        failures = []
+        if messages:
+            # Rows of hot recipients go to one of their inbox shards
+            requests = [{'PutRequest': {'Item': serialize_item(dict(
+                message, recipientId=shard_key(message['recipientId'], get_inbox_shards(message['recipientId']))))}}
+                for message in messages]
+            write_requests_concurrently(messages_table.name, requests, FANOUT_CONCURRENCY, failures)
+        failed = {base_key(request['PutRequest']['Item']['recipientId']['S']) for request in failures}
+        for result in results:
+            if result['status'] == 'sent' and result['recipientId'] in failed:
+                result['status'] = 'failed'
+                del result['messageId']
+
+        stored = [message for message in messages if message['recipientId'] not in failed]
+        if FANOUT_QUEUE_URL and stored:
+            # Jobs the queue rejects are handled inline so no recipient is skipped
+            stored = [message for job in enqueue(direct_jobs(stored)) for message in job['messages']]
+        notify(stored)
+
+        counts = {}
+        for result in results:
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+        return response(200 if counts.get('sent', 0) == len(results) else 207, {
+            'message': 'Messages sent',
+            'sentAt': sent_at,
+            'sent': counts.get('sent', 0),
+            'blocked': counts.get('blocked', 0),
+            'failed': counts.get('failed', 0),
+            'results': results
+        })
+    except Exception as e:
+        return internal_error(e)
@@ -0,0 +1,64 @@
+import os
+import random
+from common import ConditionFailed, error_code
+
+# Write sharding for hot partition keys. Every direct message to a user lands in the
+# inbox-index partition of its recipientId, and every large-group message in the
+# timeline partition of its groupId; a popular user or a busy group can push one
+# partition past what DynamoDB accepts however much capacity the table has. A hot key
+# gets a shard count (inboxShards on the user item, timelineShards on the group item)
+# and its rows are spread over key, key#1 .. key#n-1; readers query every shard and
+# merge by message ID. Shard 0 is the bare key, so keys that were never sharded and
+# rows written before a key became hot stay where readers already look.
+#
+# A key becomes hot when a write to it is throttled, or when the count is set on the
+# item by hand. Counts only ever grow: readers take the count from the item on every
+# read, while writers may use a cached, smaller one and still land on a shard that is read.
+HOT_KEY_SHARDS = int(os.environ.get('HOT_KEY_SHARDS', '8'))
+THROTTLE_CODES = {'ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded'}
+
+def shard_key(key, shards, first=0):
+    shards = int(shards or 1)
+    if shards <= 1:
+        return key
+    shard = random.randrange(min(first, shards - 1), shards)
+    return key if shard == 0 else f'{key}#{shard}'
+
+def shard_keys(key, shards):
+    return [key] + [f'{key}#{shard}' for shard in range(1, int(shards or 1))]
+
+def base_key(value):
+    # User and group IDs are UUIDs, so '#' only ever comes from a shard suffix
+    return value.split('#', 1)[0]
+
+def is_throttled(e):
+    return error_code(e) in THROTTLE_CODES
+
+def mark_hot(table, key, attribute, shards=None):
+    # Raises the item's shard count to HOT_KEY_SHARDS (never lowers it); returns the count in effect
+    shards = shards or HOT_KEY_SHARDS
+    key_name = next(iter(key))
+    try:
+        table.update_item(
+            Key=key,
+            UpdateExpression=f'SET {attribute} = :shards',
+            ConditionExpression=f'attribute_exists({key_name}) AND (attribute_not_exists({attribute}) OR {attribute} < :shards)',
+            ExpressionAttributeValues={':shards': shards},
+            ReturnValuesOnConditionCheckFailure='ALL_OLD'
+        )
+        return shards
+    except ConditionFailed as e:
+        return (e.item or {}).get(attribute, 1)
+
+def put_sharded(table, item, key_attribute, shards, on_throttle):
+    # Puts item under one shard of item[key_attribute]. If that partition is throttled
+    # (after botocore's own retries), on_throttle() marks the key hot and returns the new
+    # count, and the item is written once more to one of the added shards.
+    key = item[key_attribute]
+    try:
+        table.put_item(Item=dict(item, **{key_attribute: shard_key(key, shards)}))
+    except Exception as e:
+        if not is_throttled(e):
+            raise
+        shards = on_throttle()
+        table.put_item(Item=dict(item, **{key_attribute: shard_key(key, shards, first=1)}))
@@ -0,0 +1,134 @@
+from common import ConditionFailed
+from conversations import conversations_table, apply
+from fanout import read_items
+from shards import shard_key, shard_keys, is_throttled
+import metrics
+
+# Unread counters for badges. Each user has UNREAD_SHARDS small counter rows in
+# conversations-table (conversationKey 'unread'; they have no lastMessageId, so the
+# recency index leaves them out), each holding an unreadTotal plus one attribute per
+# conversation with unread messages, named by its conversation key (user#<id> or
+# group#<id>). Sends ADD to one of the recipient's rows, /messages/ack subtracts what
+# it acknowledges from the rows that hold it, and a badge refresh sums the rows from
+# one BatchGetItem.
+#
+# The rows are keyed like hot inbox shards (userId, userId#1 .. userId#n-1; see
+# shards), so a busy recipient's increments are spread over partitions instead of all
+# landing on the one that holds their conversation summaries; sends skip the bare key
+# for the same reason (it still holds counts from before the rows were sharded). Like
+# the summaries, counters never fail a send, but an update that still fails after
+# INCREMENT_ATTEMPTS rows is counted in the UnreadCountErrors metric and logged, not
+# dropped silently. Every handler must agree on UNREAD_SHARDS, and it may only grow:
+# rows past a lowered count would no longer be read.
+UNREAD_KEY = 'unread'
+TOTAL = 'unreadTotal'
+UNREAD_SHARDS = 8
+INCREMENT_ATTEMPTS = 3
+
+def enabled():
+    return conversations_table is not None
+
+def counter_key(shard):
+    return {'userId': shard, 'conversationKey': UNREAD_KEY}
+
+def add(shard, counts):
+    # Adds {conversation key: n} (n may be negative) and the sum to the total of one
+    # counter row in one atomic update. Acks only subtract what a row holds, but two at
+    # once can both subtract it, so counters that end up at or below zero are removed
+    # and what they overshot is given back to the total.
+    names = {}
+    values = {':total': sum(counts.values())}
+    actions = [f'{TOTAL} :total']
+    for i, (conversation_key, count) in enumerate(counts.items()):
+        names[f'#c{i}'] = conversation_key
+        values[f':c{i}'] = count
+        actions.append(f'#c{i} :c{i}')
+    result = conversations_table.update_item(
+        Key=counter_key(shard),
+        UpdateExpression='ADD ' + ', '.join(actions),
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values,
+        ReturnValues='ALL_NEW'
+    )
+    counters = result.get('Attributes', {})
+    spent = {name: counters.get(key, 0) for name, key in names.items() if counters.get(key, 0) <= 0}
+    if spent:
+        clear_spent(shard, {name: names[name] for name in spent}, spent)
+
+def clear_spent(shard, names, spent):
+    # Removes spent counters, unless a send has changed one of them meanwhile
+    values = {f':v{i}': value for i, value in enumerate(spent.values())}
+    conditions = [f'{name} = :v{i}' for i, name in enumerate(spent)]
+    update = 'REMOVE ' + ', '.join(spent)
+    overshoot = -sum(value for value in spent.values() if value < 0)
+    if overshoot:
+        update += f' ADD {TOTAL} :overshoot'
+        values[':overshoot'] = overshoot
+    try:
+        conversations_table.update_item(
+            Key=counter_key(shard),
+            UpdateExpression=update,
+            ConditionExpression=' AND '.join(conditions),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values
+        )
+    except ConditionFailed:
+        pass
+
+def counted(update):
+    # update(shard, counts), with failures counted before apply logs them
+    def run(shard, counts):
+        try:
+            update(shard, counts)
+        except Exception:
+            metrics.count('UnreadCountErrors')
+            raise
+    return run
+
+def increment(user_id, counts):
+    # Adds to one of the user's rows past the bare key, picked at random; a throttled
+    # row (after botocore's own retries) hands the update to another, up to
+    # INCREMENT_ATTEMPTS rows in all
+    for attempt in range(INCREMENT_ATTEMPTS):
+        try:
+            return add(shard_key(user_id, UNREAD_SHARDS, first=1), counts)
+        except Exception as e:
+            if not is_throttled(e) or attempt == INCREMENT_ATTEMPTS - 1:
+                raise
+
+def record(counts):
+    # counts: [(user ID, conversation key)], one new message each, applied concurrently
+    if enabled():
+        apply([(user_id, {conversation_key: 1}) for user_id, conversation_key in counts], counted(increment))
+
+def get_rows(user_id):
+    return read_items(conversations_table.name, [counter_key(shard) for shard in shard_keys(user_id, UNREAD_SHARDS)])
+
+def subtract(user_id, counts):
+    # Takes each acknowledged count from the rows that hold it, at most what they hold:
+    # an ack can cover messages that were never counted (a large group's, sent without a queue)
+    if not enabled() or not counts:
+        return
+    remaining = dict(counts)
+    updates = []
+    for row in sorted(get_rows(user_id), key=lambda row: row['userId']):
+        taken = {}
+        for conversation_key, count in remaining.items():
+            held = row.get(conversation_key, 0)
+            if count > 0 and held > 0:
+                taken[conversation_key] = -min(count, held)
+                remaining[conversation_key] = count - min(count, held)
+        if taken:
+            updates.append((row['userId'], taken))
+    apply(updates, counted(add))
+
+def get_counters(user_id):
+    # {conversation key: unread count} and the total, summed over the user's rows
+    counts = {}
+    total = 0
+    for row in get_rows(user_id):
+        total += row.get(TOTAL, 0)
+        for name, count in row.items():
+            if name not in ('userId', 'conversationKey', TOTAL):
+                counts[name] = counts.get(name, 0) + count
+    return {name: count for name, count in counts.items() if count > 0}, max(total, 0)
@@ -0,0 +1,31 @@
+import json
+from common import response, internal_error
+from metrics import instrument
+import unread
+
+# Badge refreshes: the user's unread counters from one GetItem, maintained by the send
+# paths and /messages/ack (see unread.py)
+
+def describe(conversation_key, count):
+    kind, _, counterpart = conversation_key.partition('#')
+    if kind == 'group':
+        return {'conversationType': 'group', 'groupId': counterpart, 'unread': count}
+    return {'conversationType': 'direct', 'withUserId': counterpart, 'unread': count}
+
+@instrument
+def handler(event, context):
+    try:
+        body = json.loads(event['body'])
+        user_id = body['userId']
+        counts, total = unread.get_counters(user_id)
+        return response(200, {
+            'userId': user_id,
+            'unread': total,
+            'conversations': [describe(key, count) for key, count in sorted(counts.items(), key=lambda entry: -entry[1])]
+        })
+    except KeyError as e:
+        return response(400, {
+            'message': f'Missing required key in request body: {e}'
+        })
+    except Exception as e:
+        return internal_error(e)
@@ -0,0 +1,33 @@
+import os
+from common import Table, response, internal_error
+from clock import now_ms, to_iso
+from push import CONNECTION_TTL_SECONDS
+from metrics import instrument
+
+connections_table = Table(os.environ['CONNECTIONS_TABLE_NAME'])
+
+# $connect route of the WebSocket API: wss://.../dev?userId=<userId>
+@instrument
+def handler(event, context):
+    try:
+        connection_id = event['requestContext']['connectionId']
+        user_id = (event.get('queryStringParameters') or {}).get('userId')
+        if not user_id:
+            return response(400, {
+                'message': 'userId query parameter is required'
+            })
+
+        connected_ms = now_ms()
+        connections_table.put_item(Item={
+            'userId': user_id,
+            'connectionId': connection_id,
+            'connectedAt': to_iso(connected_ms),
+            # Rows of connections that never sent $disconnect expire on their own
+            'expiresAt': connected_ms // 1000 + CONNECTION_TTL_SECONDS
+        })
+        return response(200, {
+            'message': 'Connected',
+            'connectionId': connection_id
+        })
+    except Exception as e:
+        return internal_error(e)
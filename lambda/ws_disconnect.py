@@ -0,0 +1,25 @@
+import os
+from common import Table, response, internal_error
+from metrics import instrument
+
+connections_table = Table(os.environ['CONNECTIONS_TABLE_NAME'])
+connection_index_name = os.environ.get('CONNECTION_INDEX_NAME', 'connection-index')
+
+# $disconnect route of the WebSocket API; the event only carries the connection ID,
+# so the row is found through the connection index
+@instrument
+def handler(event, context):
+    try:
+        connection_id = event['requestContext']['connectionId']
+        result = connections_table.query(
+            IndexName=connection_index_name,
+            KeyConditionExpression='connectionId = :connectionId',
+            ExpressionAttributeValues={':connectionId': connection_id}
+        )
+        for item in result.get('Items', []):
+            connections_table.delete_item(Key={'userId': item['userId'], 'connectionId': connection_id})
+        return response(200, {
+            'message': 'Disconnected'
+        })
+    except Exception as e:
+        return internal_error(e)
@@ -0,0 +1,11 @@
+"""Offline harness: an in-process DynamoDB stand-in and the stack's tables.
+
+Importing the package puts lambda/ on sys.path so the handler modules and
+common can be imported the same way Lambda imports them.
+"""
+import os
+import sys
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lambda')
+if LAMBDA_DIR not in sys.path:
+    sys.path.insert(0, LAMBDA_DIR)
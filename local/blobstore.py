@@ -0,0 +1,35 @@
+"""Directory-backed stand-in for the archive bucket.
+
+DirectoryStore has the put(key, data) method archive.get_store() returns, writing
+each object to <root>/<key>; archive.use_store(DirectoryStore(path)) archives to
+local disk instead of S3.
+"""
+import os
+
+
+class DirectoryStore:
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def put(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+
+    def get(self, key):
+        with open(self.path(key), 'rb') as f:
+            return f.read()
+
+    def keys(self, prefix=''):
+        found = []
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                key = os.path.relpath(os.path.join(directory, name), self.root).replace(os.sep, '/')
+                if key.startswith(prefix) and not key.endswith('.tmp'):
+                    found.append(key)
+        return sorted(found)
@@ -0,0 +1,762 @@
+"""In-process stand-in for the low-level DynamoDB client.
+
+LocalDynamoDB speaks the same wire format as boto3.client('dynamodb') for the
+operations the handlers use (GetItem, PutItem, UpdateItem, DeleteItem, Query,
+Scan, BatchWriteItem, BatchGetItem), so common.use_client(LocalDynamoDB(...))
+runs the handlers unchanged. Every call records the read and write capacity
+units DynamoDB would bill for it, including writes to global secondary indexes.
+
+Optional knobs make it behave more like the real service under load: a fixed
+round-trip latency plus a per-item cost, a share of batch writes returned as
+UnprocessedItems, and a per-partition write throughput limit. Tables can have a
+TTL attribute (swept by expire()) and a stream (consumed with drain_stream()).
+"""
+import bisect
+import itertools
+import math
+import random
+import threading
+import time
+import zlib
+from collections import defaultdict
+from decimal import Decimal
+
+from common import serialize_item, deserialize_item
+from . import expressions
+from .expressions import ExpressionError
+
+READ_UNIT_BYTES = 4096
+WRITE_UNIT_BYTES = 1024
+MAX_BATCH_WRITE = 25
+MAX_BATCH_GET = 100
+# Query and Scan stop after reading this much data and return a LastEvaluatedKey
+MAX_PAGE_BYTES = 1024 * 1024
+EXPRESSION_PARAMETERS = ('KeyConditionExpression', 'ConditionExpression', 'UpdateExpression',
+                         'FilterExpression', 'ProjectionExpression')
+
+
+class ClientError(Exception):
+    # Shaped like botocore's ClientError: the error code is in response['Error']['Code']
+    def __init__(self, code, message, operation, **extra):
+        super().__init__(f'An error occurred ({code}) when calling the {operation} operation: {message}')
+        self.response = {
+            'Error': {'Code': code, 'Message': message},
+            'ResponseMetadata': {'HTTPStatusCode': 400},
+        }
+        self.response.update(extra)
+        self.operation_name = operation
+
+
+def value_size(value):
+    # Approximates DynamoDB's item size rules
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, bool) or value is None:
+        return 1
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return 3 + sum(len(k.encode('utf-8')) + value_size(v) + 1 for k, v in value.items())
+    if isinstance(value, list):
+        return 3 + sum(value_size(v) + 1 for v in value)
+    if isinstance(value, (set, frozenset)):
+        return sum(value_size(v) for v in value)
+    # Numbers: roughly one byte per two significant digits plus one
+    return len(str(value).lstrip('-').replace('.', '')) // 2 + 1
+
+
+def item_size(item):
+    if not item:
+        return 0
+    return sum(len(name.encode('utf-8')) + value_size(value) for name, value in item.items())
+
+
+def read_units(size, consistent):
+    units = max(1, math.ceil(size / READ_UNIT_BYTES))
+    return units if consistent else units / 2
+
+
+def write_units(size):
+    return max(1, math.ceil(size / WRITE_UNIT_BYTES))
+
+
+class Index:
+    def __init__(self, name, hash_key, range_key=None, projection_type='ALL', non_key_attributes=()):
+        self.name = name
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.projection_type = projection_type
+        self.non_key_attributes = tuple(non_key_attributes)
+
+    def covers(self, item):
+        # Sparse index: only items that carry the index key attributes are in it
+        return item is not None and self.hash_key in item and (self.range_key is None or self.range_key in item)
+
+
+class LocalTable:
+    def __init__(self, name, hash_key, range_key=None, ttl_attribute=None, stream_view_type=None):
+        self.name = name
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.ttl_attribute = ttl_attribute
+        self.stream_view_type = stream_view_type
+        # Stream records not yet handed to a consumer
+        self.stream = []
+        self.stream_arn = f'arn:aws:dynamodb:local:000000000000:table/{name}/stream/local'
+        self.indexes = {}
+        # hash key value -> {range key value (or None) -> item}
+        self.partitions = defaultdict(dict)
+        # index name -> index hash key value -> {table key -> item}
+        self.index_partitions = defaultdict(lambda: defaultdict(dict))
+        # Sorted copies of queried partitions, dropped whenever the table is written
+        self.version = 0
+        self.sorted_partitions = {}
+
+    @property
+    def key_names(self):
+        return (self.hash_key, self.range_key) if self.range_key else (self.hash_key,)
+
+    def key(self, item):
+        return item[self.hash_key], item[self.range_key] if self.range_key else None
+
+    def index_items(self, index, hash_value):
+        return list(self.index_partitions[index.name].get(hash_value, {}).values())
+
+    def sort_key(self, index, item):
+        # Index entries sort by the index range key, ties broken by the table key
+        parts = []
+        if index is not None and index.range_key:
+            parts.append(item[index.range_key])
+        if self.range_key:
+            parts.append(item[self.range_key])
+        return tuple(parts)
+
+    def sorted_partition(self, index, hash_value):
+        # (items, sort keys) of one partition of the table or an index, in ascending order
+        cache_key = (index.name if index else None, hash_value)
+        cached = self.sorted_partitions.get(cache_key)
+        if cached is None or cached[0] != self.version:
+            if index is None:
+                items = list(self.partitions.get(hash_value, {}).values())
+            else:
+                items = self.index_items(index, hash_value)
+            items.sort(key=lambda item: self.sort_key(index, item))
+            cached = (self.version, items, [self.sort_key(index, item) for item in items])
+            self.sorted_partitions[cache_key] = cached
+        return cached[1], cached[2]
+
+    def reindex(self, old, new):
+        self.version += 1
+        for index in self.indexes.values():
+            entries = self.index_partitions[index.name]
+            if index.covers(old):
+                partition = entries[old[index.hash_key]]
+                partition.pop(self.key(old), None)
+                if not partition:
+                    del entries[old[index.hash_key]]
+            if index.covers(new):
+                entries[new[index.hash_key]][self.key(new)] = new
+
+    def projected(self, index, item):
+        # The index entry for an item: the whole item for ALL, else the keys plus projected attributes
+        if index.projection_type == 'ALL':
+            return item
+        names = set(self.key_names) | {index.hash_key}
+        if index.range_key:
+            names.add(index.range_key)
+        if index.projection_type == 'INCLUDE':
+            names.update(index.non_key_attributes)
+        return {k: v for k, v in item.items() if k in names}
+
+    def count(self):
+        return sum(len(partition) for partition in self.partitions.values())
+
+
+class LocalDynamoDB:
+    def __init__(self, latency=0.0, per_item_latency=0.0, unprocessed_rate=0.0, partition_wcu_limit=None, seed=None):
+        # latency and per_item_latency are in seconds; partition_wcu_limit is write units
+        # per second per partition key, beyond which writes are throttled
+        self.latency = latency
+        self.per_item_latency = per_item_latency
+        self.unprocessed_rate = unprocessed_rate
+        self.partition_wcu_limit = partition_wcu_limit
+        self.random = random.Random(seed)
+        self.tables = {}
+        self.lock = threading.RLock()
+        self.partition_usage = {}
+        self.sequence = 0
+        self.reset_stats()
+
+    # Schema
+
+    def add_table(self, name, hash_key, range_key=None, global_indexes=(), local_indexes=(),
+                  ttl_attribute=None, stream_view_type=None):
+        # Indexes are given like the Pulumi definitions: {'name', 'hash_key', 'range_key', 'projection_type'}
+        table = LocalTable(name, hash_key, range_key, ttl_attribute, stream_view_type)
+        for index in global_indexes:
+            table.indexes[index['name']] = Index(
+                index['name'], index['hash_key'], index.get('range_key'),
+                index.get('projection_type', 'ALL'), index.get('non_key_attributes', ()))
+        for index in local_indexes:
+            table.indexes[index['name']] = Index(
+                index['name'], hash_key, index['range_key'],
+                index.get('projection_type', 'ALL'), index.get('non_key_attributes', ()))
+        self.tables[name] = table
+        return table
+
+    def create_table(self, TableName, KeySchema, GlobalSecondaryIndexes=(), LocalSecondaryIndexes=(),
+                     StreamSpecification=None, **kwargs):
+        # The boto3 spelling, for code that creates tables through a client
+        def keys(schema):
+            found = {entry['KeyType']: entry['AttributeName'] for entry in schema}
+            return found['HASH'], found.get('RANGE')
+
+        def index_definitions(indexes):
+            for index in indexes:
+                hash_key, range_key = keys(index['KeySchema'])
+                projection = index.get('Projection', {})
+                yield {
+                    'name': index['IndexName'],
+                    'hash_key': hash_key,
+                    'range_key': range_key,
+                    'projection_type': projection.get('ProjectionType', 'ALL'),
+                    'non_key_attributes': projection.get('NonKeyAttributes', ()),
+                }
+
+        hash_key, range_key = keys(KeySchema)
+        stream = StreamSpecification or {}
+        self.add_table(TableName, hash_key, range_key,
+                       list(index_definitions(GlobalSecondaryIndexes)), list(index_definitions(LocalSecondaryIndexes)),
+                       stream_view_type=stream.get('StreamViewType') if stream.get('StreamEnabled') else None)
+        return {'TableDescription': {'TableName': TableName, 'TableStatus': 'ACTIVE'}}
+
+    # Statistics
+
+    def reset_stats(self):
+        with self.lock:
+            self.calls = defaultdict(int)
+            self.read_units = defaultdict(float)
+            self.write_units = defaultdict(float)
+            self.throttled = 0
+
+    def totals(self):
+        # Snapshot of capacity consumed so far, summed over tables
+        with self.lock:
+            return {
+                'calls': sum(self.calls.values()),
+                'rcu': sum(self.read_units.values()),
+                'wcu': sum(self.write_units.values()),
+                'throttled': self.throttled,
+            }
+
+    def stats(self):
+        # Per-table and per-operation breakdown
+        with self.lock:
+            return {
+                'calls': dict(self.calls),
+                'rcu': dict(self.read_units),
+                'wcu': dict(self.write_units),
+                'throttled': self.throttled,
+            }
+
+    # Plumbing
+
+    def table(self, name, operation):
+        table = self.tables.get(name)
+        if table is None:
+            raise ClientError('ResourceNotFoundException', f'Requested resource not found: Table: {name} not found', operation)
+        return table
+
+    def wait(self, items=1):
+        # Sleeps outside the lock so concurrent callers overlap like real requests do
+        delay = self.latency + self.per_item_latency * items
+        if delay > 0:
+            time.sleep(delay)
+
+    def record(self, operation, table_name, rcu=0.0, wcu=0.0):
+        self.calls[operation] += 1
+        if rcu:
+            self.read_units[table_name] += rcu
+        if wcu:
+            self.write_units[table_name] += wcu
+
+    def capacity(self, table_name, params, rcu=0.0, wcu=0.0):
+        if params.get('ReturnConsumedCapacity', 'NONE') == 'NONE':
+            return None
+        consumed = {'TableName': table_name, 'CapacityUnits': rcu + wcu}
+        if rcu:
+            consumed['ReadCapacityUnits'] = rcu
+        if wcu:
+            consumed['WriteCapacityUnits'] = wcu
+        return consumed
+
+    def throttle(self, table, old, new):
+        # True if the write would push a partition past partition_wcu_limit this second:
+        # the table's partition for the item, or the partition of an index it is written
+        # to (DynamoDB throttles base-table writes when an index partition can't keep up).
+        if self.partition_wcu_limit is None:
+            return False
+        units = write_units(max(item_size(old), item_size(new)))
+        second = int(time.monotonic())
+        keys = {(table.name, None, (new or old)[table.hash_key])}
+        for index in table.indexes.values():
+            for version in (old, new):
+                if version is not None and index.covers(version):
+                    keys.add((table.name, index.name, version[index.hash_key]))
+        usage = []
+        for key in keys:
+            window, used = self.partition_usage.get(key, (second, 0))
+            if window != second:
+                used = 0
+            if used + units > self.partition_wcu_limit:
+                self.throttled += 1
+                return True
+            usage.append((key, used + units))
+        for key, used in usage:
+            self.partition_usage[key] = (second, used)
+        return False
+
+    def key_of(self, table, key, operation):
+        names = table.key_names
+        if set(key) != set(names):
+            raise ClientError('ValidationException', 'The provided key element does not match the schema', operation)
+        return key[table.hash_key], key[table.range_key] if table.range_key else None
+
+    def lookup(self, table, key, operation):
+        hash_value, range_value = self.key_of(table, key, operation)
+        partition = table.partitions.get(hash_value)
+        return partition.get(range_value) if partition else None
+
+    def store(self, table, item):
+        hash_value, range_value = table.key(item)
+        old = table.partitions[hash_value].get(range_value)
+        table.partitions[hash_value][range_value] = item
+        table.reindex(old, item)
+        self.emit(table, old, item)
+
+    def remove(self, table, item, identity=None):
+        hash_value, range_value = table.key(item)
+        partition = table.partitions.get(hash_value)
+        if partition is not None:
+            partition.pop(range_value, None)
+            if not partition:
+                del table.partitions[hash_value]
+        table.reindex(item, None)
+        self.emit(table, item, None, identity)
+
+    # Streams and TTL
+
+    def emit(self, table, old, new, identity=None):
+        if table.stream_view_type is None:
+            return
+        self.sequence += 1
+        view = table.stream_view_type
+        either = new if new is not None else old
+        change = {
+            'ApproximateCreationDateTime': int(time.time()),
+            'Keys': serialize_item({k: either[k] for k in table.key_names}),
+            'SequenceNumber': str(self.sequence).zfill(21),
+            'SizeBytes': item_size(either),
+            'StreamViewType': view,
+        }
+        if new is not None and view in ('NEW_IMAGE', 'NEW_AND_OLD_IMAGES'):
+            change['NewImage'] = serialize_item(new)
+        if old is not None and view in ('OLD_IMAGE', 'NEW_AND_OLD_IMAGES'):
+            change['OldImage'] = serialize_item(old)
+        record = {
+            'eventID': str(self.sequence),
+            'eventName': 'INSERT' if old is None else 'REMOVE' if new is None else 'MODIFY',
+            'eventVersion': '1.1',
+            'eventSource': 'aws:dynamodb',
+            'awsRegion': 'local',
+            'dynamodb': change,
+            'eventSourceARN': table.stream_arn,
+        }
+        if identity:
+            record['userIdentity'] = identity
+        table.stream.append(record)
+
+    def expire(self, now=None):
+        # Plays the TTL sweeper: deletes every item whose TTL attribute (epoch seconds) is
+        # at or before now, free of charge, with the service identity on its stream record
+        now = time.time() if now is None else now
+        identity = {'type': 'Service', 'principalId': 'dynamodb.amazonaws.com'}
+        expired = 0
+        with self.lock:
+            for table in self.tables.values():
+                if table.ttl_attribute is None:
+                    continue
+                for partition in list(table.partitions.values()):
+                    for item in list(partition.values()):
+                        value = item.get(table.ttl_attribute)
+                        if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool) and value <= now:
+                            self.remove(table, item, identity)
+                            expired += 1
+        return expired
+
+    def read_stream(self, table_name):
+        # Takes the table's pending stream records
+        with self.lock:
+            table = self.table(table_name, 'GetRecords')
+            records, table.stream = table.stream, []
+        return records
+
+    def drain_stream(self, table_name, handler, batch_size=100, event_names=None, context=None):
+        # Plays a stream event source mapping; event_names mirrors its filter criteria
+        records = [record for record in self.read_stream(table_name)
+                   if event_names is None or record['eventName'] in event_names]
+        for start in range(0, len(records), batch_size):
+            handler({'Records': records[start:start + batch_size]}, context)
+        return len(records)
+
+    def write_cost(self, table, old, new):
+        # Table write plus one write per index entry that is added or removed and
+        # two when an update moves an item to a different index key
+        units = write_units(max(item_size(old), item_size(new)))
+        for index in table.indexes.values():
+            before, after = index.covers(old), index.covers(new)
+            if before and after:
+                moved = any(old[k] != new[k] for k in (index.hash_key, index.range_key) if k)
+                units += write_units(item_size(table.projected(index, new)))
+                if moved:
+                    units += write_units(item_size(table.projected(index, old)))
+            elif before:
+                units += write_units(item_size(table.projected(index, old)))
+            elif after:
+                units += write_units(item_size(table.projected(index, new)))
+        return units
+
+    def check_condition(self, params, old, operation):
+        expression = params.get('ConditionExpression')
+        if not expression:
+            return
+        tree = expressions.parse_condition(
+            expression, params.get('ExpressionAttributeNames'), self.values(params))
+        if not expressions.test(tree, old or {}):
+            extra = {}
+            if old and params.get('ReturnValuesOnConditionCheckFailure') == 'ALL_OLD':
+                extra['Item'] = serialize_item(old)
+            raise ClientError('ConditionalCheckFailedException', 'The conditional request failed', operation, **extra)
+
+    def check_expressions(self, params):
+        # Rejects what DynamoDB rejects before touching any item: reserved words as bare
+        # names and placeholders that none of the request's expressions use
+        expressions.validate({name: params[name] for name in EXPRESSION_PARAMETERS if params.get(name)},
+                             params.get('ExpressionAttributeNames'), params.get('ExpressionAttributeValues'))
+
+    def values(self, params):
+        values = params.get('ExpressionAttributeValues')
+        return deserialize_item(values) if values else {}
+
+    def run(self, operation, work):
+        try:
+            return work()
+        except ExpressionError as e:
+            raise ClientError('ValidationException', str(e), operation) from e
+
+    # Item operations
+
+    def get_item(self, TableName, Key, **params):
+        def work():
+            with self.lock:
+                table = self.table(TableName, 'GetItem')
+                self.check_expressions(params)
+                item = self.lookup(table, deserialize_item(Key), 'GetItem')
+                rcu = read_units(item_size(item), params.get('ConsistentRead', False))
+                self.record('GetItem', TableName, rcu=rcu)
+                result = {}
+                if item is not None:
+                    if params.get('ProjectionExpression'):
+                        paths = expressions.parse_projection(params['ProjectionExpression'], params.get('ExpressionAttributeNames'))
+                        item = expressions.project(paths, item)
+                    result['Item'] = serialize_item(item)
+                consumed = self.capacity(TableName, params, rcu=rcu)
+                if consumed:
+                    result['ConsumedCapacity'] = consumed
+                return result
+        result = self.run('GetItem', work)
+        self.wait()
+        return result
+
+    def put_item(self, TableName, Item, **params):
+        def work():
+            with self.lock:
+                table = self.table(TableName, 'PutItem')
+                self.check_expressions(params)
+                new = deserialize_item(Item)
+                old = self.lookup(table, {k: new.get(k) for k in table.key_names if k in new}, 'PutItem')
+                wcu = self.write_cost(table, old, new)
+                if self.throttle(table, old, new):
+                    raise ClientError('ProvisionedThroughputExceededException', 'Write throughput exceeded for partition', 'PutItem')
+                try:
+                    self.check_condition(params, old, 'PutItem')
+                except ClientError:
+                    self.record('PutItem', TableName, wcu=write_units(item_size(old)))
+                    raise
+                self.store(table, new)
+                self.record('PutItem', TableName, wcu=wcu)
+                result = {}
+                if old is not None and params.get('ReturnValues') == 'ALL_OLD':
+                    result['Attributes'] = serialize_item(old)
+                consumed = self.capacity(TableName, params, wcu=wcu)
+                if consumed:
+                    result['ConsumedCapacity'] = consumed
+                return result
+        result = self.run('PutItem', work)
+        self.wait()
+        return result
+
+    def update_item(self, TableName, Key, **params):
+        def work():
+            with self.lock:
+                table = self.table(TableName, 'UpdateItem')
+                self.check_expressions(params)
+                key = deserialize_item(Key)
+                old = self.lookup(table, key, 'UpdateItem')
+                try:
+                    self.check_condition(params, old, 'UpdateItem')
+                except ClientError:
+                    self.record('UpdateItem', TableName, wcu=write_units(item_size(old)))
+                    raise
+                new, changed = dict(old) if old else dict(key), set()
+                if params.get('UpdateExpression'):
+                    actions = expressions.parse_update(
+                        params['UpdateExpression'], params.get('ExpressionAttributeNames'), self.values(params))
+                    new, changed = expressions.apply_update(actions, old or dict(key))
+                if changed & set(table.key_names):
+                    raise ClientError('ValidationException', 'Cannot update attribute in the key', 'UpdateItem')
+                wcu = self.write_cost(table, old, new)
+                if self.throttle(table, old, new):
+                    raise ClientError('ProvisionedThroughputExceededException', 'Write throughput exceeded for partition', 'UpdateItem')
+                self.store(table, new)
+                self.record('UpdateItem', TableName, wcu=wcu)
+                result = {}
+                returned = self.returned_values(params.get('ReturnValues', 'NONE'), old, new, changed)
+                if returned:
+                    result['Attributes'] = serialize_item(returned)
+                consumed = self.capacity(TableName, params, wcu=wcu)
+                if consumed:
+                    result['ConsumedCapacity'] = consumed
+                return result
+        result = self.run('UpdateItem', work)
+        self.wait()
+        return result
+
+    def returned_values(self, mode, old, new, changed):
+        if mode == 'ALL_NEW':
+            return new
+        if mode == 'ALL_OLD':
+            return old
+        if mode == 'UPDATED_NEW':
+            return {k: v for k, v in new.items() if k in changed}
+        if mode == 'UPDATED_OLD':
+            return {k: v for k, v in (old or {}).items() if k in changed}
+        return None
+
+    def delete_item(self, TableName, Key, **params):
+        def work():
+            with self.lock:
+                table = self.table(TableName, 'DeleteItem')
+                self.check_expressions(params)
+                old = self.lookup(table, deserialize_item(Key), 'DeleteItem')
+                try:
+                    self.check_condition(params, old, 'DeleteItem')
+                except ClientError:
+                    self.record('DeleteItem', TableName, wcu=write_units(item_size(old)))
+                    raise
+                wcu = self.write_cost(table, old, None)
+                if old is not None:
+                    self.remove(table, old)
+                self.record('DeleteItem', TableName, wcu=wcu)
+                result = {}
+                if old is not None and params.get('ReturnValues') == 'ALL_OLD':
+                    result['Attributes'] = serialize_item(old)
+                consumed = self.capacity(TableName, params, wcu=wcu)
+                if consumed:
+                    result['ConsumedCapacity'] = consumed
+                return result
+        result = self.run('DeleteItem', work)
+        self.wait()
+        return result
+
+    # Reads over many items
+
+    def ordered(self, table, index, items):
+        return sorted(items, key=lambda item: table.sort_key(index, item))
+
+    def position(self, table, index, item):
+        names = list(table.key_names)
+        if index is not None:
+            names += [k for k in (index.hash_key, index.range_key) if k and k not in names]
+        return {k: item[k] for k in names}
+
+    def page(self, operation, table, index, candidates, params, started=False):
+        # Applies ExclusiveStartKey (unless the caller already did), Limit and the 1 MB
+        # page size, then filters and projects; candidates may be a lazy iterator
+        start = params.get('ExclusiveStartKey')
+        if start and not started:
+            start = deserialize_item(start)
+            for offset, item in enumerate(candidates):
+                if self.position(table, index, item) == start:
+                    candidates = candidates[offset + 1:]
+                    break
+        limit = params.get('Limit')
+        names = params.get('ExpressionAttributeNames')
+        condition = None
+        if params.get('FilterExpression'):
+            condition = expressions.parse_condition(params['FilterExpression'], names, self.values(params))
+        projection = None
+        if params.get('ProjectionExpression'):
+            projection = expressions.parse_projection(params['ProjectionExpression'], names)
+
+        read, matched, size, last, more = 0, [], 0, None, False
+        for item in candidates:
+            if (limit is not None and read >= limit) or size >= MAX_PAGE_BYTES:
+                more = True
+                break
+            entry = table.projected(index, item) if index is not None else item
+            read += 1
+            size += item_size(entry)
+            last = item
+            if condition is None or expressions.test(condition, entry):
+                matched.append(expressions.project(projection, entry) if projection else entry)
+        rcu = read_units(size, params.get('ConsistentRead', False))
+        self.record(operation, table.name, rcu=rcu)
+
+        result = {'Count': len(matched), 'ScannedCount': read}
+        if params.get('Select') != 'COUNT':
+            result['Items'] = [serialize_item(item) for item in matched]
+        if last is not None and more:
+            result['LastEvaluatedKey'] = serialize_item(self.position(table, index, last))
+        consumed = self.capacity(table.name, params, rcu=rcu)
+        if consumed:
+            result['ConsumedCapacity'] = consumed
+        return result
+
+    def query(self, TableName, KeyConditionExpression, IndexName=None, **params):
+        def work():
+            with self.lock:
+                table = self.table(TableName, 'Query')
+                self.check_expressions(dict(params, KeyConditionExpression=KeyConditionExpression))
+                index = None
+                if IndexName:
+                    index = table.indexes.get(IndexName)
+                    if index is None:
+                        raise ClientError('ValidationException', f'The table does not have the specified index: {IndexName}', 'Query')
+                hash_key = index.hash_key if index else table.hash_key
+                condition = expressions.parse_condition(
+                    KeyConditionExpression, params.get('ExpressionAttributeNames'), self.values(params))
+                hash_value = expressions.key_equalities(condition).get(hash_key)
+                if hash_value is None:
+                    raise ClientError('ValidationException', 'Query condition missed key schema element', 'Query')
+                items, keys = table.sorted_partition(index, hash_value)
+                forward = params.get('ScanIndexForward', True)
+                # Seek straight past ExclusiveStartKey instead of walking the partition
+                start = params.get('ExclusiveStartKey')
+                if start:
+                    start_key = table.sort_key(index, deserialize_item(start))
+                    offset = bisect.bisect_right(keys, start_key) if forward else bisect.bisect_left(keys, start_key)
+                else:
+                    offset = 0 if forward else len(items)
+                if forward:
+                    ordered = itertools.islice(items, offset, None)
+                else:
+                    ordered = (items[position] for position in range(offset - 1, -1, -1))
+                # The key condition is only checked on the items a page actually reaches
+                candidates = (item for item in ordered if expressions.test(condition, item))
+                return self.page('Query', table, index, candidates, params, started=True)
+        result = self.run('Query', work)
+        self.wait(len(result.get('Items', ())))
+        return result
+
+    def scan(self, TableName, IndexName=None, Segment=None, TotalSegments=None, **params):
+        def work():
+            with self.lock:
+                table = self.table(TableName, 'Scan')
+                self.check_expressions(params)
+                index = table.indexes.get(IndexName) if IndexName else None
+                candidates = []
+                for hash_value in sorted(table.partitions, key=repr):
+                    if TotalSegments and zlib.crc32(repr(hash_value).encode()) % TotalSegments != Segment:
+                        continue
+                    items = self.ordered(table, None, table.partitions[hash_value].values())
+                    candidates.extend(item for item in items if index is None or index.covers(item))
+                return self.page('Scan', table, index, candidates, params)
+        result = self.run('Scan', work)
+        self.wait(len(result.get('Items', ())))
+        return result
+
+    # Batches
+
+    def batch_write_item(self, RequestItems, **params):
+        def work():
+            with self.lock:
+                if sum(len(requests) for requests in RequestItems.values()) > MAX_BATCH_WRITE:
+                    raise ClientError('ValidationException', 'Too many items requested for the BatchWriteItem call', 'BatchWriteItem')
+                unprocessed, consumed, count = {}, [], 0
+                for table_name, requests in RequestItems.items():
+                    table = self.table(table_name, 'BatchWriteItem')
+                    wcu = 0
+                    for request in requests:
+                        count += 1
+                        if self.unprocessed_rate and self.random.random() < self.unprocessed_rate:
+                            unprocessed.setdefault(table_name, []).append(request)
+                            continue
+                        if 'PutRequest' in request:
+                            new = deserialize_item(request['PutRequest']['Item'])
+                            old = self.lookup(table, {k: new.get(k) for k in table.key_names if k in new}, 'BatchWriteItem')
+                        else:
+                            old = self.lookup(table, deserialize_item(request['DeleteRequest']['Key']), 'BatchWriteItem')
+                            new = None
+                        units = self.write_cost(table, old, new)
+                        if self.throttle(table, old, new):
+                            unprocessed.setdefault(table_name, []).append(request)
+                            continue
+                        if new is not None:
+                            self.store(table, new)
+                        elif old is not None:
+                            self.remove(table, old)
+                        wcu += units
+                    self.record('BatchWriteItem', table_name, wcu=wcu)
+                    capacity = self.capacity(table_name, params, wcu=wcu)
+                    if capacity:
+                        consumed.append(capacity)
+                result = {'UnprocessedItems': unprocessed}
+                if consumed:
+                    result['ConsumedCapacity'] = consumed
+                return result, count
+        result, count = self.run('BatchWriteItem', work)
+        self.wait(count)
+        return result
+
+    def batch_get_item(self, RequestItems, **params):
+        def work():
+            with self.lock:
+                if sum(len(request['Keys']) for request in RequestItems.values()) > MAX_BATCH_GET:
+                    raise ClientError('ValidationException', 'Too many items requested for the BatchGetItem call', 'BatchGetItem')
+                responses, consumed, count = {}, [], 0
+                for table_name, request in RequestItems.items():
+                    table = self.table(table_name, 'BatchGetItem')
+                    self.check_expressions(request)
+                    projection = None
+                    if request.get('ProjectionExpression'):
+                        projection = expressions.parse_projection(request['ProjectionExpression'], request.get('ExpressionAttributeNames'))
+                    found, rcu = [], 0
+                    for key in request['Keys']:
+                        count += 1
+                        item = self.lookup(table, deserialize_item(key), 'BatchGetItem')
+                        rcu += read_units(item_size(item), request.get('ConsistentRead', False))
+                        if item is not None:
+                            found.append(serialize_item(expressions.project(projection, item) if projection else item))
+                    responses[table_name] = found
+                    self.record('BatchGetItem', table_name, rcu=rcu)
+                    capacity = self.capacity(table_name, params, rcu=rcu)
+                    if capacity:
+                        consumed.append(capacity)
+                result = {'Responses': responses, 'UnprocessedKeys': {}}
+                if consumed:
+                    result['ConsumedCapacity'] = consumed
+                return result, count
+        result, count = self.run('BatchGetItem', work)
+        self.wait(count)
+        return result
@@ -0,0 +1,496 @@
+"""Parser and evaluator for the DynamoDB expression language.
+
+Covers what the handlers use: key conditions, condition/filter expressions
+(comparisons, BETWEEN, IN, AND/OR/NOT, attribute_exists, attribute_not_exists,
+attribute_type, begins_with, contains, size), update expressions (SET with +/-,
+if_not_exists and list_append, REMOVE, ADD, DELETE) and projections. Items are
+plain Python values as produced by common.deserialize_item. Like DynamoDB, it
+rejects reserved words used as bare attribute names, and validate() rejects
+requests that define placeholders none of their expressions use.
+"""
+import re
+from decimal import Decimal
+
+KEYWORDS = {'AND', 'OR', 'NOT', 'BETWEEN', 'IN', 'SET', 'REMOVE', 'ADD', 'DELETE'}
+# Attribute names that must go through an ExpressionAttributeNames placeholder
+RESERVED_WORDS = frozenset('''
+ABORT ABSOLUTE ACTION ADD AFTER AGENT AGGREGATE ALL ALLOCATE ALTER ANALYZE AND ANY ARCHIVE ARE
+ARRAY AS ASC ASCII ASENSITIVE ASSERTION ASYMMETRIC AT ATOMIC ATTACH ATTRIBUTE AUTH AUTHORIZATION
+AUTHORIZE AUTO AVG BACK BACKUP BASE BATCH BEFORE BEGIN BETWEEN BIGINT BINARY BIT BLOB BLOCK BOOLEAN
+BOTH BREADTH BUCKET BULK BY BYTE CALL CALLED CALLING CAPACITY CASCADE CASCADED CASE CAST CATALOG
+CHAR CHARACTER CHECK CLASS CLOB CLOSE CLUSTER CLUSTERED CLUSTERING CLUSTERS COALESCE COLLATE
+COLLATION COLLECTION COLUMN COLUMNS COMBINE COMMENT COMMIT COMPACT COMPILE COMPRESS CONDITION
+CONFLICT CONNECT CONNECTION CONSISTENCY CONSISTENT CONSTRAINT CONSTRAINTS CONSTRUCTOR CONSUMED
+CONTINUE CONVERT COPY CORRESPONDING COUNT COUNTER CREATE CROSS CUBE CURRENT CURSOR CYCLE DATA
+DATABASE DATE DATETIME DAY DEALLOCATE DEC DECIMAL DECLARE DEFAULT DEFERRABLE DEFERRED DEFINE
+DEFINED DEFINITION DELETE DELIMITED DEPTH DEREF DESC DESCRIBE DESCRIPTOR DETACH DETERMINISTIC
+DIAGNOSTICS DIRECTORIES DISABLE DISCONNECT DISTINCT DISTRIBUTE DO DOMAIN DOUBLE DROP DUMP DURATION
+DYNAMIC EACH ELEMENT ELSE ELSEIF EMPTY ENABLE END EQUAL EQUALS ERROR ESCAPE ESCAPED EVAL EVALUATE
+EXCEEDED EXCEPT EXCEPTION EXCEPTIONS EXCLUSIVE EXEC EXECUTE EXISTS EXIT EXPLAIN EXPLODE EXPORT
+EXPRESSION EXTENDED EXTERNAL EXTRACT FAIL FALSE FAMILY FETCH FIELDS FILE FILTER FILTERING FINAL
+FINISH FIRST FIXED FLATTERN FLOAT FOR FORCE FOREIGN FORMAT FORWARD FOUND FREE FROM FULL FUNCTION
+FUNCTIONS GENERAL GENERATE GET GLOB GLOBAL GO GOTO GRANT GREATER GROUP GROUPING HANDLER HASH HAVE
+HAVING HEAP HIDDEN HOLD HOUR IDENTIFIED IDENTITY IF IGNORE IMMEDIATE IMPORT IN INCLUDING INCLUSIVE
+INCREMENT INCREMENTAL INDEX INDEXED INDEXES INDICATOR INFINITE INITIALLY INLINE INNER INNTER INOUT
+INPUT INSENSITIVE INSERT INSTEAD INT INTEGER INTERSECT INTERVAL INTO INVALIDATE IS ISOLATION ITEM
+ITEMS ITERATE JOIN KEY KEYS LAG LANGUAGE LARGE LAST LATERAL LEAD LEADING LEAVE LEFT LENGTH LESS
+LEVEL LIKE LIMIT LIMITED LINES LIST LOAD LOCAL LOCALTIME LOCALTIMESTAMP LOCATION LOCATOR LOCK LOCKS
+LOG LOGED LONG LOOP LOWER MAP MATCH MATERIALIZED MAX MAXLEN MEMBER MERGE METHOD METRICS MIN MINUS
+MINUTE MISSING MOD MODE MODIFIES MODIFY MODULE MONTH MULTI MULTISET NAME NAMES NATIONAL NATURAL
+NCHAR NCLOB NEW NEXT NO NONE NOT NULL NULLIF NUMBER NUMERIC OBJECT OF OFFLINE OFFSET OLD ON ONLINE
+ONLY OPAQUE OPEN OPERATOR OPTION OR ORDER ORDINALITY OTHER OTHERS OUT OUTER OUTPUT OVER OVERLAPS
+OVERRIDE OWNER PAD PARALLEL PARAMETER PARAMETERS PARTIAL PARTITION PARTITIONED PARTITIONS PATH
+PERCENT PERCENTILE PERMISSION PERMISSIONS PIPE PIPELINED PLAN POOL POSITION PRECISION PREPARE
+PRESERVE PRIMARY PRIOR PRIVATE PRIVILEGES PROCEDURE PROCESSED PROJECT PROJECTION PROPERTY
+PROVISIONING PUBLIC PUT QUERY QUIT QUORUM RAISE RANDOM RANGE RANK RAW READ READS REAL REBUILD
+RECORD RECURSIVE REDUCE REF REFERENCE REFERENCES REFERENCING REGEXP REGION REINDEX RELATIVE
+RELEASE REMAINDER RENAME REPEAT REPLACE REQUEST RESET RESIGNAL RESOURCE RESPONSE RESTORE RESTRICT
+RESULT RETURN RETURNING RETURNS REVERSE REVOKE RIGHT ROLE ROLES ROLLBACK ROLLUP ROUTINE ROW ROWS
+RULE RULES SAMPLE SATISFIES SAVE SAVEPOINT SCAN SCHEMA SCOPE SCROLL SEARCH SECOND SECTION SEGMENT
+SEGMENTS SELECT SELF SEMI SENSITIVE SEPARATE SEQUENCE SERIALIZABLE SESSION SET SETS SHARD SHARE
+SHARED SHORT SHOW SIGNAL SIMILAR SIZE SKEWED SMALLINT SNAPSHOT SOME SOURCE SPACE SPACES SPARSE
+SPECIFIC SPECIFICTYPE SPLIT SQL SQLCODE SQLERROR SQLEXCEPTION SQLSTATE SQLWARNING START STATE
+STATIC STATUS STORAGE STORE STORED STREAM STRING STRUCT STYLE SUB SUBMULTISET SUBPARTITION
+SUBSTRING SUBTYPE SUM SUPER SYMMETRIC SYNONYM SYSTEM TABLE TABLESAMPLE TEMP TEMPORARY TERMINATED
+TEXT THAN THEN THROUGHPUT TIME TIMESTAMP TIMEZONE TINYINT TO TOKEN TOTAL TOUCH TRAILING
+TRANSACTION TRANSFORM TRANSLATE TRANSLATION TREAT TRIGGER TRIM TRUE TRUNCATE TTL TUPLE TYPE UNDER
+UNDO UNION UNIQUE UNIT UNKNOWN UNLOGGED UNNEST UNPROCESSED UNSIGNED UNTIL UPDATE UPPER URL USAGE
+USE USER USERS USING UUID VACUUM VALUE VALUED VALUES VARCHAR VARIABLE VARIANCE VARINT VARYING VIEW
+VIEWS VIRTUAL VOID WAIT WHEN WHENEVER WHERE WHILE WINDOW WITH WITHIN WITHOUT WORK WRAPPED WRITE
+YEAR ZONE
+'''.split())
+TOKEN = re.compile(r"\s*(?:(<>|<=|>=|[=<>(),.\[\]+-])|([#:]?[A-Za-z0-9_]+))")
+MISSING = object()
+
+
+class ExpressionError(ValueError):
+    pass
+
+
+def tokenize(text):
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = TOKEN.match(text, position)
+        if not match:
+            raise ExpressionError(f'Invalid expression near: {text[position:]!r}')
+        tokens.append(match.group(1) or match.group(2))
+        position = match.end()
+    return tokens
+
+
+class Parser:
+    def __init__(self, text, names, values):
+        self.tokens = tokenize(text)
+        self.position = 0
+        self.names = names or {}
+        self.values = values or {}
+        # Placeholders the expression refers to, for validate()
+        self.used = set()
+
+    def peek(self, offset=0):
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else None
+
+    def keyword(self, offset=0):
+        token = self.peek(offset)
+        return token.upper() if token and token.upper() in KEYWORDS else None
+
+    def take(self, expected=None):
+        token = self.peek()
+        if token is None or (expected and token.upper() != expected):
+            raise ExpressionError(f'Expected {expected or "a token"}, got {token!r}')
+        self.position += 1
+        return token
+
+    def done(self):
+        return self.position >= len(self.tokens)
+
+    # Paths and operands
+
+    def name(self, token):
+        if token.startswith('#'):
+            if token not in self.names:
+                raise ExpressionError(f'Undefined attribute name {token}')
+            self.used.add(token)
+            return self.names[token]
+        if token.upper() in RESERVED_WORDS:
+            raise ExpressionError(f'Attribute name is a reserved keyword; reserved keyword: {token}')
+        return token
+
+    def path(self):
+        parts = [self.name(self.take())]
+        while self.peek() in ('.', '['):
+            if self.take() == '.':
+                parts.append(self.name(self.take()))
+            else:
+                parts.append(int(self.take()))
+                self.take(']')
+        return ('path', parts)
+
+    def operand(self):
+        token = self.peek()
+        if token.startswith(':'):
+            self.take()
+            if token not in self.values:
+                raise ExpressionError(f'Undefined attribute value {token}')
+            self.used.add(token)
+            return ('value', self.values[token])
+        if self.peek(1) == '(' and not token.startswith('#'):
+            return self.function()
+        return self.path()
+
+    def function(self):
+        name = self.take()
+        self.take('(')
+        args = [self.value_expression()]
+        while self.peek() == ',':
+            self.take()
+            args.append(self.value_expression())
+        self.take(')')
+        return ('call', name, args)
+
+    def value_expression(self):
+        left = self.operand()
+        if self.peek() in ('+', '-'):
+            op = self.take()
+            return ('arith', op, left, self.operand())
+        return left
+
+    # Conditions (NOT binds tighter than AND, AND tighter than OR)
+
+    def condition(self):
+        left = self.conjunction()
+        while self.keyword() == 'OR':
+            self.take()
+            left = ('or', left, self.conjunction())
+        return left
+
+    def conjunction(self):
+        left = self.negation()
+        while self.keyword() == 'AND':
+            self.take()
+            left = ('and', left, self.negation())
+        return left
+
+    def negation(self):
+        if self.keyword() == 'NOT':
+            self.take()
+            return ('not', self.negation())
+        return self.comparison()
+
+    def comparison(self):
+        if self.peek() == '(':
+            self.take()
+            inner = self.condition()
+            self.take(')')
+            return inner
+        left = self.operand()
+        token = self.peek()
+        if token in ('=', '<>', '<', '<=', '>', '>='):
+            self.take()
+            return ('compare', token, left, self.operand())
+        if self.keyword() == 'BETWEEN':
+            self.take()
+            low = self.operand()
+            self.take('AND')
+            return ('between', left, low, self.operand())
+        if self.keyword() == 'IN':
+            self.take()
+            self.take('(')
+            options = [self.operand()]
+            while self.peek() == ',':
+                self.take()
+                options.append(self.operand())
+            self.take(')')
+            return ('in', left, options)
+        if left[0] == 'call':
+            return ('truth', left)
+        raise ExpressionError(f'Expected a comparison, got {token!r}')
+
+    # Update expressions
+
+    def update(self):
+        actions = []
+        while not self.done():
+            clause = self.take().upper()
+            while True:
+                path = self.path()
+                if clause == 'SET':
+                    self.take('=')
+                    actions.append(('SET', path, self.value_expression()))
+                elif clause == 'REMOVE':
+                    actions.append(('REMOVE', path, None))
+                elif clause in ('ADD', 'DELETE'):
+                    actions.append((clause, path, self.operand()))
+                else:
+                    raise ExpressionError(f'Unknown update clause {clause}')
+                if self.peek() != ',':
+                    break
+                self.take()
+        return actions
+
+    def projection(self):
+        paths = [self.path()]
+        while self.peek() == ',':
+            self.take()
+            paths.append(self.path())
+        return paths
+
+
+def parse_condition(text, names=None, values=None):
+    parser = Parser(text, names, values)
+    tree = parser.condition()
+    if not parser.done():
+        raise ExpressionError(f'Unexpected token {parser.peek()!r}')
+    return tree
+
+
+def parse_update(text, names=None, values=None):
+    return Parser(text, names, values).update()
+
+
+def parse_projection(text, names=None):
+    return Parser(text, names, None).projection()
+
+
+def validate(expressions, names=None, values=None):
+    # Checks a request the way DynamoDB does before running it: every expression must
+    # parse, and every placeholder in names and values must be used by one of them.
+    # expressions maps parameter names (e.g. 'ConditionExpression') to their text.
+    used = set()
+    for parameter, text in expressions.items():
+        parser = Parser(text, names, values)
+        if parameter == 'UpdateExpression':
+            parser.update()
+        elif parameter == 'ProjectionExpression':
+            parser.projection()
+        else:
+            parser.condition()
+        if not parser.done():
+            raise ExpressionError(f'Invalid {parameter}: unexpected token {parser.peek()!r}')
+        used |= parser.used
+    for kind, defined in (('ExpressionAttributeNames', names), ('ExpressionAttributeValues', values)):
+        if defined is None:
+            continue
+        if not expressions:
+            raise ExpressionError(f'{kind} can only be specified when using expressions')
+        unused = sorted(set(defined) - used)
+        if unused:
+            raise ExpressionError(f"Value provided in {kind} unused in expressions: keys: {{{', '.join(unused)}}}")
+
+
+# Evaluation
+
+def resolve(item, parts):
+    value = item
+    for part in parts:
+        if isinstance(part, int):
+            if not isinstance(value, list) or part >= len(value):
+                return MISSING
+            value = value[part]
+        else:
+            if not isinstance(value, dict) or part not in value:
+                return MISSING
+            value = value[part]
+    return value
+
+
+def type_name(value):
+    if isinstance(value, str):
+        return 'S'
+    if isinstance(value, bool):
+        return 'BOOL'
+    if isinstance(value, (int, float, Decimal)):
+        return 'N'
+    if isinstance(value, (bytes, bytearray)):
+        return 'B'
+    if value is None:
+        return 'NULL'
+    if isinstance(value, dict):
+        return 'M'
+    if isinstance(value, list):
+        return 'L'
+    if isinstance(value, (set, frozenset)):
+        sample = next(iter(value))
+        return 'SS' if isinstance(sample, str) else 'BS' if isinstance(sample, bytes) else 'NS'
+    return '?'
+
+
+def evaluate(node, item):
+    kind = node[0]
+    if kind == 'value':
+        return node[1]
+    if kind == 'path':
+        return resolve(item, node[1])
+    if kind == 'arith':
+        left, right = evaluate(node[2], item), evaluate(node[3], item)
+        if left is MISSING or right is MISSING:
+            raise ExpressionError('An operand in the update expression does not exist in the item')
+        return left + right if node[1] == '+' else left - right
+    if kind == 'call':
+        return call(node[1], node[2], item)
+    return test(node, item)
+
+
+def call(name, args, item):
+    if name == 'if_not_exists':
+        value = evaluate(args[0], item)
+        return evaluate(args[1], item) if value is MISSING else value
+    if name == 'list_append':
+        return list(evaluate(args[0], item)) + list(evaluate(args[1], item))
+    if name == 'size':
+        value = evaluate(args[0], item)
+        return MISSING if value is MISSING else len(value)
+    if name == 'attribute_exists':
+        return evaluate(args[0], item) is not MISSING
+    if name == 'attribute_not_exists':
+        return evaluate(args[0], item) is MISSING
+    if name == 'attribute_type':
+        value = evaluate(args[0], item)
+        return value is not MISSING and type_name(value) == evaluate(args[1], item)
+    if name == 'begins_with':
+        value, prefix = evaluate(args[0], item), evaluate(args[1], item)
+        return isinstance(value, (str, bytes)) and value.startswith(prefix)
+    if name == 'contains':
+        value, member = evaluate(args[0], item), evaluate(args[1], item)
+        if isinstance(value, str):
+            return isinstance(member, str) and member in value
+        if isinstance(value, (set, frozenset, list)):
+            return member in value
+        return False
+    raise ExpressionError(f'Unknown function {name}')
+
+
+def compare(op, left, right):
+    if left is MISSING or right is MISSING:
+        return op == '<>' and not (left is MISSING and right is MISSING)
+    try:
+        if op == '=':
+            return left == right
+        if op == '<>':
+            return left != right
+        if op == '<':
+            return left < right
+        if op == '<=':
+            return left <= right
+        if op == '>':
+            return left > right
+        return left >= right
+    except TypeError:
+        return False
+
+
+def test(node, item):
+    kind = node[0]
+    if kind == 'and':
+        return test(node[1], item) and test(node[2], item)
+    if kind == 'or':
+        return test(node[1], item) or test(node[2], item)
+    if kind == 'not':
+        return not test(node[1], item)
+    if kind == 'compare':
+        return compare(node[1], evaluate(node[2], item), evaluate(node[3], item))
+    if kind == 'between':
+        value = evaluate(node[1], item)
+        return compare('>=', value, evaluate(node[2], item)) and compare('<=', value, evaluate(node[3], item))
+    if kind == 'in':
+        value = evaluate(node[1], item)
+        return any(compare('=', value, evaluate(option, item)) for option in node[2])
+    if kind == 'truth':
+        return bool(evaluate(node[1], item))
+    raise ExpressionError(f'Not a condition: {kind}')
+
+
+def key_equalities(node):
+    # Attribute names compared with '=' in the top-level AND chain of a key condition
+    if node[0] == 'and':
+        found = key_equalities(node[1])
+        found.update(key_equalities(node[2]))
+        return found
+    if node[0] == 'compare' and node[1] == '=' and node[2][0] == 'path' and node[3][0] == 'value':
+        return {node[2][1][0]: node[3][1]}
+    return {}
+
+
+def assign(item, parts, value):
+    target = item
+    for part in parts[:-1]:
+        target = target[part]
+    last = parts[-1]
+    if isinstance(last, int) and last >= len(target):
+        target.append(value)
+    else:
+        target[last] = value
+
+
+def discard(item, parts):
+    target = resolve(item, parts[:-1]) if len(parts) > 1 else item
+    if isinstance(target, dict):
+        target.pop(parts[-1], None)
+    elif isinstance(target, list) and parts[-1] < len(target):
+        del target[parts[-1]]
+
+
+def apply_update(actions, item):
+    # Every right-hand side is evaluated against the item as it was before the update
+    original = item
+    updated = deep_copy(item)
+    changed = set()
+    for action, path, operand in actions:
+        parts = path[1]
+        changed.add(parts[0])
+        if action == 'SET':
+            assign(updated, parts, deep_copy(evaluate(operand, original)))
+        elif action == 'REMOVE':
+            discard(updated, parts)
+        elif action == 'ADD':
+            value = evaluate(operand, original)
+            current = resolve(updated, parts)
+            if current is MISSING:
+                assign(updated, parts, set(value) if isinstance(value, (set, frozenset)) else value)
+            elif isinstance(current, (set, frozenset)):
+                if not isinstance(value, (set, frozenset)):
+                    raise ExpressionError('An operand in the update expression has an incorrect data type')
+                assign(updated, parts, set(current) | set(value))
+            elif isinstance(current, (int, float, Decimal)) and not isinstance(current, bool):
+                assign(updated, parts, current + value)
+            else:
+                raise ExpressionError('An operand in the update expression has an incorrect data type')
+        elif action == 'DELETE':
+            value = evaluate(operand, original)
+            current = resolve(updated, parts)
+            if current is MISSING:
+                continue
+            if not isinstance(current, (set, frozenset)):
+                raise ExpressionError('An operand in the update expression has an incorrect data type')
+            remaining = set(current) - set(value)
+            if remaining:
+                assign(updated, parts, remaining)
+            else:
+                discard(updated, parts)
+    return updated, changed
+
+
+def project(paths, item):
+    result = {}
+    for _, parts in paths:
+        value = resolve(item, parts)
+        if value is MISSING:
+            continue
+        target = result
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = deep_copy(value)
+    return result
+
+
+def deep_copy(value):
+    if isinstance(value, dict):
+        return {k: deep_copy(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [deep_copy(v) for v in value]
+    if isinstance(value, (set, frozenset)):
+        return set(value)
+    return value
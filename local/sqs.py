@@ -0,0 +1,108 @@
+"""In-process stand-in for an SQS queue feeding a Lambda event source mapping.
+
+LocalQueue accepts the SendMessage/SendMessageBatch calls jobs.enqueue makes and
+drain() plays the event source mapping: it hands the worker batches of records in
+the Lambda SQS event format, deletes what succeeded, redelivers what the worker
+reported in batchItemFailures and moves records that keep failing to a dead-letter
+list. duplicate_rate redelivers a share of successful records once more, the way
+SQS standard queues occasionally do, to exercise idempotency.
+"""
+import random
+import threading
+import uuid
+from collections import deque
+
+from .dynamodb import ClientError
+
+MAX_BATCH_ENTRIES = 10
+MAX_MESSAGE_BYTES = 256 * 1024
+
+
+class LocalQueue:
+    def __init__(self, name='fanout-queue', max_receive_count=5, duplicate_rate=0.0, seed=None):
+        self.name = name
+        self.url = f'https://sqs.local/000000000000/{name}'
+        self.arn = f'arn:aws:sqs:local:000000000000:{name}'
+        self.max_receive_count = max_receive_count
+        self.duplicate_rate = duplicate_rate
+        self.random = random.Random(seed)
+        self.messages = deque()
+        self.dead_letters = []
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.deliveries = 0
+
+    def __len__(self):
+        return len(self.messages)
+
+    def check_url(self, queue_url, operation):
+        if queue_url != self.url:
+            raise ClientError('AWS.SimpleQueueService.NonExistentQueue', 'The specified queue does not exist', operation)
+
+    def append(self, body):
+        message_id = str(uuid.uuid4())
+        self.messages.append({'messageId': message_id, 'body': body, 'receiveCount': 0})
+        self.sent += 1
+        return message_id
+
+    def send_message(self, QueueUrl, MessageBody, **params):
+        self.check_url(QueueUrl, 'SendMessage')
+        if len(MessageBody.encode('utf-8')) > MAX_MESSAGE_BYTES:
+            raise ClientError('InvalidParameterValue', 'Message must be shorter than 262144 bytes', 'SendMessage')
+        with self.lock:
+            return {'MessageId': self.append(MessageBody)}
+
+    def send_message_batch(self, QueueUrl, Entries, **params):
+        self.check_url(QueueUrl, 'SendMessageBatch')
+        if len(Entries) > MAX_BATCH_ENTRIES:
+            raise ClientError('AWS.SimpleQueueService.TooManyEntriesInBatchRequest',
+                              'Maximum number of entries per request are 10', 'SendMessageBatch')
+        if sum(len(entry['MessageBody'].encode('utf-8')) for entry in Entries) > MAX_MESSAGE_BYTES:
+            raise ClientError('AWS.SimpleQueueService.BatchRequestTooLong',
+                              'Batch requests cannot be longer than 262144 bytes', 'SendMessageBatch')
+        with self.lock:
+            successful = [{'Id': entry['Id'], 'MessageId': self.append(entry['MessageBody'])} for entry in Entries]
+        return {'Successful': successful, 'Failed': []}
+
+    def receive(self, batch_size=10):
+        # Takes up to batch_size messages off the queue as Lambda SQS event records
+        with self.lock:
+            batch = [self.messages.popleft() for _ in range(min(batch_size, len(self.messages)))]
+        for message in batch:
+            message['receiveCount'] += 1
+        return batch
+
+    def record(self, message):
+        return {
+            'messageId': message['messageId'],
+            'receiptHandle': message['messageId'],
+            'body': message['body'],
+            'attributes': {'ApproximateReceiveCount': str(message['receiveCount'])},
+            'eventSource': 'aws:sqs',
+            'eventSourceARN': self.arn,
+        }
+
+    def drain(self, worker, batch_size=10, context=None):
+        # Invokes worker(event, context) until the queue is empty; returns the invocation count
+        invocations = 0
+        while True:
+            batch = self.receive(batch_size)
+            if not batch:
+                return invocations
+            invocations += 1
+            self.deliveries += len(batch)
+            try:
+                result = worker({'Records': [self.record(message) for message in batch]}, context)
+                failed = {failure['itemIdentifier'] for failure in (result or {}).get('batchItemFailures', [])}
+            except Exception:
+                # An invocation error returns the whole batch to the queue
+                failed = {message['messageId'] for message in batch}
+            with self.lock:
+                for message in batch:
+                    if message['messageId'] in failed:
+                        if message['receiveCount'] >= self.max_receive_count:
+                            self.dead_letters.append(message)
+                        else:
+                            self.messages.append(message)
+                    elif self.duplicate_rate and not message.get('duplicate') and self.random.random() < self.duplicate_rate:
+                        self.messages.append(dict(message, duplicate=True))
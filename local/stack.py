@@ -0,0 +1,131 @@
+"""The DynamoDB tables from __main__.py, created on a LocalDynamoDB.
+
+install() builds the stand-in, creates the tables, sets the environment variables
+the handlers read at import time and points common at the stand-in; install_queue()
+does the same for the group fan-out queue and install_push() for WebSocket push.
+Keep TABLES in step with the Pulumi definitions.
+"""
+import json
+import os
+import uuid
+
+import common
+from .dynamodb import LocalDynamoDB
+from .sqs import LocalQueue
+from .websocket import LocalConnectionManager
+
+TABLES = {
+    'USERS_TABLE_NAME': {
+        'name': 'users-table',
+        'hash_key': 'userId',
+    },
+    'MESSAGES_TABLE_NAME': {
+        'name': 'messages-table',
+        'hash_key': 'messageId',
+        'range_key': 'recipientId',
+        'global_indexes': [{
+            'name': 'inbox-index',
+            'hash_key': 'recipientId',
+            'range_key': 'inboxKey',
+            'projection_type': 'ALL',
+        }],
+        'ttl_attribute': 'expiresAt',
+        'stream_view_type': 'OLD_IMAGE',
+    },
+    'GROUPS_TABLE_NAME': {
+        'name': 'groups-table',
+        'hash_key': 'groupId',
+    },
+    'GROUP_MESSAGES_TABLE_NAME': {
+        'name': 'group-messages-table',
+        'hash_key': 'groupId',
+        'range_key': 'messageId',
+        'ttl_attribute': 'expiresAt',
+        'stream_view_type': 'OLD_IMAGE',
+    },
+    'MEMBERSHIPS_TABLE_NAME': {
+        'name': 'memberships-table',
+        'hash_key': 'userId',
+        'range_key': 'groupId',
+    },
+    'CONNECTIONS_TABLE_NAME': {
+        'name': 'connections-table',
+        'hash_key': 'userId',
+        'range_key': 'connectionId',
+        'global_indexes': [{
+            'name': 'connection-index',
+            'hash_key': 'connectionId',
+            'projection_type': 'KEYS_ONLY',
+        }],
+        'ttl_attribute': 'expiresAt',
+    },
+    'CONVERSATIONS_TABLE_NAME': {
+        'name': 'conversations-table',
+        'hash_key': 'userId',
+        'range_key': 'conversationKey',
+        'local_indexes': [{
+            'name': 'recency-index',
+            'range_key': 'lastMessageId',
+            'projection_type': 'ALL',
+        }],
+    },
+    'IDEMPOTENCY_TABLE_NAME': {
+        'name': 'idempotency-table',
+        'hash_key': 'idempotencyKey',
+        'ttl_attribute': 'expiresAt',
+    },
+}
+
+
+def install(client=None, **options):
+    # Returns the LocalDynamoDB the handlers now talk to; options go to its constructor
+    if client is None:
+        client = LocalDynamoDB(**options)
+    for variable, definition in TABLES.items():
+        definition = dict(definition)
+        client.add_table(definition.pop('name'), **definition)
+        os.environ[variable] = TABLES[variable]['name']
+    common.use_client(client)
+    return client
+
+
+def install_queue(queue=None, **options):
+    # Turns on queued group fan-out; call before send_group_message is imported, since
+    # jobs reads FANOUT_QUEUE_URL at import time. Drain with queue.drain(fanout_worker.handler).
+    if queue is None:
+        queue = LocalQueue(**options)
+    os.environ['FANOUT_QUEUE_URL'] = queue.url
+    import jobs
+    jobs.use_queue_client(queue)
+    return queue
+
+
+def install_push(manager=None, **options):
+    # Turns on WebSocket push; like install_queue(), call before the send handlers are
+    # imported. Connect clients with manager.connect(ws_connect.handler, user_id).
+    if manager is None:
+        manager = LocalConnectionManager(**options)
+    os.environ['WEBSOCKET_ENDPOINT'] = manager.endpoint
+    import push
+    push.use_push_client(manager)
+    return manager
+
+
+def api_event(resource, method='POST', body=None, headers=None):
+    # A REST API proxy integration event, as API Gateway passes it to the handlers
+    return {
+        'resource': resource,
+        'path': resource,
+        'httpMethod': method,
+        'headers': dict(headers or {}),
+        'queryStringParameters': None,
+        'pathParameters': None,
+        'requestContext': {
+            'resourcePath': resource,
+            'httpMethod': method,
+            'requestId': str(uuid.uuid4()),
+            'stage': 'local',
+        },
+        'body': json.dumps(body) if body is not None else None,
+        'isBase64Encoded': False,
+    }
@@ -0,0 +1,81 @@
+"""In-process stand-in for the WebSocket API and its connection management client.
+
+LocalConnectionManager answers the PostToConnection calls push.deliver makes and
+keeps what each connection received. connect() and disconnect() play API Gateway's
+side: they mint a connection ID and invoke the $connect/$disconnect handlers with
+the event shape a WebSocket API passes them. drop() loses a connection without a
+$disconnect, so the next post raises GoneException the way a stale one would.
+"""
+import threading
+import time
+import uuid
+from urllib.parse import urlencode
+
+from .dynamodb import ClientError
+
+MAX_PAYLOAD_BYTES = 128 * 1024
+
+
+class LocalConnectionManager:
+    def __init__(self, endpoint='https://websocket.local/dev', latency=0.0):
+        self.endpoint = endpoint
+        self.latency = latency
+        self.connections = {}
+        self.lock = threading.Lock()
+        self.posts = 0
+        self.gone = 0
+
+    def event(self, route_key, connection_id, user_id=None):
+        event = {
+            'requestContext': {
+                'routeKey': route_key,
+                'eventType': route_key.strip('$').upper(),
+                'connectionId': connection_id,
+                'requestId': str(uuid.uuid4()),
+                'stage': 'local',
+            },
+            'isBase64Encoded': False,
+        }
+        if user_id is not None:
+            event['queryStringParameters'] = {'userId': user_id}
+            event['requestContext']['path'] = '/dev?' + urlencode({'userId': user_id})
+        return event
+
+    def connect(self, handler, user_id):
+        # Returns the new connection ID, or None when the $connect handler refused it
+        connection_id = uuid.uuid4().hex[:16]
+        result = handler(self.event('$connect', connection_id, user_id), None)
+        if result['statusCode'] != 200:
+            return None
+        with self.lock:
+            self.connections[connection_id] = []
+        return connection_id
+
+    def disconnect(self, handler, connection_id):
+        with self.lock:
+            self.connections.pop(connection_id, None)
+        return handler(self.event('$disconnect', connection_id), None)
+
+    def drop(self, connection_id):
+        with self.lock:
+            self.connections.pop(connection_id, None)
+
+    def received(self, connection_id):
+        with self.lock:
+            return list(self.connections.get(connection_id, []))
+
+    def post_to_connection(self, ConnectionId, Data, **params):
+        if self.latency:
+            time.sleep(self.latency)
+        if isinstance(Data, str):
+            Data = Data.encode('utf-8')
+        if len(Data) > MAX_PAYLOAD_BYTES:
+            raise ClientError('PayloadTooLargeException', 'Message payload is too large', 'PostToConnection')
+        with self.lock:
+            self.posts += 1
+            inbox = self.connections.get(ConnectionId)
+            if inbox is None:
+                self.gone += 1
+                raise ClientError('GoneException', 'Connection is no longer available', 'PostToConnection')
+            inbox.append(Data)
+        return {}
@@ -0,0 +1,75 @@
+"""Carry messages-table rows across the key change that replaces the table.
+
+messages-table used to be keyed by messageId alone. It is now keyed by messageId
+and recipientId, with inbox-index sorting each inbox by inboxKey, and DynamoDB
+can't change a table's key schema in place: `pulumi up` replaces the table, and
+the old table is deleted with every message in it. So export the rows first,
+from the table that is about to be replaced:
+
+    python migrations/reimport_messages.py export \\
+        --table $(pulumi stack output messages_table_name) --file messages.jsonl
+
+then run `pulumi up` and load them into the new table:
+
+    python migrations/reimport_messages.py import \\
+        --table $(pulumi stack output messages_table_name) --file messages.jsonl
+
+Old message IDs are random UUIDs, which don't sort with the time-ordered IDs
+inboxes use now, so imported rows get new inboxKeys minted at import time, in the
+order of their timestamps. Clients therefore see them as new messages once, even if
+they already hold a watermark from after the deploy, rather than never. Rows
+without a recipientId are skipped. Importing twice rewrites the same rows.
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lambda'))
+
+from common import Table, serialize_item, deserialize_item  # noqa: E402
+from fanout import FANOUT_CONCURRENCY, write_items  # noqa: E402
+from ids import new_id  # noqa: E402
+
+
+def export_rows(table, lines):
+    # Writes every row to lines as one DynamoDB-typed JSON object per line; returns the count
+    exported = 0
+    scan_args = {}
+    while True:
+        result = table.scan(**scan_args)
+        for item in result.get('Items', []):
+            lines.write(json.dumps(serialize_item(item), separators=(',', ':')) + '\n')
+            exported += 1
+        if 'LastEvaluatedKey' not in result:
+            return exported
+        scan_args['ExclusiveStartKey'] = result['LastEvaluatedKey']
+
+
+def import_rows(table, lines):
+    # Returns (imported, failed, skipped) row counts
+    rows = [deserialize_item(json.loads(line)) for line in lines if line.strip()]
+    kept = sorted((row for row in rows if row.get('recipientId')), key=lambda row: str(row.get('timestamp', '')))
+    for row in kept:
+        row['inboxKey'] = new_id()
+    imported, failed = write_items(table, kept, FANOUT_CONCURRENCY)
+    return imported, failed, len(rows) - len(kept)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('step', choices=('export', 'import'))
+    parser.add_argument('--table', required=True, help='name of the deployed messages-table')
+    parser.add_argument('--file', required=True, help='JSON lines file to write (export) or read (import)')
+    args = parser.parse_args()
+    if args.step == 'export':
+        with open(args.file, 'w', encoding='utf-8') as lines:
+            print(f'exported={export_rows(Table(args.table), lines)}')
+    else:
+        with open(args.file, encoding='utf-8') as lines:
+            imported, failed, skipped = import_rows(Table(args.table), lines)
+        print(f'imported={imported} failed={failed} skipped={skipped}')
+
+
+if __name__ == '__main__':
+    main()
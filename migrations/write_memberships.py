@@ -0,0 +1,110 @@
+"""Write memberships-table rows for groups created before the table existed.
+
+/messages finds a user's group timelines through their membership rows, which
+create_group and /group/add-user write. Groups created by older versions have a
+member list but no rows, so send_group_message keeps them on fan-out-on-write,
+whatever their size, until their item has hasMemberships set. This scans
+groups-table and, for every group without the flag, writes a row for each member
+(keeping any read cursor already there) and then sets the flag, bumping
+membershipVersion so warm containers reload the group. The flag is only set if the
+membership didn't change meanwhile; otherwise rows of users removed since are
+deleted and the group is done again. Members only see timeline messages sent after
+the flag is set; everything before is in their inboxes. The script can be re-run or
+run while the stack serves traffic. Run it once after deploying, from the repo
+root, with AWS credentials for the stack:
+
+    python migrations/write_memberships.py \\
+        --groups-table $(pulumi stack output groups_table_name) \\
+        --memberships-table $(pulumi stack output memberships_table_name)
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lambda'))
+
+from common import Table, ConditionFailed  # noqa: E402
+from clock import now_ms  # noqa: E402
+from ids import min_id  # noqa: E402
+
+
+def groups_without_memberships(groups_table):
+    # IDs of the groups whose item lacks hasMemberships
+    group_ids = []
+    scan_args = {
+        'FilterExpression': 'attribute_not_exists(hasMemberships)',
+        'ProjectionExpression': 'groupId'
+    }
+    while True:
+        result = groups_table.scan(**scan_args)
+        group_ids.extend(item['groupId'] for item in result.get('Items', []))
+        if 'LastEvaluatedKey' not in result:
+            return group_ids
+        scan_args['ExclusiveStartKey'] = result['LastEvaluatedKey']
+
+
+def write_group(groups_table, memberships_table, group_id):
+    # Returns the number of membership rows written, or None if the group is gone
+    # or already flagged
+    written = set()
+    while True:
+        item = groups_table.get_item(
+            Key={'groupId': group_id},
+            ProjectionExpression='members, membershipVersion, hasMemberships'
+        ).get('Item')
+        if item is None or item.get('hasMemberships'):
+            return None
+        members = set(item.get('members', ()))
+        # Rows written on an earlier pass for users removed since
+        for user_id in written - members:
+            memberships_table.delete_item(Key={'userId': user_id, 'groupId': group_id})
+        joined_at = min_id(now_ms())
+        for user_id in sorted(members):
+            memberships_table.update_item(
+                Key={'userId': user_id, 'groupId': group_id},
+                UpdateExpression='SET readCursor = if_not_exists(readCursor, :joinedAt)',
+                ExpressionAttributeValues={':joinedAt': joined_at}
+            )
+        written = members
+        # Unchanged since it was read: the same version, or still none (groups from
+        # before versions existed)
+        values = {':true': True, ':one': 1}
+        if 'membershipVersion' in item:
+            condition = 'membershipVersion = :version'
+            values[':version'] = item['membershipVersion']
+        else:
+            condition = 'attribute_exists(groupId) AND attribute_not_exists(membershipVersion)'
+        try:
+            groups_table.update_item(
+                Key={'groupId': group_id},
+                UpdateExpression='SET hasMemberships = :true ADD membershipVersion :one',
+                ConditionExpression=condition,
+                ExpressionAttributeValues=values
+            )
+            return len(members)
+        except ConditionFailed:
+            pass
+
+
+def write_memberships(groups_table, memberships_table):
+    # Returns (groups, rows) counts
+    groups = rows = 0
+    for group_id in groups_without_memberships(groups_table):
+        written = write_group(groups_table, memberships_table, group_id)
+        if written is not None:
+            groups += 1
+            rows += written
+    return groups, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--groups-table', required=True, help='name of the deployed groups-table')
+    parser.add_argument('--memberships-table', required=True, help='name of the deployed memberships-table')
+    args = parser.parse_args()
+    groups, rows = write_memberships(Table(args.groups_table), Table(args.memberships_table))
+    print(f'groups={groups} rows={rows}')
+
+
+if __name__ == '__main__':
+    main()
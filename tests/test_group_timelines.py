@@ -0,0 +1,24 @@
+import pytest
+
+
+@pytest.fixture
+def fanout_on_read_from_3(monkeypatch):
+    import send_group_message
+    monkeypatch.setattr(send_group_message, 'FANOUT_ON_READ_MIN_MEMBERS', 3)
+
+
+def test_poll_queries_only_groups_with_a_timeline(api, fanout_on_read_from_3):
+    a, b, c = api.register('a'), api.register('b'), api.register('c')
+    small = [api.ok('/group', {'groupName': f's{i}', 'members': [a, b]})['groupId'] for i in range(10)]
+    large = api.ok('/group', {'groupName': 'l', 'members': [a, b, c]})['groupId']
+    api.ok('/group/message', {'senderId': a, 'groupId': small[0], 'content': 'small'}, status=202)
+    api.drain()
+    api.ok('/group/message', {'senderId': a, 'groupId': large, 'content': 'large'})
+
+    page = api.ok('/messages', {'userId': b})
+    assert [m['content'] for m in page['messages']] == ['small', 'large']
+
+    api.client.reset_stats()
+    assert api.ok('/messages', {'userId': b, 'since': page['watermark']})['messages'] == []
+    # The inbox, the membership rows and the one timeline
+    assert api.client.stats()['calls']['Query'] == 3
@@ -0,0 +1,42 @@
+def inbox(api, user_id):
+    return [m['content'] for m in api.ok('/messages', {'userId': user_id})['messages']]
+
+
+def test_retried_send_is_replayed_not_stored_again(api):
+    a, b = api.register('a'), api.register('b')
+    headers = {'Idempotency-Key': 'retry-1'}
+    first = api.invoke('/message', {'senderId': a, 'recipientId': b, 'content': 'once'}, headers)
+    retry = api.invoke('/message', {'senderId': a, 'recipientId': b, 'content': 'once'}, headers)
+    assert retry['statusCode'] == first['statusCode'] == 200
+    assert retry['body'] == first['body']
+    assert retry['headers']['Idempotent-Replayed'] == 'true'
+    assert inbox(api, b) == ['once']
+
+
+def test_key_reused_for_another_body_is_a_422(api):
+    a, b = api.register('a'), api.register('b')
+    headers = {'Idempotency-Key': 'retry-2'}
+    api.ok('/message', {'senderId': a, 'recipientId': b, 'content': 'one'}, headers)
+    status, _ = api.call('/message', {'senderId': a, 'recipientId': b, 'content': 'two'}, headers)
+    assert status == 422
+    assert inbox(api, b) == ['one']
+
+
+def test_keys_are_scoped_to_the_sender(api):
+    a, b, c = api.register('a'), api.register('b'), api.register('c')
+    headers = {'Idempotency-Key': 'same'}
+    api.ok('/message', {'senderId': a, 'recipientId': c, 'content': 'from a'}, headers)
+    api.ok('/message', {'senderId': b, 'recipientId': c, 'content': 'from b'}, headers)
+    assert sorted(inbox(api, c)) == ['from a', 'from b']
+
+
+def test_retried_group_send_does_not_fan_out_again(api):
+    a, b = api.register('a'), api.register('b')
+    group_id = api.ok('/group', {'groupName': 'ab', 'members': [a, b]})['groupId']
+    body = {'senderId': a, 'groupId': group_id, 'content': 'hi all'}
+    headers = {'Idempotency-Key': 'group-1'}
+    api.ok('/group/message', body, headers, status=202)
+    api.ok('/group/message', body, headers, status=202)
+    assert api.queue.sent == 1
+    api.drain()
+    assert inbox(api, b) == ['hi all']
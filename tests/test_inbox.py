@@ -0,0 +1,59 @@
+def send(api, sender, recipient, count, prefix='m'):
+    return [api.ok('/message', {'senderId': sender, 'recipientId': recipient, 'content': f'{prefix}{i}'})['messageId']
+            for i in range(count)]
+
+
+def contents(page):
+    return [m['content'] for m in page['messages']]
+
+
+def test_pages_and_since_return_each_message_once(api):
+    a, b = api.register('a'), api.register('b')
+    send(api, a, b, 5)
+    first = api.ok('/messages', {'userId': b, 'limit': 2})
+    second = api.ok('/messages', {'userId': b, 'limit': 2, 'nextToken': first['nextToken']})
+    third = api.ok('/messages', {'userId': b, 'limit': 2, 'nextToken': second['nextToken']})
+    assert contents(first) + contents(second) + contents(third) == ['m0', 'm1', 'm2', 'm3', 'm4']
+    assert third['nextToken'] is None
+
+    assert api.ok('/messages', {'userId': b, 'since': third['watermark']})['messages'] == []
+    send(api, a, b, 1, prefix='n')
+    assert contents(api.ok('/messages', {'userId': b, 'since': third['watermark']})) == ['n0']
+
+
+def test_ack_moves_the_delivered_cursor_and_unread_count(api):
+    a, b = api.register('a'), api.register('b')
+    send(api, a, b, 3)
+    page = api.ok('/messages', {'userId': b, 'limit': 2})
+    assert api.ok('/messages/unread-count', {'userId': b})['unread'] == 3
+
+    assert api.ok('/messages/ack', {'userId': b, 'watermark': page['watermark']})['advanced']
+    assert contents(api.ok('/messages', {'userId': b})) == ['m2']
+    assert api.ok('/messages/unread-count', {'userId': b})['unread'] == 1
+    # Acknowledging an older position changes nothing
+    first = page['messages'][0]['messageId']
+    assert not api.ok('/messages/ack', {'userId': b, 'messageId': first})['advanced']
+    assert api.ok('/messages/unread-count', {'userId': b})['unread'] == 1
+
+
+def test_ack_with_delete_removes_acknowledged_rows(api):
+    a, b = api.register('a'), api.register('b')
+    send(api, a, b, 3)
+    watermark = api.ok('/messages', {'userId': b})['watermark']
+    result = api.ok('/messages/ack', {'userId': b, 'watermark': watermark, 'delete': True})
+    assert result['deleted'] == 3 and not result['moreToDelete']
+
+
+def test_ack_rejects_unknown_users_and_bad_positions(api):
+    a = api.register('a')
+    assert api.call('/messages/ack', {'userId': a, 'watermark': 'nope'})[0] == 400
+    watermark = send(api, a, a, 1)[0]
+    assert api.call('/messages/ack', {'userId': 'missing', 'watermark': watermark})[0] == 404
+
+
+def test_blocked_sender_is_rejected(api):
+    a, b = api.register('a'), api.register('b')
+    api.ok('/block', {'blockerId': b, 'blockedId': a})
+    status, _ = api.call('/message', {'senderId': a, 'recipientId': b, 'content': 'hi'})
+    assert status == 403
+    assert api.ok('/messages', {'userId': b})['messages'] == []
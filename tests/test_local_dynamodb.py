@@ -0,0 +1,59 @@
+import pytest
+
+from local.dynamodb import ClientError, LocalDynamoDB
+
+
+@pytest.fixture
+def client():
+    client = LocalDynamoDB()
+    client.add_table('t', 'id')
+    client.put_item(TableName='t', Item={'id': {'S': 'a'}, 'n': {'N': '1'}})
+    return client
+
+
+def validation_message(call):
+    with pytest.raises(ClientError) as error:
+        call()
+    assert error.value.response['Error']['Code'] == 'ValidationException'
+    return error.value.response['Error']['Message']
+
+
+def test_unused_attribute_values_are_rejected(client):
+    message = validation_message(lambda: client.update_item(
+        TableName='t', Key={'id': {'S': 'a'}}, UpdateExpression='SET n = :one',
+        ExpressionAttributeValues={':one': {'N': '1'}, ':two': {'N': '2'}}))
+    assert 'unused in expressions' in message and ':two' in message
+
+
+def test_unused_attribute_names_are_rejected(client):
+    message = validation_message(lambda: client.get_item(
+        TableName='t', Key={'id': {'S': 'a'}}, ProjectionExpression='n',
+        ExpressionAttributeNames={'#n': 'n'}))
+    assert 'ExpressionAttributeNames unused' in message
+
+
+def test_values_without_expressions_are_rejected(client):
+    validation_message(lambda: client.put_item(
+        TableName='t', Item={'id': {'S': 'b'}}, ExpressionAttributeValues={':x': {'S': 'x'}}))
+
+
+def test_values_used_by_any_expression_of_the_request_count(client):
+    client.update_item(
+        TableName='t', Key={'id': {'S': 'a'}}, UpdateExpression='SET n = :two',
+        ConditionExpression='n = :one', ExpressionAttributeValues={':one': {'N': '1'}, ':two': {'N': '2'}})
+
+
+@pytest.mark.parametrize('expression', ['SET timestamp = :v', 'SET #n = :v, status = :v'])
+def test_reserved_words_must_be_escaped(client, expression):
+    message = validation_message(lambda: client.update_item(
+        TableName='t', Key={'id': {'S': 'a'}}, UpdateExpression=expression,
+        ExpressionAttributeNames={'#n': 'n'} if '#n' in expression else None,
+        ExpressionAttributeValues={':v': {'S': 'x'}}))
+    assert 'reserved keyword' in message
+
+
+def test_escaped_reserved_words_are_accepted(client):
+    client.update_item(
+        TableName='t', Key={'id': {'S': 'a'}}, UpdateExpression='SET #t = :v',
+        ExpressionAttributeNames={'#t': 'timestamp'}, ExpressionAttributeValues={':v': {'S': 'x'}})
+    assert client.get_item(TableName='t', Key={'id': {'S': 'a'}})['Item']['timestamp'] == {'S': 'x'}
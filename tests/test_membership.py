@@ -0,0 +1,88 @@
+import pytest
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    import fanout
+    monkeypatch.setattr(fanout, 'BASE_DELAY', 0.0)
+
+
+def memberships(api, user_id):
+    import check_messages
+    return [item['groupId'] for item in check_messages.memberships_table.query(
+        KeyConditionExpression='userId = :userId',
+        ExpressionAttributeValues={':userId': user_id})['Items']]
+
+
+@pytest.mark.parametrize('members', ['abc', None, [['a']], ['a', 1], ['']])
+def test_create_group_rejects_members_that_are_not_user_ids(api, members):
+    status, payload = api.call('/group', {'groupName': 'g', 'members': members})
+    assert status == 400, payload
+
+
+def test_create_group_reports_memberships_it_could_not_write(api, no_backoff):
+    a, b = api.register('a'), api.register('b')
+    api.client.unprocessed_rate = 1.0
+    status, payload = api.call('/group', {'groupName': 'ab', 'members': [a, b]})
+    assert status == 207, payload
+    assert payload['failedMembers'] == sorted([a, b])
+    assert memberships(api, b) == []
+
+    api.client.unprocessed_rate = 0.0
+    api.ok('/group/add-user', {'groupId': payload['groupId'], 'userId': b})
+    assert memberships(api, b) == [payload['groupId']]
+
+
+def test_removed_member_stops_getting_rows_despite_another_containers_cache(api):
+    import groups
+    a, b, c = api.register('a'), api.register('b'), api.register('c')
+    group_id = api.ok('/group', {'groupName': 'abc', 'members': [a, b, c]})['groupId']
+    api.ok('/group/message', {'senderId': a, 'groupId': group_id, 'content': 'before'}, status=202)
+    cached = groups.group_cache.peek(group_id)
+    assert c in cached['members']
+
+    api.ok('/group/remove-user', {'groupId': group_id, 'userId': c})
+    # A container that sent before the removal still holds the old member set
+    groups.group_cache.put(group_id, cached)
+    api.ok('/group/message', {'senderId': a, 'groupId': group_id, 'content': 'after'}, status=202)
+    api.drain()
+    assert [m['content'] for m in api.ok('/messages', {'userId': c})['messages']] == ['before']
+    assert [m['content'] for m in api.ok('/messages', {'userId': b})['messages']] == ['before', 'after']
+
+
+@pytest.mark.parametrize('members', [['a', 'b'], []])
+def test_add_and_remove_convert_a_legacy_member_list(api, members):
+    import check_messages
+    c = api.register('c')
+    # Groups created before members became a string set
+    check_messages.groups_table.put_item(Item={'groupId': 'legacy', 'groupName': 'old', 'members': members, 'membershipVersion': 1})
+
+    api.ok('/group/add-user', {'groupId': 'legacy', 'userId': c})
+    item = check_messages.groups_table.get_item(Key={'groupId': 'legacy'})['Item']
+    assert item['members'] == set(members) | {c}
+    assert item['membershipVersion'] == 2
+
+    api.ok('/group/remove-user', {'groupId': 'legacy', 'userId': c})
+    if members:
+        check_messages.groups_table.put_item(Item={'groupId': 'legacy', 'groupName': 'old', 'members': members, 'membershipVersion': 3})
+        api.ok('/group/remove-user', {'groupId': 'legacy', 'userId': members[0]})
+        assert check_messages.groups_table.get_item(Key={'groupId': 'legacy'})['Item']['members'] == set(members[1:])
+
+
+def test_ack_does_not_write_back_a_membership_removed_meanwhile(api, monkeypatch):
+    import ack_messages
+    a, b = api.register('a'), api.register('b')
+    group_id = api.ok('/group', {'groupName': 'g', 'members': [a, b]})['groupId']
+    api.ok('/message', {'senderId': a, 'recipientId': b, 'content': 'hi'})
+    watermark = api.ok('/messages', {'userId': b})['watermark']
+    query = ack_messages.memberships_table.query
+
+    def query_then_remove(**kwargs):
+        # /group/remove-user runs between the ack's query and its update
+        result = query(**kwargs)
+        api.ok('/group/remove-user', {'groupId': group_id, 'userId': b})
+        return result
+    monkeypatch.setattr(ack_messages.memberships_table, 'query', query_then_remove)
+
+    assert api.ok('/messages/ack', {'userId': b, 'watermark': watermark})['advanced']
+    assert ack_messages.memberships_table.get_item(Key={'userId': b, 'groupId': group_id}).get('Item') is None
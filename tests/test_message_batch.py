@@ -0,0 +1,14 @@
+def test_batch_counts_and_summaries_follow_from_the_queue_once(api):
+    a, b, c = api.register('a'), api.register('b'), api.register('c')
+    api.queue.duplicate_rate = 1.0
+    result = api.ok('/message/batch', {'senderId': a, 'recipientIds': [b, c], 'content': 'hi'})
+    assert result['sent'] == 2
+    # The rows are written before responding; what follows them is queued
+    assert [m['content'] for m in api.ok('/messages', {'userId': b})['messages']] == ['hi']
+    assert api.ok('/messages/unread-count', {'userId': b})['unread'] == 0
+
+    api.drain()
+    assert api.ok('/messages/unread-count', {'userId': b})['unread'] == 1
+    conversations = api.ok('/conversations', {'userId': a})['conversations']
+    assert sorted(conversation['withUserId'] for conversation in conversations) == sorted([b, c])
+    assert all(conversation['messageCount'] == 1 for conversation in conversations)
@@ -0,0 +1,43 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def records(monkeypatch, capsys):
+    # The EMF records the handlers print, once metrics are on
+    import metrics
+    monkeypatch.setattr(metrics, 'METRICS_ENABLED', True)
+
+    def read():
+        return [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith('{"_aws"')]
+    return read
+
+
+def metric_names(record):
+    return [metric['Name'] for metric in record['_aws']['CloudWatchMetrics'][0]['Metrics']]
+
+
+def test_block_cache_stats_are_in_the_record(api, records):
+    a, b = api.register('a'), api.register('b')
+    records()
+    for _ in range(2):
+        api.ok('/message', {'senderId': a, 'recipientId': b, 'content': 'hi'})
+    first, second = records()
+    assert (first['BlockCacheMisses'], first['BlockCacheHits']) == (1, 0)
+    assert (second['BlockCacheMisses'], second['BlockCacheHits']) == (0, 1)
+    assert second['BlockCacheSize'] == 1
+    assert {'BlockCacheHits', 'BlockCacheSize'} <= set(metric_names(second))
+    assert 'GroupCacheHits' not in second
+
+
+def test_group_cache_stats_are_in_the_record(api, records):
+    a, b = api.register('a'), api.register('b')
+    group_id = api.ok('/group', {'groupName': 'g', 'members': [a, b]})['groupId']
+    records()
+    api.ok('/group/message', {'senderId': a, 'groupId': group_id, 'content': 'hi'}, status=202)
+    api.ok('/group/message', {'senderId': a, 'groupId': group_id, 'content': 'hi'}, status=202)
+    second = records()[-1]
+    # Fan-out-on-write groups are revalidated on every send
+    assert (second['GroupCacheHits'], second['GroupCacheRevalidations']) == (1, 1)
+    assert 'BlockCacheHits' not in second
@@ -0,0 +1,68 @@
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'migrations'))
+
+import reimport_messages  # noqa: E402
+import write_memberships  # noqa: E402
+from common import Table  # noqa: E402
+
+
+def test_reimport_messages_carries_rows_to_the_new_key_schema(api):
+    import check_messages
+    b = api.register('b')
+    # The table as it was keyed before recipientId became its sort key
+    api.client.add_table('legacy-messages', 'messageId')
+    legacy = Table('legacy-messages')
+    for message_id, timestamp in (('f0e1d2c3-0000-4000-8000-000000000000', '2024-01-02'),
+                                  ('0a1b2c3d-0000-4000-8000-000000000000', '2024-01-03')):
+        legacy.put_item(Item={'messageId': message_id, 'senderId': 'a', 'recipientId': b,
+                              'content': timestamp, 'timestamp': timestamp})
+    legacy.put_item(Item={'messageId': 'no-recipient', 'senderId': 'a', 'content': 'orphan'})
+
+    lines = io.StringIO()
+    assert reimport_messages.export_rows(legacy, lines) == 3
+    lines.seek(0)
+    assert reimport_messages.import_rows(check_messages.messages_table, lines) == (2, 0, 1)
+
+    page = api.ok('/messages', {'userId': b})
+    assert [m['content'] for m in page['messages']] == ['2024-01-02', '2024-01-03']
+    api.ok('/message', {'senderId': 'a', 'recipientId': b, 'content': 'new'})
+    assert [m['content'] for m in api.ok('/messages', {'userId': b, 'since': page['watermark']})['messages']] == ['new']
+
+
+def test_write_memberships_moves_old_groups_to_fan_out_on_read(api, monkeypatch):
+    import send_group_message
+    monkeypatch.setattr(send_group_message, 'FANOUT_ON_READ_MIN_MEMBERS', 3)
+    a, b, c = api.register('a'), api.register('b'), api.register('c')
+    # A group as the first create_group stored it: a member list and nothing else
+    send_group_message.groups_table.put_item(Item={'groupId': 'old', 'groupName': 'old', 'members': [a, b, c]})
+    tables = (send_group_message.groups_table, Table(os.environ['MEMBERSHIPS_TABLE_NAME']))
+
+    assert api.ok('/group/message', {'senderId': a, 'groupId': 'old', 'content': 'before'}, status=202)['fanout'] == 'queued'
+    api.drain()
+    assert write_memberships.write_memberships(*tables) == (1, 3)
+    assert write_memberships.write_memberships(*tables) == (0, 0)
+    assert api.ok('/group/message', {'senderId': a, 'groupId': 'old', 'content': 'after'})['fanout'] == 'read'
+    assert [m['content'] for m in api.ok('/messages', {'userId': b})['messages']] == ['before', 'after']
+
+
+def test_write_memberships_drops_rows_of_users_removed_meanwhile(api):
+    import send_group_message
+    a, b = api.register('a'), api.register('b')
+    groups_table = send_group_message.groups_table
+    memberships_table = Table(os.environ['MEMBERSHIPS_TABLE_NAME'])
+    groups_table.put_item(Item={'groupId': 'old', 'groupName': 'old', 'members': [a, b]})
+    first, second = sorted((a, b))
+    update_item = memberships_table.update_item
+
+    def remove_second_after_first_row(**kwargs):
+        # The second member leaves once the migration has written the first row
+        update_item(**kwargs)
+        del memberships_table.update_item
+        api.ok('/group/remove-user', {'groupId': 'old', 'userId': second})
+    memberships_table.update_item = remove_second_after_first_row
+
+    assert write_memberships.write_group(groups_table, memberships_table, 'old') == 1
+    assert [row['userId'] for row in memberships_table.scan()['Items']] == [first]
@@ -0,0 +1,39 @@
+def test_queued_group_message_survives_watermark_and_ack(api):
+    a, b, c = api.register('a'), api.register('b'), api.register('c')
+    group_id = api.ok('/group', {'groupName': 'ab', 'members': [a, b]})['groupId']
+
+    # The group send is queued; the DM that follows it lands in B's inbox first
+    sent = api.ok('/group/message', {'senderId': a, 'groupId': group_id, 'content': 'to the group'}, status=202)
+    dm = api.ok('/message', {'senderId': c, 'recipientId': b, 'content': 'direct'})
+    assert len(api.queue) > 0
+
+    first = api.ok('/messages', {'userId': b})
+    assert [m['content'] for m in first['messages']] == ['direct']
+    watermark = first['watermark']
+    assert watermark == dm['messageId']
+
+    api.drain()
+    assert len(api.queue) == 0
+
+    since = api.ok('/messages', {'userId': b, 'since': watermark})
+    assert [m['messageId'] for m in since['messages']] == [sent['messageId']]
+    assert api.ok('/messages/unread-count', {'userId': b})['unread'] == 2
+
+    # Acking the first watermark leaves the queued message unread
+    api.ok('/messages/ack', {'userId': b, 'watermark': watermark})
+    full = api.ok('/messages', {'userId': b})
+    assert [m['content'] for m in full['messages']] == ['to the group']
+    assert api.ok('/messages/unread-count', {'userId': b})['unread'] == 1
+
+    api.ok('/messages/ack', {'userId': b, 'watermark': since['watermark']})
+    assert api.ok('/messages', {'userId': b})['messages'] == []
+    assert api.ok('/messages/unread-count', {'userId': b})['unread'] == 0
+
+
+def test_redelivered_job_does_not_duplicate_rows(api):
+    a, b = api.register('a'), api.register('b')
+    group_id = api.ok('/group', {'groupName': 'ab', 'members': [a, b]})['groupId']
+    api.queue.duplicate_rate = 1.0
+    api.ok('/group/message', {'senderId': a, 'groupId': group_id, 'content': 'once'}, status=202)
+    api.drain()
+    assert [m['content'] for m in api.ok('/messages', {'userId': b})['messages']] == ['once']
@@ -0,0 +1,80 @@
+import pytest
+
+from local.dynamodb import ClientError
+
+
+def unread_count(api, user_id):
+    return api.ok('/messages/unread-count', {'userId': user_id})
+
+
+def test_counts_are_spread_over_rows_and_summed(api):
+    import unread
+    a, b, c = api.register('a'), api.register('b'), api.register('c')
+    for i in range(20):
+        api.ok('/message', {'senderId': a if i % 2 else c, 'recipientId': b, 'content': f'm{i}'})
+    rows = unread.get_rows(b)
+    assert len(rows) > 1 and b not in [row['userId'] for row in rows]
+    result = unread_count(api, b)
+    assert result['unread'] == 20
+    assert sorted(entry['unread'] for entry in result['conversations']) == [10, 10]
+
+    watermark = api.ok('/messages', {'userId': b, 'limit': 100})['watermark']
+    api.ok('/messages/ack', {'userId': b, 'watermark': watermark})
+    assert unread_count(api, b) == {'userId': b, 'unread': 0, 'conversations': []}
+
+
+def test_subtract_takes_from_every_row_including_the_bare_key(api):
+    import unread
+    a, b = api.register('a'), api.register('b')
+    # Counts from before the rows were sharded are on the bare key
+    unread.add(b, {f'user#{a}': 2})
+    unread.record([(b, f'user#{a}')] * 3)
+    assert unread.get_counters(b) == ({f'user#{a}': 5}, 5)
+    unread.subtract(b, {f'user#{a}': 4})
+    assert unread.get_counters(b) == ({f'user#{a}': 1}, 1)
+    # More than is held is taken only down to zero
+    unread.subtract(b, {f'user#{a}': 3})
+    assert unread.get_counters(b) == ({}, 0)
+
+
+@pytest.fixture
+def invocation(monkeypatch):
+    import metrics
+    invocation = metrics.Invocation('test', False)
+    monkeypatch.setattr(metrics, '_current', invocation)
+    return invocation
+
+
+def throttle(monkeypatch, calls):
+    # Makes the first `calls` counter updates fail as throttled
+    import unread
+    add = unread.add
+    failures = []
+
+    def throttled_add(shard, counts):
+        if len(failures) < calls:
+            failures.append(shard)
+            raise ClientError('ProvisionedThroughputExceededException', 'Rate exceeded', 'UpdateItem')
+        add(shard, counts)
+    monkeypatch.setattr(unread, 'add', throttled_add)
+    return failures
+
+
+def test_throttled_increment_moves_to_another_row(api, monkeypatch, invocation):
+    import unread
+    a, b = api.register('a'), api.register('b')
+    failures = throttle(monkeypatch, unread.INCREMENT_ATTEMPTS - 1)
+    unread.record([(b, f'user#{a}')])
+    assert len(failures) == unread.INCREMENT_ATTEMPTS - 1
+    assert unread.get_counters(b) == ({f'user#{a}': 1}, 1)
+    assert 'UnreadCountErrors' not in invocation.counts
+
+
+def test_lost_increments_are_counted(api, monkeypatch, invocation):
+    import unread
+    a, b = api.register('a'), api.register('b')
+    throttle(monkeypatch, unread.INCREMENT_ATTEMPTS)
+    unread.record([(b, f'user#{a}')])
+    assert unread.get_counters(b) == ({}, 0)
+    assert invocation.counts == {'UnreadCountErrors': 1}
+    assert {'Name': 'UnreadCountErrors', 'Unit': 'Count'} in invocation.record(200, None)['_aws']['CloudWatchMetrics'][0]['Metrics']
@@ -0,0 +1,76 @@
+import base64
+import json
+
+import pytest
+
+
+@pytest.mark.parametrize('resource', ['/messages', '/conversations'])
+@pytest.mark.parametrize('limit', [None, [1], {}, 'ten', 0, 1000])
+def test_bad_limit_is_a_400(api, resource, limit):
+    user_id = api.register('a')
+    status, payload = api.call(resource, {'userId': user_id, 'limit': limit})
+    assert status == 400, payload
+
+
+@pytest.mark.parametrize('resource', ['/messages', '/conversations'])
+def test_non_string_next_token_is_a_400(api, resource):
+    user_id = api.register('a')
+    status, payload = api.call(resource, {'userId': user_id, 'nextToken': 5})
+    assert status == 400, payload
+
+
+@pytest.mark.parametrize('since', ['abc', 5, ['01M56NY7EEJTXMF9KG9WMQ8Z23'], '01M56NY7EEJTXMF9KG9WMQ8Z2', '2024-13-01T00:00:00.000Z'])
+def test_bad_since_is_a_400(api, since):
+    status, payload = api.call('/messages', {'userId': api.register('a'), 'since': since})
+    assert status == 400, payload
+
+
+def test_since_accepts_watermarks_and_timestamps(api):
+    user_id = api.register('a')
+    api.ok('/messages', {'userId': user_id, 'since': '01M56NY7EEJTXMF9KG9WMQ8Z23'})
+    api.ok('/messages', {'userId': user_id, 'since': '2024-05-01T12:00:00.123Z'})
+
+
+def token(cursor):
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode('utf-8')).decode('ascii')
+
+
+@pytest.mark.parametrize('cursor', [
+    {'positions': 'inbox'},
+    {'positions': {'inbox': 5}},
+    {'positions': {'inbox': {'messageId': 'm', 'recipientId': 'USER'}}},
+    {'positions': {'inbox': {'messageId': 'm', 'recipientId': 'someone-else', 'inboxKey': '01M56NY7EEJTXMF9KG9WMQ8Z23'}}},
+    {'positions': {'group-1': {'messageId': 'm'}}},
+    {'positions': {}, 'done': 5},
+    {'positions': {}, 'done': [['inbox']]},
+])
+def test_malformed_message_cursor_is_a_400(api, cursor):
+    user_id = api.register('a')
+    cursor = json.loads(json.dumps(cursor).replace('USER', user_id))
+    status, payload = api.call('/messages', {'userId': user_id, 'nextToken': token(dict(cursor, userId=user_id))})
+    assert status == 400, payload
+
+
+def test_message_cursor_round_trips(api):
+    a, b = api.register('a'), api.register('b')
+    for i in range(3):
+        api.ok('/message', {'senderId': a, 'recipientId': b, 'content': f'm{i}'})
+    page = api.ok('/messages', {'userId': b, 'limit': 2})
+    assert len(api.ok('/messages', {'userId': b, 'limit': 2, 'nextToken': page['nextToken']})['messages']) == 1
+
+
+@pytest.mark.parametrize('body', [
+    {'recipientIds': [['b']], 'content': 'hi'},
+    {'recipientIds': [{'id': 'b'}], 'content': 'hi'},
+    {'recipientIds': [1], 'content': 'hi'},
+    {'messages': [{'recipientId': None, 'content': 'hi'}]},
+])
+def test_batch_rejects_recipient_ids_that_are_not_strings(api, body):
+    status, payload = api.call('/message/batch', dict(body, senderId=api.register('a')))
+    assert status == 400, payload
+
+
+@pytest.mark.parametrize('resource', ['/conversations', '/messages/unread-count'])
+def test_missing_user_id_is_a_400(api, resource):
+    status, payload = api.call(resource, {})
+    assert status == 400, payload